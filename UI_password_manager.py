@@ -2,32 +2,276 @@ import flet as ft
 import os
 import password_manager_core
 import time
+import math
+import asyncio
 import secrets
 import threading
-import configparser
-import csv
-import io
+import atexit
+import contextlib
+
+
+# 一覧の 1 件分の行の高さ（固定）。スクロール位置から表示範囲を計算するために使う
+PASSWORD_ROW_HEIGHT = 200
+# アイドルタイムアウトで鍵が消去されたかを確認する間隔（秒）
+SESSION_WATCH_INTERVAL = 1.0
+
+
+class VirtualizedListView:
+    """
+    表示範囲と前後の少しの余裕（overscan）の行だけコントロールを生成する ListView。
+    行の高さを固定とし、表示範囲外の行はその分の高さを持つ空白で置き換える。
+    作成済みの行はレコードごとに再利用する。inserted / updated / removed の変更通知では、
+    表示範囲のコントロールに対して該当する行だけを差し込み・置き換え・取り除く。
+    """
+
+    def __init__(self, items, build_row, row_height, empty_message, overscan=5):
+        self.items = items
+        self.build_row = build_row
+        self.row_height = row_height
+        self.overscan = overscan
+        self.empty_text = ft.Text(empty_message, color=ft.Colors.GREY)
+        self.top_spacer = ft.Container(height=0)
+        self.bottom_spacer = ft.Container(height=0)
+        self.list_view = ft.ListView(
+            expand=True,
+            spacing=0,
+            padding=10,
+            on_scroll=self._on_scroll,
+            on_scroll_interval=50,
+        )
+        self._first_visible = 0
+        self._visible_rows = 8
+        self._window = None
+        self._rows = {}  # id(レコード) -> (レコード, 行コントロール)
+        self._render()
+
+    def set_items(self, items):
+        """表示するレコードのリストを差し替える（検索結果の表示など）"""
+        self.items = items
+        self._first_visible = 0
+        self._render(force=True)
+
+    def inserted(self, index):
+        """items の index にレコードが挿入されたことを通知する（表示範囲の行だけを差し込む）"""
+        if not self._can_patch():
+            return self._render(force=True)
+        start, end, _ = self._window
+        if index < end:
+            # 表示範囲より前に挿入された場合は、表示範囲の先頭に 1 行ずれて入ってくる
+            pos = max(index, start)
+            self.list_view.controls.insert(
+                pos - start + 1, self._row_for(self.items[pos])
+            )
+        self._patched(start)
+
+    def updated(self, index):
+        """items の index のレコードが差し替えられたことを通知する（その行だけを作り直す）"""
+        if not self._can_patch():
+            return self._render(force=True)
+        start, end, _ = self._window
+        if start <= index < end:
+            self.list_view.controls[index - start + 1] = self._row_for(
+                self.items[index]
+            )
+        self._patched(start)
+
+    def removed(self, index):
+        """items の index のレコードが削除されたことを通知する（その行だけを取り除く）"""
+        if not self._can_patch():
+            return self._render(force=True)
+        start, end, _ = self._window
+        if index < end:
+            # 表示範囲より前で削除された場合は、表示範囲の先頭の行が範囲の外へずれる
+            self.list_view.controls.pop(max(index, start) - start + 1)
+        self._patched(start)
+
+    def refresh(self, item):
+        """レコードそのものは同じまま表示内容が変わった行を作り直す"""
+        self._rows.pop(id(item), None)
+        if not self._can_patch():
+            return self._render(force=True)
+        start, end, _ = self._window
+        for index in range(start, end):
+            if self.items[index] is item:
+                self.list_view.controls[index - start + 1] = self._row_for(item)
+        self._patched(start)
+
+    def _can_patch(self):
+        """
+        表示中の行を差分で更新できるか（空の一覧の表示との切り替えや、
+        表示範囲の先頭が末尾を越える場合は、作り直す）
+        """
+        if self._window is None or self._window[2] == 0 or not self.items:
+            return False
+        return self._window[0] < len(self.items)
+
+    def _patched(self, start):
+        """
+        行を差し込み・取り除いた後に、表示範囲の末尾の行数と空白の高さを合わせて送信する。
+        件数が 1 件増減するため、末尾で増減するのは高々 1 行。
+        """
+        count = len(self.items)
+        end = min(self._first_visible + self._visible_rows + self.overscan, count)
+        controls = self.list_view.controls
+        while len(controls) - 2 > end - start:
+            controls.pop(-2)
+        while len(controls) - 2 < end - start:
+            controls.insert(-1, self._row_for(self.items[start + len(controls) - 2]))
+        self._rows = {
+            id(item): (item, row)
+            for item, row in zip(self.items[start:end], controls[1:-1])
+        }
+        self._window = (start, end, count)
+        self.top_spacer.height = start * self.row_height
+        self.bottom_spacer.height = (count - end) * self.row_height
+        if self.list_view.page is not None:
+            self.list_view.update()
+
+    def _row_for(self, item):
+        """作成済みの行があれば再利用し、なければ作成する"""
+        cached = self._rows.get(id(item))
+        if cached is not None and cached[0] is item:
+            return cached[1]
+        return self._wrap(self.build_row(item))
+
+    def visible_items(self):
+        """現在描画している範囲（overscan を含む）のレコードを返す"""
+        if self._window is None:
+            return []
+        start, end, _ = self._window
+        return self.items[start:end]
+
+    def _on_scroll(self, e):
+        if e.pixels is None:
+            return
+        self._first_visible = max(int(e.pixels // self.row_height), 0)
+        if e.viewport_dimension:
+            self._visible_rows = int(e.viewport_dimension // self.row_height) + 1
+        self._render()
+
+    def _render(self, force=False):
+        count = len(self.items)
+        start = max(self._first_visible - self.overscan, 0)
+        end = min(self._first_visible + self._visible_rows + self.overscan, count)
+        if not force and self._window == (start, end, count):
+            return
+        self._window = (start, end, count)
 
+        if count == 0:
+            self._rows = {}
+            self.list_view.controls = [self.empty_text]
+        else:
+            rows = {}
+            controls = [self.top_spacer]
+            for item in self.items[start:end]:
+                row = self._row_for(item)
+                rows[id(item)] = (item, row)
+                controls.append(row)
+            controls.append(self.bottom_spacer)
+            self._rows = rows
+            self.top_spacer.height = start * self.row_height
+            self.bottom_spacer.height = (count - end) * self.row_height
+            self.list_view.controls = controls
+
+        if self.list_view.page is not None:
+            self.list_view.update()
+
+    def _wrap(self, row):
+        return ft.Container(content=row, height=self.row_height)
+
+
+class ClipboardExpiryTimer:
+    """
+    クリップボードを一定時間後にクリアするタイマー。
+    期限は 1 つだけ持ち、コピーのたびにスレッドを作るのではなく期限を延長する。
+    カウントダウン中は 1 秒ごとに表示用のコントロールだけを更新する。
+    """
+
+    def __init__(self, page, counters, delay_seconds=10):
+        self.page = page
+        self.counters = counters
+        self.delay_seconds = delay_seconds
+        self._deadline = None
+        self._future = None
+        self._lock = threading.Lock()
+
+    def start(self, delay_seconds=None):
+        """期限を今から delay_seconds 秒後に設定する（実行中のカウントダウンはそのまま延長される）"""
+        if delay_seconds is None:
+            delay_seconds = self.delay_seconds
+        with self._lock:
+            self._deadline = time.monotonic() + delay_seconds
+            if self._future is None:
+                self._future = self.page.run_task(self._run)
+
+    def cancel(self, clear_clipboard=True):
+        """カウントダウンを止める。clear_clipboard が True ならその場でクリップボードをクリアする"""
+        with self._lock:
+            pending = self._deadline is not None
+            self._deadline = None
+            if self._future is not None:
+                self._future.cancel()
+                self._future = None
+            if pending and clear_clipboard:
+                try:
+                    self.page.set_clipboard("")
+                except Exception:
+                    pass
+
+    async def _run(self):
+        while True:
+            with self._lock:
+                if self._deadline is None:
+                    return
+                remaining = self._deadline - time.monotonic()
+                if remaining <= 0:
+                    # 期限切れの判定とクリアを同じロック内で行い、直後の新しいコピーを消さない
+                    self._deadline = None
+                    self._future = None
+                    self.page.set_clipboard("")
+                    break
+            seconds = math.ceil(remaining)
+            self._show(f"クリップボードクリアまでの時間: {seconds}秒")
+            # 表示している秒数が変わる時点まで待つ（期限が延長されても次の tick で反映される）
+            await asyncio.sleep(remaining - (seconds - 1))
+        self._show("クリップボードをクリアしました")
+
+    def _show(self, message):
+        attached = []
+        for counter in self.counters:
+            counter.value = message
+            if counter.page is not None:
+                attached.append(counter)
+        if attached:
+            try:
+                self.page.update(*attached)
+            except Exception:
+                pass
 
-async def main_ui(page: ft.Page, master_password: str):
-    page.title = "パスワードマネージャー"
-    page.vertical_alignment = ft.MainAxisAlignment.START
 
-    # --- アプリケーションの状態管理 ---
-    # メモリ上に全パスワード情報を保持するリスト
-    all_passwords = []
+async def main_ui(
+    page: ft.Page,
+    session: password_manager_core.VaultSession,
+    all_passwords: password_manager_core.PasswordStore,
+    search_index: password_manager_core.PasswordSearchIndex = None,
+    on_lock=None,
+    lease=None,
+):
+    """
+    パスワード管理UIを表示する。
+    session はアンロック済みのセッション、all_passwords は復号済みの全データ
+    （メモリ上に全パスワード情報を保持するリポジトリ）、search_index は all_passwords の検索インデックス。
+    on_lock() はセッションがアイドルタイムアウトでロックされたときに呼ばれる（ロック画面に戻す）。
+    lease は acquire_vault_lease() で取った保管庫のリースで、ロックしたときに解放する
+    （開いている間はコマンドライン版からの書き込みを止める）。
+    """
+    if search_index is None:
+        search_index = password_manager_core.PasswordSearchIndex(all_passwords)
+    # TOTP のシークレットは一度だけ検証・デコードし、コードは時間枠ごとにまとめて計算する
+    totp_engine = password_manager_core.TotpEngine()
 
-    # UIの初期化時に、マスターパスワードで復号して全データを読み込む
-    try:
-        all_passwords = password_manager_core.get_decrypted_passwords(master_password)
-    except Exception as e:
-        page.add(
-            ft.Text(
-                f"エラー: パスワードファイルの読み込みに失敗しました: {e}",
-                color=ft.Colors.RED,
-            )
-        )
-        return
+    page.title = "パスワードマネージャー"
+    page.vertical_alignment = ft.MainAxisAlignment.START
 
     password_notice = ft.Text(
         "最小長さ～最大長さの範囲でランダムで生成されます。"
@@ -42,144 +286,170 @@ async def main_ui(page: ft.Page, master_password: str):
     error_message_tab3 = ft.Text(color=ft.Colors.RED)
     time_counter_tab3 = ft.Text()
 
-    clipboard_clear_thread = None
+    def show_save_error(e):
+        msg = f"エラー: 保存に失敗しました: {e}"
+        error_message.value = msg
+        error_message_tab2.value = msg
+        page.update()
 
-    password_list_view = ft.ListView(expand=True, spacing=10, padding=10)
+    # settings.ini で journal が選ばれている場合は、変更ごとにジャーナルへ追記する。
+    # それ以外は書き込みスレッドが連続した変更をまとめてアトミックに書き込む。
+    journal = None
+    writer = None
+    if password_manager_core.load_storage_mode_from_config() == "journal":
+        journal = password_manager_core.VaultJournal(session)
+    else:
+        writer = password_manager_core.BackgroundVaultWriter(
+            session, on_error=show_save_error
+        )
 
     def save_all_passwords_to_file():
-        """メモリ上のall_passwordsを暗号化してファイルにアトミックに保存する（CSV形式、totp_secret含む）"""
+        """
+        メモリ上のall_passwordsを暗号化してファイルにアトミックに保存する（バイナリ形式、totp_secret含む）。
+        書き込みはバックグラウンドで行われ、エラーは show_save_error で通知される。
+        """
         try:
-            buf = io.StringIO()
-            writer = csv.writer(buf)
-            for p in all_passwords:
-                writer.writerow(
-                    [
-                        p.get("service_name", ""),
-                        p.get("username", ""),
-                        p.get("password", ""),
-                        p.get("totp_secret", ""),
-                    ]
-                )
-            content_string = buf.getvalue()
-            content_bytes = content_string.encode("utf-8")
-            password_manager_core.encrypt_password_file(content_bytes, master_password)
+            content_bytes = password_manager_core.serialize_passwords(all_passwords)
+            writer.submit(content_bytes)
             return True
         except Exception as e:
-            msg = f"エラー: 保存に失敗しました: {e}"
-            error_message.value = msg
-            error_message_tab2.value = msg
-            page.update()
+            show_save_error(e)
+            return False
+
+    def store_transaction():
+        """
+        all_passwords の変更と persist_change() を続けて行う範囲。ジャーナルモードでは
+        コンパクション用の直列化が、変更済みで未追記の状態を読まないようにする。
+        """
+        if journal is None:
+            return contextlib.nullcontext()
+        return journal.transaction()
+
+    def persist_change(op, idx=0, record=None):
+        """
+        1 件の変更を保存する（store_transaction() の中で呼ぶ）。ジャーナルモードでは変更分だけを追記し、
+        閾値を超えたらバックグラウンドでスナップショットへ畳み込む。
+        """
+        if journal is None:
+            return save_all_passwords_to_file()
+        try:
+            journal.append(op, idx, record)
+            if journal.needs_compaction():
+                journal.compact_in_background(*journal.snapshot(all_passwords))
+            return True
+        except Exception as e:
+            show_save_error(e)
             return False
 
-    def refresh_password_list():
-        """メモリ上のall_passwordsを元にパスワードリストUIを更新"""
-        password_list_view.controls.clear()
-        if not all_passwords:
-            password_list_view.controls.append(
-                ft.Text("登録されたパスワードはありません。", color=ft.Colors.GREY)
+    def build_password_row(p):
+        """1 件分の行（サービス名・ユーザー名・パスワード・TOTP）のコントロールを作成する"""
+        service_text = ft.Text(f"サービス名: {p.service_name}")
+        username_text = ft.Text(
+            f"ユーザー名: {p.username}",
+            color=ft.Colors.BLUE,
+            weight=ft.FontWeight.BOLD,
+        )
+        username_detector = ft.GestureDetector(
+            content=username_text,
+            on_tap=lambda e, user=p.username: on_double_click(user),
+        )
+        password_text = ft.Text(
+            f"パスワード: {'*' * len(p.password)}",
+            color=ft.Colors.RED,
+            weight=ft.FontWeight.BOLD,
+        )
+        password_detector = ft.GestureDetector(
+            content=password_text,
+            on_tap=lambda e, sealed=p.password: copy_secret(sealed),
+        )
+        menu_button = ft.PopupMenuButton(
+            icon=ft.Icons.MORE_VERT,
+            tooltip="メニュー",
+            items=[
+                ft.PopupMenuItem(
+                    text="編集",
+                    icon=ft.Icons.EDIT,
+                    on_click=lambda e, item=p: open_edit_dialog(item),
+                ),
+                ft.PopupMenuItem(
+                    text="削除",
+                    icon=ft.Icons.DELETE,
+                    on_click=lambda e, item=p: open_delete_dialog(item),
+                ),
+            ],
+        )
+
+        # TOTP 表示: 一覧表示ではシークレットを復号せず、レコードに保存された妥当性だけを見る
+        if p.totp_secret and p.totp_valid is False:
+            totp_row = ft.Row(
+                controls=[
+                    ft.Text("TOTP: 無効なシークレット", color=ft.Colors.RED),
+                    ft.ElevatedButton(text="コードをコピー", disabled=True),
+                ],
+                spacing=10,
+            )
+        elif p.totp_secret:
+            totp_row = ft.Row(
+                controls=[
+                    ft.Text("TOTP: ", weight=ft.FontWeight.BOLD),
+                    ft.ElevatedButton(
+                        text="コードをコピー",
+                        on_click=lambda e, item=p: copy_totp_code(item),
+                    ),
+                ],
+                spacing=10,
             )
         else:
-            for idx, p in enumerate(all_passwords):
-                # (UIコンポーネントの作成ロジックは変更なし)
-                service_text = ft.Text(f"サービス名: {p['service_name']}")
-                username_text = ft.Text(
-                    f"ユーザー名: {p['username']}",
-                    color=ft.Colors.BLUE,
-                    weight=ft.FontWeight.BOLD,
-                )
-                username_detector = ft.GestureDetector(
-                    content=username_text,
-                    on_tap=lambda e, user=p["username"]: on_double_click(user),
-                )
-                password_text = ft.Text(
-                    f"パスワード: {'*' * len(p['password'])}",
-                    color=ft.Colors.RED,
-                    weight=ft.FontWeight.BOLD,
-                )
-                password_detector = ft.GestureDetector(
-                    content=password_text,
-                    on_tap=lambda e, pwd=p["password"]: on_double_click(pwd),
-                )
-                menu_button = ft.PopupMenuButton(
-                    icon=ft.Icons.MORE_VERT,
-                    tooltip="メニュー",
-                    items=[
-                        ft.PopupMenuItem(
-                            text="編集",
-                            icon=ft.Icons.EDIT,
-                            on_click=lambda e, i=idx, item=p: open_edit_dialog(i, item),
-                        ),
-                        ft.PopupMenuItem(
-                            text="削除",
-                            icon=ft.Icons.DELETE,
-                            on_click=lambda e, i=idx, item=p: open_delete_dialog(
-                                i, item
-                            ),
-                        ),
-                    ],
-                )
-                password_list_view.controls.append(service_text)
-                password_list_view.controls.append(
-                    ft.Row(
-                        controls=[username_detector, menu_button],
-                        alignment=ft.MainAxisAlignment.SPACE_BETWEEN,
-                    )
-                )
-                password_list_view.controls.append(password_detector)
-
-                # TOTP 表示: シークレットが設定されていればコードを生成してコピーできる
-                totp_secret = p.get("totp_secret", "")
-
-                def make_copy_totp(secret):
-                    def _handler(e):
-                        try:
-                            code = password_manager_core.generate_totp_code(secret)
-                            page.set_clipboard(code)
-                            clear_clipboard_sync(code, 10)
-                        except Exception as ex:
-                            error_message_tab2.value = (
-                                f"TOTP の生成に失敗しました: {ex}"
-                            )
-                            page.update()
-
-                    return _handler
-
-                if totp_secret:
-                    # シークレットの妥当性を確認して表示を決める（無効なら例外を捕捉して無効表示）
-                    try:
-                        code = password_manager_core.generate_totp_code(totp_secret)
-                        totp_row = ft.Row(
-                            controls=[
-                                ft.Text("TOTP: ", weight=ft.FontWeight.BOLD),
-                                ft.ElevatedButton(
-                                    text="コードをコピー",
-                                    on_click=make_copy_totp(totp_secret),
-                                ),
-                            ],
-                            spacing=10,
-                        )
-                    except Exception:
-                        # 無効なシークレット
-                        totp_row = ft.Row(
-                            controls=[
-                                ft.Text("TOTP: ", weight=ft.FontWeight.BOLD),
-                                ft.Text("無効なシークレット", color=ft.Colors.GREY),
-                                ft.ElevatedButton(text="コードをコピー", disabled=True),
-                            ],
-                            spacing=10,
-                        )
-                else:
-                    totp_row = ft.Row(
-                        controls=[
-                            ft.Text("TOTP: 未設定", color=ft.Colors.GREY),
-                            ft.ElevatedButton(text="コードをコピー", disabled=True),
-                        ],
-                        spacing=10,
-                    )
+            totp_row = ft.Row(
+                controls=[
+                    ft.Text("TOTP: 未設定", color=ft.Colors.GREY),
+                    ft.ElevatedButton(text="コードをコピー", disabled=True),
+                ],
+                spacing=10,
+            )
 
-                password_list_view.controls.append(totp_row)
-                password_list_view.controls.append(ft.Divider())
-        page.update()
+        return ft.Column(
+            controls=[
+                service_text,
+                ft.Row(
+                    controls=[username_detector, menu_button],
+                    alignment=ft.MainAxisAlignment.SPACE_BETWEEN,
+                ),
+                password_detector,
+                totp_row,
+                ft.Divider(),
+            ],
+            spacing=10,
+        )
+
+    # 表示範囲の行だけを生成する一覧。all_passwords を変更したら
+    # inserted / updated / removed で通知すると、変わった行だけが作り直される。
+    password_list = VirtualizedListView(
+        all_passwords,
+        build_password_row,
+        row_height=PASSWORD_ROW_HEIGHT,
+        empty_message="登録されたパスワードはありません。",
+    )
+    password_list_view = password_list.list_view
+
+    # ========== 検索 ==========
+    def apply_search():
+        """検索ボックスの内容で一覧を絞り込む（空なら全件）"""
+        query = search_input.value or ""
+        if query.strip():
+            password_list.set_items(search_index.search(query))
+        else:
+            password_list.set_items(all_passwords)
+
+    def is_searching():
+        return bool((search_input.value or "").strip())
+
+    search_input = ft.TextField(
+        label="検索（サービス名・ユーザー名）",
+        prefix_icon=ft.Icons.SEARCH,
+        on_change=lambda e: apply_search(),
+        width=400,
+    )
 
     # ========== タブ1: パスワード生成 ==========
     service_name_input = ft.TextField(label="タイトル", width=400)
@@ -229,55 +499,140 @@ async def main_ui(page: ft.Page, master_password: str):
             page.update()
             return
 
-        all_passwords.append(
-            {
-                "service_name": service_name,
-                "username": username,
-                "password": password,
-                "totp_secret": "",
-            }
+        new_record = password_manager_core.PasswordRecord(
+            service_name, username, session.seal(password)
         )
-        if save_all_passwords_to_file():
+        with store_transaction():
+            new_index = all_passwords.add(new_record)
+            saved = persist_change(
+                password_manager_core.JOURNAL_OP_ADD, new_index, new_record
+            )
+        search_index.add(new_record)
+        if saved:
             msg = "パスワードを保存しました。"
             error_message.value = msg
             error_message_tab2.value = msg
-            refresh_password_list()  # 保存後にリストを更新
+            if is_searching():
+                apply_search()
+            else:
+                password_list.inserted(new_index)  # 追加した行だけを描画
         page.update()
 
     # ========== タブ2: 登録したパスワード ==========
     def on_double_click(text):
-        nonlocal clipboard_clear_thread
         page.set_clipboard(text)
-        clipboard_clear_thread = clear_clipboard_sync(text, 10)
+        clipboard_timer.start()
 
-    def open_edit_dialog(idx, item):
-        service_edit = ft.TextField(value=item["service_name"], label="サービス名")
-        username_edit = ft.TextField(value=item["username"], label="ユーザー名")
+    def copy_secret(sealed_secret):
+        """暗号化されたままのシークレットを、コピーする時点で復号してコピーする"""
+        try:
+            on_double_click(session.reveal(sealed_secret))
+        except Exception as ex:
+            error_message_tab2.value = f"エラー: パスワードの復号に失敗しました: {ex}"
+            page.update()
+
+    def prepare_totp(record):
+        """
+        レコードの TOTP シークレットを復号して検証し、デコード済みの鍵をエンジンに登録する。
+        検証結果はレコードに保存され、以降の一覧表示や保存で再検証しない。
+        """
+        sealed = record.totp_secret
+        if not sealed:
+            return False
+        if not totp_engine.is_prepared(sealed):
+            record.totp_valid = totp_engine.prepare(sealed, session.reveal(sealed))
+        return totp_engine.is_valid(sealed)
+
+    # 表示中の行について計算した TOTP コードの時間枠（時間枠が変わるまで使い回す）
+    totp_window = None
+
+    def visible_totp_window(item, now):
+        """
+        表示中のエントリのコードを、時間枠ごとに 1 回だけ totp_engine.window() でまとめて計算する。
+        シークレットの復号・デコードは TotpEngine にキャッシュされるため、各エントリにつき 1 回だけ。
+        """
+        nonlocal totp_window
+        counter = int(now // totp_engine.interval)
+        if (
+            totp_window is None
+            or totp_window.counter != counter
+            or item.totp_secret not in totp_window.codes
+        ):
+            visible = [r for r in password_list.visible_items() if r.totp_secret]
+            for record in visible:
+                prepare_totp(record)
+            totp_window = totp_engine.window(
+                [r.totp_secret for r in visible] + [item.totp_secret], for_time=now
+            )
+        return totp_window
+
+    def copy_totp_code(item):
+        """表示中のエントリのコードを現在の時間枠でまとめて計算し、選択したコードをコピーする"""
+        try:
+            if not prepare_totp(item):
+                error_message_tab2.value = "エラー: TOTP シークレットキーが不正です。"
+                password_list.refresh(item)
+                page.update()
+                return
+            now = time.time()
+            window = visible_totp_window(item, now)
+            on_double_click(window.codes[item.totp_secret])
+            remaining = totp_engine.interval - now % totp_engine.interval
+            error_message_tab2.value = (
+                f"TOTP コードをコピーしました（有効期限まで {int(remaining)}秒）"
+            )
+        except Exception as ex:
+            error_message_tab2.value = f"TOTP の生成に失敗しました: {ex}"
+        page.update()
+
+    def open_edit_dialog(item):
+        service_edit = ft.TextField(value=item.service_name, label="サービス名")
+        username_edit = ft.TextField(value=item.username, label="ユーザー名")
         password_edit = ft.TextField(
-            value=item["password"],
+            value=session.reveal(item.password),
             label="パスワード",
             password=True,
             can_reveal_password=True,
         )
 
         totp_edit = ft.TextField(
-            value=item.get("totp_secret", ""),
+            value=session.reveal(item.totp_secret),
             label="TOTP シークレットキー (任意)",
             width=400,
         )
 
         def on_save_edit(save_e):
-            all_passwords[idx] = {
-                "service_name": service_edit.value,
-                "username": username_edit.value,
-                "password": password_edit.value,
-                "totp_secret": totp_edit.value,
-            }
-            if save_all_passwords_to_file():
+            idx = all_passwords.index_of(item)
+            if idx is None:
+                error_message_tab2.value = (
+                    "エラー: このパスワードは既に削除されています。"
+                )
+                dlg.open = False
+                page.update()
+                return
+            new_record = password_manager_core.PasswordRecord(
+                service_edit.value,
+                username_edit.value,
+                session.seal(password_edit.value),
+                session.seal(totp_edit.value),
+                extra_fields=item.extra_fields,  # このバージョンが扱わないフィールドは保持する
+            )
+            totp_engine.forget(item.totp_secret)
+            prepare_totp(new_record)
+            with store_transaction():
+                old_record = all_passwords.update(idx, new_record)
+                saved = persist_change(
+                    password_manager_core.JOURNAL_OP_UPDATE, idx, new_record
+                )
+            search_index.update(old_record, new_record)
+            if saved:
                 dlg.open = False
                 error_message_tab2.value = "パスワードを編集しました。"
                 page.update()
-                refresh_password_list()
+                if is_searching():
+                    apply_search()
+                else:
+                    password_list.updated(idx)
 
         def on_cancel_edit(cancel_e):
             dlg.open = False
@@ -300,14 +655,26 @@ async def main_ui(page: ft.Page, master_password: str):
         page.add(dlg)
         page.update()
 
-    def open_delete_dialog(idx, item):
+    def open_delete_dialog(item):
         def on_confirm_delete(confirm_e):
-            all_passwords.pop(idx)
-            if save_all_passwords_to_file():
+            idx = all_passwords.index_of(item)
+            if idx is None:
+                confirm_dlg.open = False
+                page.update()
+                return
+            with store_transaction():
+                all_passwords.delete(idx)
+                saved = persist_change(password_manager_core.JOURNAL_OP_DELETE, idx)
+            search_index.remove(item)
+            totp_engine.forget(item.totp_secret)
+            if saved:
                 confirm_dlg.open = False
                 error_message_tab2.value = "パスワードを削除しました。"
                 page.update()
-                refresh_password_list()
+                if is_searching():
+                    apply_search()
+                else:
+                    password_list.removed(idx)
 
         def on_cancel_delete(cancel_e):
             confirm_dlg.open = False
@@ -316,7 +683,7 @@ async def main_ui(page: ft.Page, master_password: str):
         confirm_dlg = ft.AlertDialog(
             modal=True,
             title=ft.Text("削除確認"),
-            content=ft.Text(f"{item['service_name']} のパスワードを削除しますか？"),
+            content=ft.Text(f"{item.service_name} のパスワードを削除しますか？"),
             actions=[
                 ft.TextButton("削除", on_click=on_confirm_delete),
                 ft.TextButton("キャンセル", on_click=on_cancel_delete),
@@ -328,41 +695,17 @@ async def main_ui(page: ft.Page, master_password: str):
         page.update()
 
     def on_tab_change(e):
-        if e.control.selected_index == 1:
-            refresh_password_list()
+        # 一覧は変更のたびに差分で更新されているため、タブ切り替えで作り直す必要はない
+        pass
 
     # ========== クリップボード処理など ==========
-    def clear_clipboard_sync(password, delay_seconds=10):
-        def clear_task():
-            try:
-                for i in range(delay_seconds, 0, -1):
-                    msg = f"クリップボードクリアまでの時間: {i}秒"
-                    (
-                        time_counter.value,
-                        time_counter_tab2.value,
-                        time_counter_tab3.value,
-                    ) = msg, msg, msg
-                    page.update()
-                    time.sleep(1)
-                page.set_clipboard("")
-                msg = "クリップボードをクリアしました"
-                time_counter.value, time_counter_tab2.value, time_counter_tab3.value = (
-                    msg,
-                    msg,
-                    msg,
-                )
-                page.update()
-            except Exception:
-                pass
-
-        thread = threading.Thread(target=clear_task, daemon=True)
-        thread.start()
-        return thread
+    clipboard_timer = ClipboardExpiryTimer(
+        page, [time_counter, time_counter_tab2, time_counter_tab3], delay_seconds=10
+    )
 
     def on_copy_click(e):
-        nonlocal clipboard_clear_thread
         page.set_clipboard(password_output.value)
-        clipboard_clear_thread = clear_clipboard_sync(password_output.value, 10)
+        clipboard_timer.start()
 
     generate_button = ft.ElevatedButton(
         text="パスワード生成", on_click=generate_password
@@ -387,35 +730,14 @@ async def main_ui(page: ft.Page, master_password: str):
     error_message_tab3 = ft.Text(color=ft.Colors.RED)
     time_counter_tab3 = ft.Text()
 
+    settings = password_manager_core.settings
+
     def load_argon2_settings():
-        """password_file/settings.ini が存在すれば読み込んでフィールドに反映する"""
-        settings_path = os.path.join("password_file", "settings.ini")
-        if not os.path.exists(settings_path):
-            return
-        cfg = configparser.ConfigParser()
-        try:
-            cfg.read(settings_path, encoding="utf-8")
-            if "argon2" in cfg:
-                sec = cfg["argon2"]
-                # 存在する値だけ上書き（strのまま）
-                if "memory_cost" in sec:
-                    argon2_memory_cost.value = sec.get(
-                        "memory_cost", argon2_memory_cost.value
-                    )
-                if "time_cost" in sec:
-                    argon2_time_cost.value = sec.get(
-                        "time_cost", argon2_time_cost.value
-                    )
-                if "parallelism" in sec:
-                    argon2_parallelism.value = sec.get(
-                        "parallelism", argon2_parallelism.value
-                    )
-        except Exception as ex:
-            # 読み込み失敗は警告表示に留める
-            error_message_tab3.value = (
-                f"警告: settings.ini の読み込みに失敗しました: {ex}"
-            )
-            page.update()
+        """settings.ini の Argon2 設定をフィールドに反映する"""
+        argon2 = settings.section("argon2")
+        argon2_memory_cost.value = str(argon2["memory_cost"])
+        argon2_time_cost.value = str(argon2["time_cost"])
+        argon2_parallelism.value = str(argon2["parallelism"])
 
     # 起動時に設定を反映
     load_argon2_settings()
@@ -423,7 +745,7 @@ async def main_ui(page: ft.Page, master_password: str):
     # Argon2設定をiniファイルに出力する関数
 
     def save_argon2_settings(e):
-        # 入力を検証し、password_file/settings.ini に保存する
+        # 入力を検証し、password_file/settings.ini に保存する（ほかのセクションはそのまま残す）
         try:
             mem = int(argon2_memory_cost.value)
             tcost = int(argon2_time_cost.value)
@@ -435,24 +757,22 @@ async def main_ui(page: ft.Page, master_password: str):
             page.update()
             return
 
-        cfg = configparser.ConfigParser()
-        cfg["argon2"] = {
-            "memory_cost": str(mem),
-            "time_cost": str(tcost),
-            "parallelism": str(parallel),
-        }
-
         try:
-            os.makedirs(os.path.join(os.getcwd(), "password_file"), exist_ok=True)
-            settings_path = os.path.join("password_file", "settings.ini")
-            with open(settings_path, "w", encoding="utf-8") as f:
-                cfg.write(f)
+            settings.update(
+                {
+                    "argon2": {
+                        "memory_cost": mem,
+                        "time_cost": tcost,
+                        "parallelism": parallel,
+                    }
+                }
+            )
 
-            error_message_tab3.value = f"Argon2 設定を保存しました: {settings_path}"
+            error_message_tab3.value = f"Argon2 設定を保存しました: {settings.path}"
             page.update()
 
             # 設定が保存されたら、マスターパスワードの再ハッシュを促すダイアログを表示
-            _show_rehash_confirmation_dialog(mem, tcost, parallel)
+            _show_rehash_confirmation_dialog()
         except Exception as ex:
             error_message_tab3.value = f"エラー: 設定の保存に失敗しました。{ex}"
             page.update()
@@ -565,6 +885,66 @@ async def main_ui(page: ft.Page, master_password: str):
         text="ハッシュ化テスト実行", on_click=show_argon2_test_dialog
     )
 
+    # Argon2 パラメータの自動調整: 目標の検証時間とメモリ上限から最も強い設定を探す
+    calibration_target = ft.TextField(
+        label="目標の検証時間（秒）", value="0.5", width=195
+    )
+    calibration_memory = ft.TextField(label="メモリ上限（MiB）", value="256", width=195)
+    calibration_progress = ft.ProgressRing(width=16, height=16, visible=False)
+    calibration_status = ft.Text()
+
+    async def on_calibrate_argon2(e):
+        try:
+            target = float(calibration_target.value)
+            budget_mib = int(calibration_memory.value)
+            if target <= 0 or budget_mib <= 0:
+                raise ValueError("値は正の数である必要があります。")
+        except Exception as ex:
+            error_message_tab3.value = f"エラー: 自動調整の条件が不正です - {ex}"
+            page.update()
+            return
+
+        def on_progress(m, t):
+            # 計測はスレッドで行われるため、ステータス表示だけを更新する
+            calibration_status.value = f"計測中: memory_cost={m}, time_cost={t}"
+            page.update(calibration_status)
+
+        calibrate_button.disabled = True
+        calibration_progress.visible = True
+        error_message_tab3.value = ""
+        page.update()
+        try:
+            result = await password_manager_core.calibrate_argon2_async(
+                target, budget_mib * 1024, progress=on_progress
+            )
+        except Exception as ex:
+            calibration_status.value = ""
+            error_message_tab3.value = f"エラー: 自動調整に失敗しました: {ex}"
+            return
+        finally:
+            calibrate_button.disabled = False
+            calibration_progress.visible = False
+            page.update()
+
+        argon2_memory_cost.value = str(result["memory_cost"])
+        argon2_time_cost.value = str(result["time_cost"])
+        argon2_parallelism.value = str(result["parallelism"])
+        calibration_status.value = (
+            f"検証時間: 中央値 {result['median']:.3f} 秒 / p95 {result['p95']:.3f} 秒"
+            f"（{len(result['measurements'])} 通りを計測）"
+        )
+        if not result["meets_target"]:
+            calibration_status.value += (
+                "\n最小の設定でも目標時間を超えるため、最も軽い設定を選びました。"
+            )
+        page.update()
+        # 結果を settings.ini に保存する（再ハッシュの確認ダイアログも表示される）
+        save_argon2_settings(e)
+
+    calibrate_button = ft.TextButton(
+        text="自動調整して保存", on_click=on_calibrate_argon2
+    )
+
     master_password_text = ft.Text("マスターパスワードの設定")
 
     def open_change_master_password_dialog(e):
@@ -588,14 +968,10 @@ async def main_ui(page: ft.Page, master_password: str):
             can_reveal_password=True,
         )
         dlg_error = ft.Text(color=ft.Colors.RED)
+        dlg_progress = ft.ProgressRing(visible=False, width=24, height=24)
 
-        def on_save_master(e_save):
-            # 現在のパスワード確認
-            if not password_manager_core.verify_master_password(current_pwd.value):
-                dlg_error.value = "エラー: 現在のマスターパスワードが正しくありません。"
-                page.update()
-                return
-            # 新しいパスワード確認
+        async def on_save_master(e_save):
+            # 新しいパスワード確認（現在のパスワードは鍵ファイルのアンラップで確認される）
             if new_pwd.value != confirm_pwd.value:
                 dlg_error.value = "エラー: 新しいパスワードが一致しません。"
                 page.update()
@@ -607,27 +983,26 @@ async def main_ui(page: ft.Page, master_password: str):
                 page.update()
                 return
 
-            # Argon2 パラメータを UI から取得して検証
+            # パスワードファイルの鍵を、settings.ini の鍵導出方式（[kdf] / [argon2]）でラップし直す。
+            # 検証とラップで KDF を 2 回実行するため、スレッドで実行し、その間はボタンを無効にする
+            save_button.disabled = cancel_button.disabled = True
+            dlg_progress.visible = True
+            dlg_error.value = ""
+            page.update()
             try:
-                mem = int(argon2_memory_cost.value)
-                tcost = int(argon2_time_cost.value)
-                parallel = int(argon2_parallelism.value)
-                if mem <= 0 or tcost <= 0 or parallel <= 0:
-                    raise ValueError(
-                        "Argon2 のパラメータは正の整数である必要があります。"
-                    )
+                await password_manager_core.change_master_password_async(
+                    current_pwd.value, new_pwd.value
+                )
             except Exception as ex:
-                dlg_error.value = f"エラー: Argon2 パラメータが不正です: {ex}"
-                page.update()
+                dlg_error.value = (
+                    f"エラー: マスターパスワードの変更に失敗しました: {ex}"
+                )
                 return
-
-            # ハッシュを指定パラメータで更新
-            password_manager_core.hash_master_password(
-                new_pwd.value, m=mem, t=tcost, p=parallel
-            )
-            dlg_error.value = (
-                "マスターパスワードを変更しました。アプリを再起動してください。"
-            )
+            finally:
+                save_button.disabled = cancel_button.disabled = False
+                dlg_progress.visible = False
+                page.update()
+            error_message_tab3.value = "マスターパスワードを変更しました。"
             page.update()
             dlg_master.open = False
             page.update()
@@ -636,17 +1011,16 @@ async def main_ui(page: ft.Page, master_password: str):
             dlg_master.open = False
             page.update()
 
+        save_button = ft.TextButton("保存", on_click=on_save_master)
+        cancel_button = ft.TextButton("キャンセル", on_click=on_cancel_master)
         dlg_master = ft.AlertDialog(
             modal=True,
             title=ft.Text("マスターパスワードの変更"),
             content=ft.Column(
-                controls=[current_pwd, new_pwd, confirm_pwd, dlg_error],
+                controls=[current_pwd, new_pwd, confirm_pwd, dlg_error, dlg_progress],
                 tight=True,
             ),
-            actions=[
-                ft.TextButton("保存", on_click=on_save_master),
-                ft.TextButton("キャンセル", on_click=on_cancel_master),
-            ],
+            actions=[save_button, cancel_button],
         )
 
         page.dialog = dlg_master
@@ -665,16 +1039,7 @@ async def main_ui(page: ft.Page, master_password: str):
 
     def load_password_file_path():
         """settings.ini からパスワードファイルパスを読み込む"""
-        try:
-            settings_path = os.path.join("password_file", "settings.ini")
-            if os.path.exists(settings_path):
-                cfg = configparser.ConfigParser()
-                cfg.read(settings_path, encoding="utf-8")
-                if "file_paths" in cfg and "password_file" in cfg["file_paths"]:
-                    return cfg["file_paths"]["password_file"]
-        except Exception:
-            pass
-        return "password_file\\passwords.txt"
+        return settings.get("file_paths", "password_file")
 
     password_file_path_input = ft.TextField(
         label="パスワードファイルパス",
@@ -683,6 +1048,45 @@ async def main_ui(page: ft.Page, master_password: str):
         hint_text="例: password_file\\passwords.txt または C:\\Users\\YourName\\passwords.txt",
     )
 
+    def move_vault(new_path):
+        """
+        開いている保管庫を new_path に移動し、ジャーナル・書き込みスレッド・リースを
+        新しいパスで作り直す（古いパスへの追記や、移動先へのコマンドライン版の書き込みを防ぐ）。
+        """
+        nonlocal journal, writer, lease
+        old_path = password_manager_core.get_password_file_path()
+        if os.path.abspath(new_path) == os.path.abspath(old_path):
+            return
+        # 移動先をほかのウィンドウやプロセスが開いていれば移動しない
+        new_lease = password_manager_core.acquire_vault_lease(new_path)
+        try:
+            # 書きかけの内容を古いパスに書き終えてから移動する
+            if writer is not None:
+                writer.close(timeout=10)
+            else:
+                journal.wait_for_compaction(timeout=10)
+            # 移動中の変更は古いパスのロックで待たせ、新しいジャーナルに追記させる
+            with password_manager_core.vault_lock(old_path):
+                try:
+                    password_manager_core.set_password_file_path(new_path)
+                finally:
+                    # 移動に失敗した場合も、現在のパスで保存を続けられるようにする
+                    if writer is not None:
+                        writer = password_manager_core.BackgroundVaultWriter(
+                            session, on_error=show_save_error
+                        )
+                    else:
+                        journal = password_manager_core.VaultJournal(session)
+        except BaseException:
+            new_lease.release()
+            raise
+        if writer is not None:
+            # 書き込みスレッドを作り直す間に保存できなかった変更があっても、新しい場所に書き込む
+            save_all_passwords_to_file()
+        if lease is not None:
+            lease.release()
+        lease = new_lease
+
     def save_password_file_path(e):
         """パスワードファイルパスを settings.ini に保存"""
         new_path = password_file_path_input.value.strip()
@@ -697,22 +1101,10 @@ async def main_ui(page: ft.Page, master_password: str):
             if parent_dir:
                 os.makedirs(parent_dir, exist_ok=True)
 
-            # 設定ファイルに保存
-            cfg = configparser.ConfigParser()
-            settings_path = os.path.join("password_file", "settings.ini")
-            if os.path.exists(settings_path):
-                cfg.read(settings_path, encoding="utf-8")
-
-            if "file_paths" not in cfg:
-                cfg["file_paths"] = {}
-            cfg["file_paths"]["password_file"] = new_path
+            move_vault(new_path)
 
-            os.makedirs(os.path.dirname(settings_path), exist_ok=True)
-            with open(settings_path, "w", encoding="utf-8") as f:
-                cfg.write(f)
-
-            # グローバル変数を更新
-            password_manager_core.set_password_file_path(new_path)
+            # 設定ファイルに保存
+            settings.update({"file_paths": {"password_file": new_path}})
             error_message_tab3.value = (
                 f"✓ パスワードファイルの保存先を変更しました: {new_path}"
             )
@@ -746,6 +1138,159 @@ async def main_ui(page: ft.Page, master_password: str):
         text="保存先を変更", on_click=save_password_file_path
     )
 
+    # ========== インポート ==========
+    import_text = ft.Text("インポート / エクスポート", size=16, weight="bold")
+    import_status = ft.Text()
+    import_progress = ft.ProgressRing(width=16, height=16, visible=False)
+    bundle_passphrase = ft.TextField(
+        label="バンドルのパスフレーズ（暗号化したバックアップ用、12文字以上）",
+        width=400,
+        password=True,
+        can_reveal_password=True,
+    )
+
+    async def save_imported_passwords():
+        """インポート後の全データを 1 回の暗号化・書き込みで保存する"""
+        import password_manager_import
+
+        try:
+            if journal is None:
+                writer.submit(password_manager_core.serialize_passwords(all_passwords))
+            else:
+                # 追記せずに、このウィンドウのジャーナルでスナップショットへ畳み込む
+                await asyncio.to_thread(
+                    password_manager_import.write_imported_store,
+                    session,
+                    all_passwords,
+                    journal,
+                )
+            return True
+        except Exception as e:
+            show_save_error(e)
+            return False
+
+    async def on_import_file_picked(e: ft.FilePickerResultEvent):
+        import password_manager_import
+
+        if not e.files:
+            return
+
+        def on_progress(result):
+            # 読み込みはスレッドで行われるため、ステータス表示だけを更新する
+            import_status.value = f"読み込み中: {result.rows} 件"
+            page.update(import_status)
+
+        import_button.disabled = True
+        import_progress.visible = True
+        error_message_tab3.value = ""
+        page.update()
+        # 読み込みは既存のレコードを含む別のストアに対して行い、終わってから一覧に反映する
+        staging = password_manager_core.PasswordStore(all_passwords)
+        existing = len(staging)
+        try:
+            result = await asyncio.to_thread(
+                password_manager_import.import_file,
+                session,
+                staging,
+                e.files[0].path,
+                progress=on_progress,
+                passphrase=bundle_passphrase.value or None,
+            )
+        except Exception as ex:
+            import_status.value = ""
+            error_message_tab3.value = f"エラー: インポートに失敗しました: {ex}"
+            return
+        finally:
+            import_button.disabled = False
+            import_progress.visible = False
+            page.update()
+
+        imported = [staging[i] for i in range(existing, len(staging))]
+        with store_transaction():
+            for record in imported:
+                all_passwords.add(record)
+        search_index.add_many(imported)
+        if imported:
+            await save_imported_passwords()
+            apply_search()
+        import_status.value = (
+            f"追加: {result.added} 件 / 重複: {result.duplicates} 件 / "
+            f"スキップ: {result.skipped} 件"
+        )
+        page.update()
+
+    import_picker = ft.FilePicker(on_result=on_import_file_picked)
+    page.overlay.append(import_picker)
+
+    async def on_export_file_picked(e: ft.FilePickerResultEvent):
+        import password_manager_export
+
+        if not e.path:
+            return
+        fmt = password_manager_export.export_format_for(e.path)
+        if fmt == "bundle" and not bundle_passphrase.value:
+            error_message_tab3.value = (
+                "エラー: バンドルのパスフレーズを入力してください。"
+                "（.csv / .jsonl の場合は平文で書き出します）"
+            )
+            page.update()
+            return
+
+        def on_progress(count):
+            import_status.value = f"書き出し中: {count} 件"
+            page.update(import_status)
+
+        export_button.disabled = True
+        import_progress.visible = True
+        error_message_tab3.value = ""
+        page.update()
+        try:
+            # 書き出し中に一覧が変更されても影響しないよう、現在の並びを固定して渡す
+            count = await asyncio.to_thread(
+                password_manager_export.export_file,
+                session,
+                password_manager_core.PasswordStore(all_passwords),
+                e.path,
+                fmt,
+                passphrase=bundle_passphrase.value or None,
+                progress=on_progress,
+            )
+        except Exception as ex:
+            import_status.value = ""
+            error_message_tab3.value = f"エラー: エクスポートに失敗しました: {ex}"
+            return
+        finally:
+            export_button.disabled = False
+            import_progress.visible = False
+            page.update()
+
+        import_status.value = f"{count} 件をエクスポートしました: {e.path}"
+        if fmt != "bundle":
+            import_status.value += "（パスワードは平文です。扱いに注意してください）"
+        page.update()
+
+    export_picker = ft.FilePicker(on_result=on_export_file_picked)
+    page.overlay.append(export_picker)
+
+    import_button = ft.ElevatedButton(
+        text="ファイルを選択してインポート",
+        icon=ft.Icons.UPLOAD_FILE,
+        on_click=lambda _: import_picker.pick_files(
+            dialog_title="インポートするファイル",
+            allowed_extensions=["csv", "xml", "jsonl", "json", "pmb"],
+        ),
+    )
+
+    export_button = ft.ElevatedButton(
+        text="エクスポート",
+        icon=ft.Icons.DOWNLOAD,
+        on_click=lambda _: export_picker.save_file(
+            dialog_title="エクスポート先（.pmb: 暗号化バンドル / .csv / .jsonl）",
+            file_name="passwords_backup.pmb",
+            allowed_extensions=["pmb", "csv", "jsonl"],
+        ),
+    )
+
     # ========== タブ構造の作成 ==========
     # タブ1: パスワード生成
     tab1_content = ft.Column(
@@ -775,6 +1320,7 @@ async def main_ui(page: ft.Page, master_password: str):
             ft.Text(
                 "登録したパスワード一覧: 文字をクリックするとクリップボードにコピーできます"
             ),
+            search_input,
             ft.Divider(),
             password_list_view,  # ListView (expand=True)
             time_counter_tab2,
@@ -793,6 +1339,16 @@ async def main_ui(page: ft.Page, master_password: str):
                 controls=[argon2_button, argon2_test_button],
                 spacing=10,
             ),
+            ft.Row(
+                controls=[
+                    calibration_target,
+                    calibration_memory,
+                    calibrate_button,
+                    calibration_progress,
+                ],
+                spacing=10,
+            ),
+            calibration_status,
             ft.Divider(),
             password_file_path_text,
             password_file_path_input,
@@ -801,6 +1357,17 @@ async def main_ui(page: ft.Page, master_password: str):
                 spacing=10,
             ),
             ft.Divider(),
+            import_text,
+            ft.Text(
+                "Bitwarden / Chrome / Firefox の CSV、KeePass の XML エクスポートと、"
+                "このアプリのエクスポートを取り込めます。"
+            ),
+            bundle_passphrase,
+            ft.Row(
+                controls=[import_button, export_button, import_progress], spacing=10
+            ),
+            import_status,
+            ft.Divider(),
             master_password_text,
             set_password_button,
             error_message_tab3,
@@ -820,8 +1387,63 @@ async def main_ui(page: ft.Page, master_password: str):
         expand=True,  # これがないと中身のスクロールが機能しません
     )
 
+    # ウィンドウを閉じたら未保存の内容を書き込み、セッションの鍵を消去する
+    def on_settings_changed(changes):
+        """settings.ini の変更を設定タブの入力欄に反映する（ファイルは再パースしない）"""
+        fields = {
+            ("argon2", "memory_cost"): argon2_memory_cost,
+            ("argon2", "time_cost"): argon2_time_cost,
+            ("argon2", "parallelism"): argon2_parallelism,
+            ("file_paths", "password_file"): password_file_path_input,
+        }
+        changed = []
+        for name, value in changes.items():
+            field = fields.get(name)
+            if field is not None and value is not None and field.value != value:
+                field.value = value
+                changed.append(field)
+        if changed:
+            page.update(*changed)
+
+    unsubscribe_settings = settings.subscribe(on_settings_changed)
+
+    shut_down = False
+
+    def shutdown_session():
+        nonlocal shut_down
+        if shut_down:
+            return
+        shut_down = True
+        unsubscribe_settings()
+        if writer is not None:
+            writer.close(timeout=10)
+        totp_engine.clear()
+        clipboard_timer.cancel()
+        session.lock()
+        if lease is not None:
+            lease.release()
+
+    def on_page_close(e):
+        shutdown_session()
+
+    page.on_close = on_page_close
+    atexit.register(shutdown_session)
+
+    async def watch_session():
+        """アイドルタイムアウトで鍵が消去されたら、後片付けをしてロック画面に戻る"""
+        while session.is_unlocked() and not shut_down:
+            await asyncio.sleep(SESSION_WATCH_INTERVAL)
+        if shut_down:
+            return  # ウィンドウを閉じた
+        await asyncio.to_thread(shutdown_session)
+        if on_lock is not None:
+            on_lock()
+
+    if session.idle_timeout:
+        page.run_task(watch_session)
+
     # ページへの追加
-    def _show_rehash_confirmation_dialog(mem, tcost, parallel):
+    def _show_rehash_confirmation_dialog():
         """Argon2 設定変更後、マスターパスワード再ハッシュの確認ダイアログを表示"""
         rehash_pwd = ft.TextField(
             label="現在のマスターパスワード",
@@ -830,26 +1452,39 @@ async def main_ui(page: ft.Page, master_password: str):
             can_reveal_password=True,
         )
         rehash_error = ft.Text(color=ft.Colors.RED)
+        rehash_progress = ft.ProgressRing(visible=False, width=24, height=24)
 
-        def on_confirm_rehash(confirm_e):
+        async def on_confirm_rehash(confirm_e):
+            # 検証とラップで KDF を 2 回実行するため、スレッドで実行し、その間はボタンを無効にする
+            rehash_button.disabled = later_button.disabled = True
+            rehash_progress.visible = True
+            rehash_error.value = ""
+            page.update()
             try:
-                password_manager_core.rehash_master_password(
-                    rehash_pwd.value, m=mem, t=tcost, p=parallel
-                )
-                rehash_error.value = (
-                    "マスターパスワードを新しい Argon2 設定で再ハッシュしました。"
+                # 保存したばかりの settings.ini の設定（[kdf] algorithm に従う）でラップし直す
+                await password_manager_core.rehash_master_password_async(
+                    rehash_pwd.value
                 )
-                page.update()
-                rehash_dlg.open = False
-                page.update()
             except Exception as ex:
                 rehash_error.value = f"エラー: {str(ex)}"
+                return
+            finally:
+                rehash_button.disabled = later_button.disabled = False
+                rehash_progress.visible = False
                 page.update()
+            rehash_error.value = (
+                "マスターパスワードを新しい Argon2 設定で再ハッシュしました。"
+            )
+            rehash_dlg.open = False
+            page.update()
 
         def on_cancel_rehash(cancel_e):
             rehash_dlg.open = False
             page.update()
 
+        rehash_button = ft.TextButton("再ハッシュ", on_click=on_confirm_rehash)
+        later_button = ft.TextButton("後で実行", on_click=on_cancel_rehash)
+
         rehash_dlg = ft.AlertDialog(
             modal=True,
             title=ft.Text("マスターパスワードを再ハッシュしますか？"),
@@ -862,13 +1497,11 @@ async def main_ui(page: ft.Page, master_password: str):
                     ft.Divider(),
                     rehash_pwd,
                     rehash_error,
+                    rehash_progress,
                 ],
                 tight=True,
             ),
-            actions=[
-                ft.TextButton("再ハッシュ", on_click=on_confirm_rehash),
-                ft.TextButton("後で実行", on_click=on_cancel_rehash),
-            ],
+            actions=[rehash_button, later_button],
         )
         page.dialog = rehash_dlg
         rehash_dlg.open = True
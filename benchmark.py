@@ -0,0 +1,918 @@
+"""
+パスワードマネージャーのベンチマーク（GUI なしで実行できる）。
+
+使い方:
+    python benchmark.py run [--quick] [--only encrypt] [--save base.json] [--compare base.json]
+    python benchmark.py compare base.json new.json [--threshold 0.1]
+    python benchmark.py passwords [--count 100000] [--length 24]
+    python benchmark.py records [--entries 100000]
+    python benchmark.py compression [--entries 10000]
+    python benchmark.py memory [--entries 100000]
+    python benchmark.py agent [--lookups 200]
+    python benchmark.py import [--entries 100000]
+    python benchmark.py export [--entries 20000]
+
+run は一時ディレクトリの中で実行するため、実際のパスワードファイルやマスターパスワードには触れない。
+各ケースはウォームアップの後に perf_counter_ns で複数回計測し、中央値などの統計を出す。
+--save で結果を JSON に保存し、--compare で以前の結果と中央値を比べて遅くなったケースを表示する
+（遅くなったケースがあれば終了コード 1 を返す）。
+"""
+
+import argparse
+import base64
+import contextlib
+import csv
+import datetime
+import io
+import json
+import os
+import platform
+import random
+import secrets
+import statistics
+import string
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import password_manager_core
+
+KIB = 1024
+MIB = 1024 * KIB
+
+# 暗号化・復号を計測する保管庫のサイズ
+VAULT_SIZES = [1 * KIB, 64 * KIB, 1 * MIB, 10 * MIB, 100 * MIB]
+QUICK_VAULT_SIZES = [1 * KIB, 64 * KIB, 1 * MIB]
+# CSV のパースを計測する件数
+PARSE_ENTRIES = [1_000, 10_000, 100_000]
+QUICK_PARSE_ENTRIES = [1_000, 10_000]
+
+# 中央値がこの割合以上遅くなったら性能低下とみなす
+DEFAULT_THRESHOLD = 0.10
+
+BENCH_PASSWORD = "benchmark-master-password"
+BENCH_TOTP_SECRET = "JBSWY3DPEHPK3PXP"
+
+
+def _synthetic_csv_rows(count, seed=0):
+    """
+    合成したパスワードファイルの行（CSV をパースした直後と同じく、セルごとに別の文字列）を返す。
+    実際の保存内容に近づけるため、サービス名とユーザー名は一定数の候補から選ぶ。
+    """
+    rng = random.Random(seed)
+
+    def word(n):
+        return "".join(rng.choice(string.ascii_lowercase) for _ in range(n))
+
+    services = [f"{word(8)}.com" for _ in range(max(count // 50, 1))]
+    usernames = [f"{word(6)}@example.com" for _ in range(max(count // 200, 1))]
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    for _ in range(count):
+        writer.writerow([rng.choice(services), rng.choice(usernames), word(20), ""])
+    return list(csv.reader(buf.getvalue().splitlines()))
+
+
+def _measure(build):
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    before, _ = tracemalloc.get_traced_memory()
+    result = build()
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return after - before, result
+
+
+def _summarize(samples_ns, number):
+    """1 回あたりの時間（ナノ秒）の統計"""
+    per_call = sorted(ns / number for ns in samples_ns)
+    p95_index = min(int(round(0.95 * (len(per_call) - 1))), len(per_call) - 1)
+    return {
+        "runs": len(per_call),
+        "number": number,
+        "min_ns": per_call[0],
+        "median_ns": statistics.median(per_call),
+        "mean_ns": statistics.fmean(per_call),
+        "p95_ns": per_call[p95_index],
+        "stdev_ns": statistics.stdev(per_call) if len(per_call) > 1 else 0.0,
+    }
+
+
+def _time_ns(func, repeat, number=1, warmup=1):
+    """
+    func を warmup 回実行した後、number 回の呼び出しを 1 サンプルとして repeat 回計測する。
+    短い処理は number を大きくしてタイマーの分解能の影響を減らす。
+    """
+    for _ in range(warmup):
+        for _ in range(number):
+            func()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter_ns()
+        for _ in range(number):
+            func()
+        samples.append(time.perf_counter_ns() - start)
+    return _summarize(samples, number)
+
+
+def _size_label(size):
+    if size >= MIB:
+        return f"{size // MIB}MB"
+    return f"{size // KIB}KB"
+
+
+def _bench_derive_key(quick):
+    salt = bytes(16)
+    return {
+        "derive_key": _time_ns(
+            lambda: password_manager_core.derive_key(BENCH_PASSWORD, salt),
+            repeat=3 if quick else 7,
+        )
+    }
+
+
+def _bench_vault_crypto(quick):
+    key = bytes(password_manager_core.KEY_BYTES)
+    filepath = os.path.join(os.getcwd(), "bench_vault.bin")
+    results = {}
+    for size in QUICK_VAULT_SIZES if quick else VAULT_SIZES:
+        plaintext = random.Random(size).randbytes(size)
+        repeat = 3 if size >= 10 * MIB else (5 if quick else 15)
+        label = _size_label(size)
+        results[f"encrypt_password_file[{label}]"] = _time_ns(
+            lambda: password_manager_core.encrypt_password_file(
+                plaintext, filepath=filepath, key=key
+            ),
+            repeat=repeat,
+        )
+        results[f"decrypt_password_file[{label}]"] = _time_ns(
+            lambda: password_manager_core.decrypt_password_file(
+                filepath=filepath, key=key
+            ),
+            repeat=repeat,
+        )
+        os.remove(filepath)
+    return results
+
+
+def _bench_parse(quick):
+    key = bytes(password_manager_core.KEY_BYTES)
+    filepath = os.path.join(os.getcwd(), "bench_vault.bin")
+    results = {}
+    for entries in QUICK_PARSE_ENTRIES if quick else PARSE_ENTRIES:
+        records = [
+            password_manager_core.PasswordRecord(
+                row[0],
+                row[1],
+                password_manager_core.seal_secret(key, row[2]),
+                "",
+            )
+            for row in _synthetic_csv_rows(entries)
+        ]
+        plaintext = password_manager_core.serialize_passwords(records)
+        del records
+        password_manager_core.encrypt_password_file(
+            plaintext, filepath=filepath, key=key
+        )
+        repeat = 3 if entries >= 100_000 else (5 if quick else 10)
+        results[f"parse_passwords[{entries}]"] = _time_ns(
+            lambda: password_manager_core.parse_passwords(plaintext, key),
+            repeat=repeat,
+        )
+        # 復号 + パース（+ ジャーナルの確認）の一連の処理
+        results[f"get_decrypted_passwords[{entries}]"] = _time_ns(
+            lambda: password_manager_core.get_decrypted_passwords(
+                filepath=filepath, key=key
+            ),
+            repeat=repeat,
+        )
+        os.remove(filepath)
+    return results
+
+
+def _bench_generate(quick):
+    number = 200 if quick else 1000
+    return {
+        "generate_secure_password[24]": _time_ns(
+            lambda: password_manager_core.generate_secure_password(24),
+            repeat=10 if quick else 30,
+            number=number,
+        ),
+        "generate_secure_passwords[1000x24]": _time_ns(
+            lambda: password_manager_core.generate_secure_passwords([24] * 1000),
+            repeat=10 if quick else 30,
+        ),
+        "generate_totp_code": _time_ns(
+            lambda: password_manager_core.generate_totp_code(BENCH_TOTP_SECRET),
+            repeat=10 if quick else 30,
+            number=number,
+        ),
+    }
+
+
+def _bench_argon2(quick):
+    # hash_master_password はカレントディレクトリ基準のパスに書き込む（run の一時ディレクトリ内）
+    repeat = 3 if quick else 5
+    salt = bytes(16)
+    key_file_bytes = password_manager_core.wrap_vault_key(
+        bytes(32), BENCH_PASSWORD, password_manager_core.DEFAULT_ARGON2_PARAMS
+    )
+    return {
+        "hash_master_password": _time_ns(
+            lambda: password_manager_core.hash_master_password(BENCH_PASSWORD),
+            repeat=repeat,
+        ),
+        "verify_master_password": _time_ns(
+            lambda: password_manager_core.verify_master_password(BENCH_PASSWORD),
+            repeat=repeat,
+        ),
+        # 旧来のアンロック（Argon2 で検証してから PBKDF2 で鍵を導出）と、
+        # 鍵ファイル v2 のアンロック（Argon2id 1 回で検証と DEK の取り出しを兼ねる）の比較
+        "unlock[verify+derive_key]": _time_ns(
+            lambda: (
+                password_manager_core.verify_master_password(BENCH_PASSWORD),
+                password_manager_core.derive_key(BENCH_PASSWORD, salt),
+            ),
+            repeat=repeat,
+        ),
+        "unlock[unwrap_vault_key]": _time_ns(
+            lambda: password_manager_core.unwrap_vault_key(
+                key_file_bytes, BENCH_PASSWORD
+            ),
+            repeat=repeat,
+        ),
+    }
+
+
+# 名前 -> ベンチマーク関数（--only で名前の前方一致で絞り込める）
+SUITE = {
+    "derive_key": _bench_derive_key,
+    "vault": _bench_vault_crypto,
+    "parse": _bench_parse,
+    "generate": _bench_generate,
+    "argon2": _bench_argon2,
+}
+
+
+@contextlib.contextmanager
+def _scratch_directory():
+    """一時ディレクトリをカレントディレクトリにして、実際のファイルに触れないようにする"""
+    previous = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="pm-bench-") as directory:
+        os.chdir(directory)
+        os.makedirs("password_file", exist_ok=True)
+        try:
+            yield directory
+        finally:
+            os.chdir(previous)
+
+
+def run_suite(only=None, quick=False, progress=None):
+    """ベンチマークを実行して {ケース名: 統計} を返す"""
+    results = {}
+    with _scratch_directory():
+        for name, bench in SUITE.items():
+            if only and not any(name.startswith(prefix) for prefix in only):
+                continue
+            if progress is not None:
+                progress(name)
+            results.update(bench(quick))
+    return results
+
+
+def _environment():
+    return {
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def save_results(path, results, quick=False):
+    data = {"environment": _environment(), "quick": quick, "results": results}
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+
+
+def load_results(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)["results"]
+
+
+def compare_results(baseline, current, threshold=DEFAULT_THRESHOLD):
+    """
+    中央値を比べて [(ケース名, 基準値, 今回, 比率, 判定)] を返す。
+    判定は "regression"（threshold 以上遅い）/ "improvement"（threshold 以上速い）/ "ok"。
+    どちらか一方にしかないケースは比較しない。
+    """
+    rows = []
+    for name, stats in current.items():
+        if name not in baseline:
+            continue
+        before = baseline[name]["median_ns"]
+        after = stats["median_ns"]
+        ratio = after / before if before else float("inf")
+        if ratio >= 1 + threshold:
+            verdict = "regression"
+        elif ratio <= 1 - threshold:
+            verdict = "improvement"
+        else:
+            verdict = "ok"
+        rows.append((name, before, after, ratio, verdict))
+    return rows
+
+
+def _format_ns(ns):
+    if ns >= 1e9:
+        return f"{ns / 1e9:.2f} s"
+    if ns >= 1e6:
+        return f"{ns / 1e6:.2f} ms"
+    if ns >= 1e3:
+        return f"{ns / 1e3:.2f} us"
+    return f"{ns:.0f} ns"
+
+
+def print_results(results):
+    width = max((len(name) for name in results), default=10)
+    print(f"{'case':<{width}}  {'median':>10}  {'p95':>10}  {'min':>10}  runs")
+    for name, stats in results.items():
+        print(
+            f"{name:<{width}}  {_format_ns(stats['median_ns']):>10}  "
+            f"{_format_ns(stats['p95_ns']):>10}  {_format_ns(stats['min_ns']):>10}  "
+            f"{stats['runs']}x{stats['number']}"
+        )
+
+
+def print_comparison(rows, threshold):
+    """比較結果を表示し、性能が低下したケースがあれば True を返す"""
+    labels = {"regression": "低下", "improvement": "改善", "ok": ""}
+    width = max((len(row[0]) for row in rows), default=10)
+    for name, before, after, ratio, verdict in rows:
+        print(
+            f"{name:<{width}}  {_format_ns(before):>10} -> {_format_ns(after):>10}  "
+            f"x{ratio:.2f}  {labels[verdict]}"
+        )
+    regressions = [row for row in rows if row[4] == "regression"]
+    if regressions:
+        print(f"性能低下（{threshold:.0%} 以上遅い）: {len(regressions)} 件")
+    return bool(regressions)
+
+
+def _legacy_generate_secure_password(length, use_special_chars=True):
+    """変更前の実装（1 文字ごとに secrets.choice を呼ぶ）。比較用"""
+    if use_special_chars:
+        characters = string.ascii_letters + string.digits + string.punctuation
+    else:
+        characters = string.ascii_letters + string.digits
+    return "".join(secrets.choice(characters) for _ in range(length))
+
+
+def bench_password_throughput(count=100_000, length=24):
+    """
+    パスワードを count 件生成したときの件数/秒を、実装ごとに比較する。
+    - secrets.choice: 変更前の実装を count 回呼ぶ
+    - single: generate_secure_password を count 回呼ぶ
+    - stream: iter_secure_passwords から count 件取り出す
+    - batch: generate_secure_passwords で count 件まとめて生成する
+    """
+    candidates = {
+        "secrets.choice": lambda: [
+            _legacy_generate_secure_password(length) for _ in range(count)
+        ],
+        "single": lambda: [
+            password_manager_core.generate_secure_password(length) for _ in range(count)
+        ],
+        "stream": lambda: list(
+            password_manager_core.iter_secure_passwords([length] * count)
+        ),
+        "batch": lambda: password_manager_core.generate_secure_passwords(
+            [length] * count
+        ),
+    }
+    results = {}
+    for name, generate in candidates.items():
+        stats = _time_ns(generate, repeat=3)
+        results[name] = count / (stats["median_ns"] / 1e9)
+    return results
+
+
+# KDF ごとの計測パラメータ（アプリの既定値と同じ）
+KDF_BENCH_PARAMS = {
+    password_manager_core.KDF_PBKDF2_SHA1: (password_manager_core.PBKDF2_ITERATIONS,),
+    password_manager_core.KDF_SCRYPT: password_manager_core.SCRYPT_DEFAULT_PARAMS,
+    password_manager_core.KDF_ARGON2ID: password_manager_core.DEFAULT_ARGON2_PARAMS,
+}
+
+
+def bench_kdf_backends(repeat=3):
+    """
+    登録されている KDF の実装ごとに、テストベクターとの一致と 1 回あたりの時間を計測する。
+    PBKDF2 は反復回数/秒も求める（同じ時間でどれだけ反復回数を増やせるかの目安）。
+    """
+    salt = bytes(16)
+    password = BENCH_PASSWORD.encode("utf-8")
+    results = {}
+    for algorithm, params in KDF_BENCH_PARAMS.items():
+        selected = password_manager_core.select_kdf_backend(algorithm)
+        for backend in password_manager_core.kdf_backends(algorithm):
+            verified = password_manager_core.verify_kdf_backend(backend)
+            result = {"verified": verified, "selected": backend is selected}
+            if verified:
+                stats = _time_ns(
+                    lambda: backend.derive(password, salt, params, 32), repeat=repeat
+                )
+                result["median_s"] = stats["median_ns"] / 1e9
+                if algorithm == password_manager_core.KDF_PBKDF2_SHA1:
+                    result["iterations_per_s"] = params[0] / result["median_s"]
+            results[f"{algorithm}[{backend.name}]"] = result
+    return results
+
+
+# コマンドライン版の起動時間の目標（KDF を実行する前まで）
+CLI_STARTUP_BUDGET_S = 0.150
+
+
+def bench_cli_startup(repeat=10):
+    """
+    password_manager_cli.py の起動時間（新しいプロセスで generate を実行して終了するまで）を計測する。
+    generate は KDF を実行しないため、import と引数の解析だけの時間になる。
+    比較のため、何も import しない python の起動時間も計測する。
+    """
+    script = os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "password_manager_cli.py"
+    )
+    commands = {
+        "python -c pass": [sys.executable, "-c", "pass"],
+        "password_manager_cli generate": [sys.executable, script, "generate"],
+    }
+    results = {}
+    for name, command in commands.items():
+        stats = _time_ns(
+            lambda: subprocess.run(command, check=True, stdout=subprocess.DEVNULL),
+            repeat=repeat,
+        )
+        results[name] = stats["median_ns"] / 1e9
+    flet_check = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys, password_manager_cli; print('flet' in sys.modules)",
+        ],
+        cwd=os.path.dirname(script),
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    results["imports_flet"] = flet_check.stdout.strip() == "True"
+    return results
+
+
+def bench_agent_lookups(lookups=200, unlock_samples=3):
+    """
+    スクリプトから lookups 回パスワードを取得する時間を、毎回アンロックする場合と
+    アンロックエージェントに問い合わせる場合で比べる（一時ディレクトリ内の保管庫を使う）。
+    毎回アンロックする場合は unlock_samples 回の中央値を lookups 倍した推定値。
+    """
+    import threading
+
+    import password_manager_agent
+
+    with _scratch_directory() as directory:
+        password_manager_core.load_password_file_path_from_config()
+        session = password_manager_core.VaultSession()
+        session.unlock(BENCH_PASSWORD, create=True)
+        store = password_manager_core.PasswordStore()
+        store.add(
+            password_manager_core.PasswordRecord(
+                "example.com", "user", session.seal("secret-password"), ""
+            )
+        )
+        password_manager_core.encrypt_password_file(
+            password_manager_core.serialize_passwords(store), key=session.key
+        )
+        session.lock()
+
+        def unlock_and_get():
+            with password_manager_core.VaultSession() as s:
+                s.unlock(BENCH_PASSWORD)
+                passwords = password_manager_core.get_decrypted_passwords(key=s.key)
+                s.reveal(passwords[passwords.find("example.com")[0]].password)
+
+        unlock_stats = _time_ns(unlock_and_get, repeat=unlock_samples, warmup=0)
+
+        socket_path = os.path.join(directory, "agent", "agent.sock")
+        ready = threading.Event()
+        agent = threading.Thread(
+            target=password_manager_agent.run_agent,
+            args=(BENCH_PASSWORD, socket_path, 0),
+            kwargs={"on_ready": ready.set},
+            daemon=True,
+        )
+        agent.start()
+        if not ready.wait(60):
+            raise RuntimeError("エージェントの起動に失敗しました。")
+        start_ns = time.perf_counter_ns()
+        for _ in range(lookups):
+            password_manager_agent.agent_get("example.com", path=socket_path)
+        agent_ns = time.perf_counter_ns() - start_ns
+        password_manager_agent.agent_stop(socket_path)
+        agent.join()
+    return {
+        "unlock_each_s": unlock_stats["median_ns"] * lookups / 1e9,
+        "agent_s": agent_ns / 1e9,
+    }
+
+
+def _legacy_serialize_csv(passwords):
+    """変更前の保存形式（マーカー行 + CSV、シークレットは Base64）。比較用"""
+    valid_cells = {True: "1", False: "0"}
+    buf = io.StringIO()
+    buf.write(password_manager_core.SEALED_VAULT_MARKER + "\r\n")
+    writer = csv.writer(buf)
+    for p in passwords:
+        writer.writerow(
+            [
+                p.service_name,
+                p.username,
+                base64.b64encode(p.password.blob).decode("ascii"),
+                (
+                    base64.b64encode(p.totp_secret.blob).decode("ascii")
+                    if p.totp_secret
+                    else ""
+                ),
+                valid_cells.get(p.totp_valid, ""),
+            ]
+        )
+    return buf.getvalue().encode("utf-8")
+
+
+def bench_record_format(entries=100_000):
+    """
+    保存形式ごとのパース・シリアライズの時間（中央値、秒）とサイズを比較する。
+    - csv: 変更前の形式（parse_passwords の旧形式の読み込み経路）
+    - binary: 長さ付きのバイナリ形式
+    """
+    key = bytes(password_manager_core.KEY_BYTES)
+    store = password_manager_core.PasswordStore(
+        password_manager_core.PasswordRecord(
+            row[0], row[1], password_manager_core.seal_secret(key, row[2]), ""
+        )
+        for row in _synthetic_csv_rows(entries)
+    )
+    serializers = {
+        "csv": _legacy_serialize_csv,
+        "binary": password_manager_core.serialize_passwords,
+    }
+    results = {}
+    for name, serialize in serializers.items():
+        data = bytearray(serialize(store))
+        serialize_stats = _time_ns(lambda: serialize(store), repeat=5)
+        parse_stats = _time_ns(
+            lambda: password_manager_core.parse_passwords(data, key), repeat=5
+        )
+        results[name] = {
+            "bytes": len(data),
+            "serialize_s": serialize_stats["median_ns"] / 1e9,
+            "parse_s": parse_stats["median_ns"] / 1e9,
+        }
+    return results
+
+
+def bench_compression(entries=10_000):
+    """
+    合成した保管庫（entries 件、バイナリ形式）を圧縮方式ごとに保存・読み込みし、
+    ファイルサイズと時間（中央値、秒）を比較する。
+    """
+    key = bytes(password_manager_core.KEY_BYTES)
+    plaintext = password_manager_core.serialize_passwords(
+        password_manager_core.PasswordRecord(
+            row[0], row[1], password_manager_core.seal_secret(key, row[2]), ""
+        )
+        for row in _synthetic_csv_rows(entries)
+    )
+    results = {}
+    with _scratch_directory():
+        filepath = os.path.join(os.getcwd(), "bench_vault.bin")
+        for compression in password_manager_core.available_compressions():
+            write_stats = _time_ns(
+                lambda: password_manager_core.encrypt_password_file(
+                    plaintext, filepath=filepath, key=key, compression=compression
+                ),
+                repeat=5,
+            )
+            read_stats = _time_ns(
+                lambda: password_manager_core.decrypt_password_file(
+                    filepath=filepath, key=key
+                ),
+                repeat=5,
+            )
+            results[compression] = {
+                "plaintext_bytes": len(plaintext),
+                "file_bytes": os.path.getsize(filepath),
+                "write_s": write_stats["median_ns"] / 1e9,
+                "read_s": read_stats["median_ns"] / 1e9,
+            }
+    return results
+
+
+def bench_record_memory(entries=100_000):
+    """
+    1 件あたりのメモリ使用量を、旧形式（辞書のリスト）と PasswordStore で比較する。
+    シークレットはどちらも同じ SealedSecret を共有させ、コンテナ部分の差だけを測る。
+    """
+    secret = password_manager_core.SealedSecret(bytes(24 + 20 + 16))
+
+    def build_dicts():
+        # 変更前の get_decrypted_passwords と同じ形
+        return [
+            {
+                "service_name": row[0],
+                "username": row[1],
+                "password": secret,
+                "totp_secret": row[3],
+            }
+            for row in _synthetic_csv_rows(entries)
+        ]
+
+    def build_store():
+        return password_manager_core.PasswordStore(
+            password_manager_core.PasswordRecord(row[0], row[1], secret, row[3])
+            for row in _synthetic_csv_rows(entries)
+        )
+
+    # パース途中の一時データは解放され、構築後に残る分だけが計測される
+    dict_bytes, dicts = _measure(build_dicts)
+    del dicts
+    store_bytes, store = _measure(build_store)
+    del store
+
+    return {
+        "entries": entries,
+        "dict_bytes_per_entry": dict_bytes / entries,
+        "store_bytes_per_entry": store_bytes / entries,
+    }
+
+
+def bench_import(entries=100_000):
+    """
+    合成した Chrome 形式の CSV（entries 件）をインポートし、読み込み・保存の時間（秒）と、
+    読み込み中のメモリのピークからインポート後に残るレコード分を引いた量（パース中の一時データ）を計測する。
+    """
+    import password_manager_import
+
+    rows = _synthetic_csv_rows(entries)
+    with _scratch_directory():
+        path = os.path.join(os.getcwd(), "chrome_export.csv")
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["name", "url", "username", "password"])
+            for i, (service, username, password, _totp) in enumerate(rows):
+                # 合成データは重複しうるため、パスワードに連番を付けてすべて別のエントリにする
+                writer.writerow(
+                    [service, f"https://{service}/", username, f"{password}{i}"]
+                )
+        file_bytes = os.path.getsize(path)
+        del rows
+
+        session = password_manager_core.VaultSession()
+        session.unlock_with_key(bytes(password_manager_core.KEY_BYTES))
+        store = password_manager_core.PasswordStore()
+        start_ns = time.perf_counter_ns()
+        result = password_manager_import.import_file(session, store, path)
+        import_ns = time.perf_counter_ns() - start_ns
+        start_ns = time.perf_counter_ns()
+        password_manager_import.write_imported_store(session, store)
+        write_ns = time.perf_counter_ns() - start_ns
+        del store
+
+        # tracemalloc は遅くなるため、時間とは別に計測する
+        tracemalloc.start()
+        store = password_manager_core.PasswordStore()
+        password_manager_import.import_file(session, store, path)
+        retained, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        session.lock()
+    return {
+        "entries": result.added,
+        "file_bytes": file_bytes,
+        "import_s": import_ns / 1e9,
+        "write_s": write_ns / 1e9,
+        "parse_overhead_bytes": peak - retained,
+    }
+
+
+def bench_export(entries=20_000):
+    """
+    entries 件の保管庫を形式ごとにエクスポートし、時間（秒）・ファイルサイズ・メモリのピーク
+    （保管庫自体を除く、書き出し中に増えた分）を計測する。件数を変えてもピークが変わらないことを確認する。
+    """
+    import password_manager_export
+
+    session = password_manager_core.VaultSession()
+    session.unlock_with_key(bytes(password_manager_core.KEY_BYTES))
+    batch = password_manager_core.SecretBatch(session.key)
+    store = password_manager_core.PasswordStore(
+        password_manager_core.PasswordRecord(
+            row[0], row[1], batch.seal(row[2]), batch.seal(BENCH_TOTP_SECRET)
+        )
+        for row in _synthetic_csv_rows(entries)
+    )
+    results = {}
+    with _scratch_directory():
+        for fmt in password_manager_export.EXPORT_FORMATS:
+            path = os.path.join(os.getcwd(), f"export.{fmt}")
+            start_ns = time.perf_counter_ns()
+            password_manager_export.export_file(
+                session, store, path, fmt, passphrase=BENCH_PASSWORD
+            )
+            elapsed_ns = time.perf_counter_ns() - start_ns
+
+            # tracemalloc は遅くなるため、時間とは別に計測する
+            tracemalloc.start()
+            password_manager_export.export_file(
+                session, store, path, fmt, passphrase=BENCH_PASSWORD
+            )
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            results[fmt] = {
+                "export_s": elapsed_ns / 1e9,
+                "file_bytes": os.path.getsize(path),
+                "peak_bytes": peak,
+            }
+    session.lock()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="パスワードマネージャーのベンチマーク")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run = sub.add_parser("run", help="処理時間のベンチマークを実行する")
+    run.add_argument(
+        "--only",
+        action="append",
+        choices=list(SUITE),
+        help="実行するベンチマーク（複数指定可）",
+    )
+    run.add_argument(
+        "--quick", action="store_true", help="小さいサイズ・少ない回数で実行する"
+    )
+    run.add_argument("--save", help="結果を保存する JSON ファイル")
+    run.add_argument("--compare", help="比較する以前の結果（JSON ファイル）")
+    run.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+
+    compare = sub.add_parser("compare", help="保存した 2 つの結果を比較する")
+    compare.add_argument("baseline")
+    compare.add_argument("current")
+    compare.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+
+    passwords = sub.add_parser(
+        "passwords", help="パスワード生成の件数/秒を実装ごとに比較する"
+    )
+    passwords.add_argument("--count", type=int, default=100_000)
+    passwords.add_argument("--length", type=int, default=24)
+
+    records = sub.add_parser(
+        "records", help="保存形式（CSV / バイナリ）のパース・シリアライズを比較する"
+    )
+    records.add_argument("--entries", type=int, default=100_000)
+
+    compression = sub.add_parser(
+        "compression", help="圧縮方式ごとのファイルサイズと保存・読み込み時間を比較する"
+    )
+    compression.add_argument("--entries", type=int, default=10_000)
+
+    cli = sub.add_parser("cli", help="コマンドライン版の起動時間を計測する")
+    cli.add_argument("--repeat", type=int, default=10)
+
+    kdf = sub.add_parser("kdf", help="鍵導出（KDF）の実装ごとの速さを比較する")
+    kdf.add_argument("--repeat", type=int, default=3)
+
+    agent = sub.add_parser(
+        "agent",
+        help="毎回アンロックする場合とアンロックエージェントの取得時間を比較する",
+    )
+    agent.add_argument("--lookups", type=int, default=200)
+
+    import_ = sub.add_parser(
+        "import", help="CSV からのインポートの時間とメモリを計測する"
+    )
+    import_.add_argument("--entries", type=int, default=100_000)
+
+    export = sub.add_parser(
+        "export", help="エクスポートの形式ごとの時間とメモリを計測する"
+    )
+    export.add_argument("--entries", type=int, default=20_000)
+
+    memory = sub.add_parser("memory", help="1 件あたりのメモリ使用量を比較する")
+    memory.add_argument("--entries", type=int, default=100_000)
+    args = parser.parse_args()
+
+    if args.command == "run":
+        # 比較対象は一時ディレクトリに移動する前に読み込んでおく
+        baseline = load_results(args.compare) if args.compare else None
+        results = run_suite(
+            only=args.only,
+            quick=args.quick,
+            progress=lambda name: print(f"実行中: {name}", file=sys.stderr),
+        )
+        print_results(results)
+        if args.save:
+            save_results(args.save, results, quick=args.quick)
+        if baseline is not None:
+            print()
+            rows = compare_results(baseline, results, args.threshold)
+            if print_comparison(rows, args.threshold):
+                sys.exit(1)
+    elif args.command == "compare":
+        rows = compare_results(
+            load_results(args.baseline), load_results(args.current), args.threshold
+        )
+        if print_comparison(rows, args.threshold):
+            sys.exit(1)
+    elif args.command == "passwords":
+        results = bench_password_throughput(args.count, args.length)
+        print(f"{args.count} 件 x {args.length} 文字")
+        for name, per_second in results.items():
+            print(f"  {name:<15}: {per_second:>12,.0f} 件/秒")
+    elif args.command == "records":
+        results = bench_record_format(args.entries)
+        print(f"件数: {args.entries}")
+        for name, result in results.items():
+            print(
+                f"  {name:<6}: パース {result['parse_s'] * 1000:8.1f} ms  "
+                f"シリアライズ {result['serialize_s'] * 1000:8.1f} ms  "
+                f"{result['bytes']:>12,} bytes"
+            )
+    elif args.command == "compression":
+        results = bench_compression(args.entries)
+        print(f"件数: {args.entries}")
+        for name, result in results.items():
+            ratio = result["file_bytes"] / result["plaintext_bytes"]
+            print(
+                f"  {name:<5}: {result['file_bytes']:>12,} bytes ({ratio:6.1%})  "
+                f"保存 {result['write_s'] * 1000:8.1f} ms  "
+                f"読み込み {result['read_s'] * 1000:8.1f} ms"
+            )
+    elif args.command == "cli":
+        results = bench_cli_startup(args.repeat)
+        startup = results["password_manager_cli generate"]
+        print(
+            f"  python -c pass               : {results['python -c pass'] * 1000:8.1f} ms"
+        )
+        print(f"  password_manager_cli generate: {startup * 1000:8.1f} ms")
+        print(
+            f"  flet の読み込み              : {'あり' if results['imports_flet'] else 'なし'}"
+        )
+        within = startup <= CLI_STARTUP_BUDGET_S
+        print(
+            f"  目標 {CLI_STARTUP_BUDGET_S * 1000:.0f} ms 以内: {'OK' if within else '超過'}"
+        )
+        if not within or results["imports_flet"]:
+            sys.exit(1)
+    elif args.command == "kdf":
+        for name, result in bench_kdf_backends(args.repeat).items():
+            mark = "*" if result["selected"] else " "
+            if not result["verified"]:
+                print(f" {mark}{name:<28}: テストベクターと一致しないため使用しない")
+                continue
+            line = f" {mark}{name:<28}: {result['median_s'] * 1000:9.1f} ms/回"
+            if "iterations_per_s" in result:
+                line += f"  {result['iterations_per_s']:>12,.0f} 反復/秒"
+            print(line)
+        print("  * = 使用される実装")
+    elif args.command == "agent":
+        results = bench_agent_lookups(args.lookups)
+        print(f"{args.lookups} 回の取得")
+        print(f"  毎回アンロック（推定）: {results['unlock_each_s']:10.2f} s")
+        print(f"  エージェント          : {results['agent_s']:10.3f} s")
+    elif args.command == "import":
+        result = bench_import(args.entries)
+        print(f"件数: {result['entries']}（{result['file_bytes']:,} bytes）")
+        print(f"  読み込み: {result['import_s']:8.2f} s")
+        print(f"  保存    : {result['write_s']:8.2f} s")
+        print(
+            f"  パース中の一時データ（重複判定のハッシュ集合を含む）: {result['parse_overhead_bytes'] / MIB:8.1f} MiB"
+        )
+    elif args.command == "export":
+        print(f"件数: {args.entries}")
+        for fmt, result in bench_export(args.entries).items():
+            print(
+                f"  {fmt:<6}: {result['export_s']:8.2f} s  "
+                f"{result['file_bytes']:>12,} bytes  "
+                f"ピーク {result['peak_bytes'] / KIB:8.0f} KiB"
+            )
+    elif args.command == "memory":
+        result = bench_record_memory(args.entries)
+        print(f"件数: {result['entries']}")
+        print(f"  辞書のリスト : {result['dict_bytes_per_entry']:.1f} bytes/件")
+        print(f"  PasswordStore: {result['store_bytes_per_entry']:.1f} bytes/件")
+
+
+if __name__ == "__main__":
+    main()
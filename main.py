@@ -1,9 +1,26 @@
+import startup_profiler
+
+# PASSWORD_MANAGER_PROFILE_STARTUP が設定されていれば、ここから先の import 時間と
+# ロック画面を表示するまでの時間を記録する
+startup_profiler.enable_from_env()
+
 import password_manager_core
-import UI_password_manager
 import master_password_UI
 import os
 import flet as ft
 import asyncio
+import threading
+
+
+# メイン画面（UI_password_manager）はロック画面を表示した後に読み込む。
+# Nuitka でビルドしたときにも含まれるよう、文字列ではなく import 文で読み込む。
+def _preload_main_ui():
+    """ロック画面の表示後、マスターパスワードの入力中にメイン画面のモジュールを読み込んでおく"""
+    try:
+        import UI_password_manager  # noqa: F401
+    except Exception as ex:
+        print(f"警告: メイン画面の読み込みに失敗しました: {ex}")
+
 
 # 初回起動かどうかをチェックする関数
 def first_run_check():
@@ -23,52 +40,142 @@ def main(page: ft.Page):
     # アプリ起動時に設定ファイルからパスワードファイルパスを読み込む
     password_manager_core.load_password_file_path_from_config()
 
-    async def show_password_manager(master_password: str):
+    # 実行中のアンロック処理（ウィンドウを閉じたときにキャンセルする）
+    unlock_tasks = set()
+
+    def on_page_close(e):
+        for task in list(unlock_tasks):
+            task.cancel()
+
+    page.on_close = on_page_close
+
+    async def show_password_manager(
+        session: password_manager_core.VaultSession, first_run: bool = False
+    ):
         """
-        マスターパスワードを受け取り、パスワード管理UIを表示する。
+        アンロック済みのセッションを受け取り、復号をバックグラウンドで行ってから
+        パスワード管理UIを表示する。その間も進捗を表示し、ウィンドウは応答し続ける。
         """
         page.clean()
-        # main_uiにマスターパスワードを渡す
-        await UI_password_manager.main_ui(page, master_password)
+        status_text = ft.Text("パスワードファイルを復号しています...")
+        page.add(ft.Row(controls=[ft.ProgressRing(), status_text], spacing=20))
+        page.update()
 
-    def on_master_password_verified(master_password: str):
-        """
-        マスターパスワードが検証された後に呼び出されるコールバック。
-        """
+        # 開いている間はコマンドライン版が書き込まないよう、保管庫のリースを取る
+        try:
+            lease = password_manager_core.acquire_vault_lease()
+        except password_manager_core.VaultInUseError as e:
+            session.lock()
+            page.clean()
+            page.add(ft.Text(f"エラー: {e}", color=ft.Colors.RED))
+            page.update()
+            return
+
+        try:
+            if first_run:
+                # 空のパスワードファイルを作成・暗号化
+                password_manager_core.encrypt_password_file(b"", key=session.key)
+
+            all_passwords = await password_manager_core.get_decrypted_passwords_async(
+                key=session.key
+            )
+
+            status_text.value = "検索インデックスを作成しています..."
+            page.update()
+            search_index = await password_manager_core.build_search_index_async(
+                all_passwords
+            )
+        except asyncio.CancelledError:
+            session.lock()
+            lease.release()
+            raise
+        except Exception as e:
+            session.lock()
+            lease.release()
+            page.clean()
+            page.add(
+                ft.Text(
+                    f"エラー: パスワードファイルの読み込みに失敗しました: {e}",
+                    color=ft.Colors.RED,
+                )
+            )
+            return
+
+        # 通常はロック画面の表示中に読み込みが終わっている
+        import UI_password_manager
+
+        page.clean()
+        # main_uiにアンロック済みのセッションと読み込んだデータを渡す
+        await UI_password_manager.main_ui(
+            page,
+            session,
+            all_passwords,
+            search_index,
+            on_lock=show_lock_screen,
+            lease=lease,
+        )
+        startup_profiler.finish("メイン画面を表示")
+
+    def start_password_manager(
+        session: password_manager_core.VaultSession, first_run: bool = False
+    ):
         try:
             loop = asyncio.get_running_loop()
-            loop.create_task(show_password_manager(master_password))
+            task = loop.create_task(show_password_manager(session, first_run))
+            unlock_tasks.add(task)
+            task.add_done_callback(unlock_tasks.discard)
         except RuntimeError:
-            asyncio.run(show_password_manager(master_password))
+            asyncio.run(show_password_manager(session, first_run))
 
-    def on_first_run_setup_complete(master_password: str):
+    def on_master_password_verified(session: password_manager_core.VaultSession):
+        """
+        マスターパスワードで鍵ファイルをアンロックできた後に呼び出されるコールバック。
+        """
+        start_password_manager(session)
+
+    def show_lock_screen():
+        """アイドルタイムアウトでセッションがロックされたら、メイン画面を閉じてロック画面に戻る"""
+        page.clean()
+        page.overlay.clear()
+        page.on_close = on_page_close
+        master_password_UI.set_master_password_verified_callback(
+            on_master_password_verified
+        )
+        master_password_UI.master_password_input_ui(page)
+        page.update()
+
+    def on_first_run_setup_complete(session: password_manager_core.VaultSession):
         """
         初回マスターパスワード設定完了後に呼び出されるコールバック。
         空のパスワードファイルを作成・暗号化してからUIを表示する。
         """
-        # 空のパスワードファイルを作成・暗号化
-        password_manager_core.encrypt_password_file(b"", master_password)
-        # 通常のコールバックを呼び出す
-        on_master_password_verified(master_password)
-    
+        start_password_manager(session, first_run=True)
+
     # --- メインロジック ---
     if first_run_check():
         # 初回起動時
         # 1. マスターパスワード設定UIを表示
         # 2. 設定完了後、on_first_run_setup_complete が呼ばれる
-        # 3. on_first_run_setup_complete が空のパスワードファイルを作成し、on_master_password_verified を呼ぶ
-        # 4. on_master_password_verified が show_password_manager を呼ぶ
-        # 5. show_password_manager がメインUIを表示
-        master_password_UI.set_master_password_verified_callback(on_first_run_setup_complete)
+        # 3. on_first_run_setup_complete が show_password_manager を呼ぶ
+        # 4. show_password_manager が空のパスワードファイルを作成し、メインUIを表示
+        master_password_UI.set_master_password_verified_callback(
+            on_first_run_setup_complete
+        )
         master_password_UI.master_password_setup_ui(page)
     else:
         # 通常起動時
         # 1. マスターパスワード入力UIを表示
-        # 2. 検証成功後、on_master_password_verified が呼ばれる
+        # 2. 鍵ファイルのアンロック（Argon2id 1 回で検証と鍵の取り出しを行う）に成功すると、
+        #    on_master_password_verified が呼ばれる
         # 3. on_master_password_verified が show_password_manager を呼ぶ
-        # 4. show_password_manager がメインUIを表示
-        master_password_UI.set_master_password_verified_callback(on_master_password_verified)
+        # 4. show_password_manager が復号を進捗表示付きで行い、メインUIを表示
+        master_password_UI.set_master_password_verified_callback(
+            on_master_password_verified
+        )
         master_password_UI.master_password_input_ui(page)
 
+    startup_profiler.mark("ロック画面を表示（最初のフレーム）")
+    threading.Thread(target=_preload_main_ui, daemon=True).start()
+
 
 ft.app(target=main)
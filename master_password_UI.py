@@ -1,7 +1,16 @@
+import asyncio
 import flet as ft
 import password_manager_core
-import os
-import configparser
+
+AGENT_PROBE_TIMEOUT = 0.5  # 秒（ロック画面の表示を遅らせないよう短くする）
+AGENT_DIALOG_MAX_ROWS = 50  # エージェントのダイアログに表示する最大件数
+
+
+def new_session():
+    """settings.ini の [session] idle_timeout を設定した VaultSession を作る"""
+    return password_manager_core.VaultSession(
+        idle_timeout=password_manager_core.load_session_idle_timeout_from_config()
+    )
 
 
 def master_password_setup_ui(page: ft.Page):
@@ -9,7 +18,7 @@ def master_password_setup_ui(page: ft.Page):
     page.vertical_alignment = ft.MainAxisAlignment.START
 
     # デフォルト設定iniファイルを作成（初回起動時）
-    _create_default_settings_ini()
+    password_manager_core.settings.write_defaults()
 
     info_text = ft.Text(
         "マスターパスワードを12文字以上で設定してください。このパスワードはパスワードマネージャーの"
@@ -31,8 +40,9 @@ def master_password_setup_ui(page: ft.Page):
     )
 
     error_message = ft.Text(color=ft.Colors.RED)
+    progress = ft.ProgressRing(visible=False, width=24, height=24)
 
-    def set_master_password(e):
+    async def set_master_password(e):
         pwd = password_input.value
         confirm_pwd = confirm_password_input.value
 
@@ -48,12 +58,28 @@ def master_password_setup_ui(page: ft.Page):
             page.update()
             return
 
-        # マスターパスワードを保存
-        password_manager_core.hash_master_password(pwd)
+        # 新しい鍵を作ってマスターパスワードでラップする（Argon2 はスレッドで実行し、画面を止めない）
+        set_password_button.disabled = True
+        progress.visible = True
+        error_message.value = ""
+        page.update()
+        session = new_session()
+        try:
+            await password_manager_core.unlock_session_async(session, pwd, create=True)
+        except Exception as ex:
+            session.lock()
+            error_message.value = (
+                f"エラー: マスターパスワードの設定に失敗しました: {ex}"
+            )
+            return
+        finally:
+            set_password_button.disabled = False
+            progress.visible = False
+            page.update()
 
-        # コールバックを呼び出してメインUIに遷移
+        # コールバックを呼び出してメインUIに遷移（アンロック済みのセッションを渡す）
         if master_password_verified_callback:
-            master_password_verified_callback(pwd)
+            master_password_verified_callback(session)
 
     set_password_button = ft.ElevatedButton(
         text="マスターパスワードを設定", on_click=set_master_password
@@ -63,7 +89,7 @@ def master_password_setup_ui(page: ft.Page):
         info_text,
         password_input,
         confirm_password_input,
-        set_password_button,
+        ft.Row(controls=[set_password_button, progress]),
         error_message,
     )
 
@@ -85,28 +111,182 @@ def master_password_input_ui(page: ft.Page):
     )
 
     error_message = ft.Text(color=ft.Colors.RED)
+    progress = ft.ProgressRing(visible=False, width=24, height=24)
 
-    def verify_master_password(e):
+    async def verify_master_password(e):
         pwd = password_input.value
 
-        if password_manager_core.verify_master_password(pwd):
+        # 鍵ファイルのアンラップが検証を兼ねる（Argon2id 1 回）。
+        # スレッドで実行し、その間も画面が応答するようにする
+        verify_password_button.disabled = True
+        progress.visible = True
+        error_message.value = ""
+        page.update()
+        session = new_session()
+        message = None
+        try:
+            await password_manager_core.unlock_session_async(session, pwd)
+        except password_manager_core.WrongMasterPasswordError:
+            message = "エラー: マスターパスワードが正しくありません。"
+        except FileNotFoundError as ex:
+            message = f"エラー: 鍵ファイルまたはソルトファイルが見つかりません: {ex}"
+        except OSError as ex:
+            message = f"エラー: 鍵ファイルを読み込めませんでした: {ex}"
+        except ValueError as ex:
+            # 鍵ファイルのヘッダーやバージョンが不正な場合など
+            message = f"エラー: 鍵ファイルを開けませんでした: {ex}"
+        except Exception as ex:
+            message = f"エラー: アンロックに失敗しました: {ex}"
+        finally:
+            verify_password_button.disabled = False
+            progress.visible = False
+            page.update()
+
+        if message is None:
             # マスターパスワードが正しい場合のコールバックを呼び出す
             if master_password_verified_callback:
-                master_password_verified_callback(pwd)  # pwdを引数として渡す
+                master_password_verified_callback(
+                    session
+                )  # アンロック済みのセッションを渡す
         else:
-            error_message.value = "エラー: マスターパスワードが正しくありません。"
+            session.lock()
+            error_message.value = message
             page.update()
 
     verify_password_button = ft.ElevatedButton(
         text="マスターパスワードを確認", on_click=verify_master_password
     )
 
+    async def open_agent_dialog(e):
+        """
+        同じ保管庫を扱うアンロックエージェントに list / get / totp で問い合わせ、
+        パスワードや TOTP コードをコピーする（この画面の保管庫はロックしたまま）。
+        """
+        import password_manager_agent
+        from UI_password_manager import ClipboardExpiryTimer
+
+        agent_errors = (OSError, ValueError, password_manager_agent.AgentError)
+        try:
+            entries = await asyncio.to_thread(password_manager_agent.agent_list)
+        except agent_errors as ex:
+            agent_button.visible = False
+            error_message.value = f"エラー: エージェントを使えません: {ex}"
+            page.update()
+            return
+
+        status_text = ft.Text()
+        time_counter = ft.Text()
+        clipboard_timer = ClipboardExpiryTimer(page, [time_counter], delay_seconds=10)
+        rows = ft.Column(scroll=ft.ScrollMode.AUTO, height=300, width=450)
+
+        def copy_button(icon, tooltip, request):
+            async def on_click(click_e):
+                try:
+                    value = await asyncio.to_thread(request)
+                except agent_errors as ex:
+                    status_text.value = f"エラー: {ex}"
+                    page.update()
+                    return
+                page.set_clipboard(value)
+                clipboard_timer.start()
+                status_text.value = f"{tooltip}しました。"
+                page.update()
+
+            return ft.IconButton(icon=icon, tooltip=tooltip, on_click=on_click)
+
+        def entry_row(service_name, username):
+            return ft.Row(
+                controls=[
+                    ft.Text(f"{service_name} / {username}", expand=True),
+                    copy_button(
+                        ft.Icons.COPY,
+                        "パスワードをコピー",
+                        lambda: password_manager_agent.agent_get(
+                            service_name, username
+                        )[1],
+                    ),
+                    copy_button(
+                        ft.Icons.TIMER,
+                        "TOTP コードをコピー",
+                        lambda: password_manager_agent.agent_totp(
+                            service_name, username
+                        ),
+                    ),
+                ]
+            )
+
+        def show_entries(query=""):
+            query = query.strip().lower()
+            matches = [
+                entry
+                for entry in entries
+                if query in entry[0].lower() or query in entry[1].lower()
+            ]
+            rows.controls = [
+                entry_row(service_name, username)
+                for service_name, username in matches[:AGENT_DIALOG_MAX_ROWS]
+            ]
+            if len(matches) > AGENT_DIALOG_MAX_ROWS:
+                rows.controls.append(
+                    ft.Text(
+                        f"ほか {len(matches) - AGENT_DIALOG_MAX_ROWS} 件（検索で絞り込んでください）"
+                    )
+                )
+
+        def on_search(search_e):
+            show_entries(search_e.control.value)
+            page.update()
+
+        def on_close_dialog(close_e):
+            # クリップボードのクリアは、ダイアログを閉じた後も予定どおり行う
+            dlg.open = False
+            page.update()
+
+        show_entries()
+        dlg = ft.AlertDialog(
+            modal=True,
+            title=ft.Text("エージェントから取得"),
+            content=ft.Column(
+                controls=[
+                    ft.TextField(label="検索", on_change=on_search, autofocus=True),
+                    rows,
+                    status_text,
+                    time_counter,
+                ],
+                tight=True,
+            ),
+            actions=[ft.TextButton("閉じる", on_click=on_close_dialog)],
+        )
+        page.dialog = dlg
+        dlg.open = True
+        page.add(dlg)
+        page.update()
+
+    # エージェントの確認（import と接続）はロック画面を表示した後にバックグラウンドで行い、
+    # 同じ保管庫を扱うエージェントが動いていればボタンを表示する
+    agent_button = ft.OutlinedButton(
+        text="エージェントから取得", on_click=open_agent_dialog, visible=False
+    )
+
+    async def probe_agent():
+        def probe():
+            import password_manager_agent
+
+            return password_manager_agent.agent_serves_current_vault(
+                timeout=AGENT_PROBE_TIMEOUT
+            )
+
+        if await asyncio.to_thread(probe):
+            agent_button.visible = True
+            page.update()
+
     page.add(
         info_text,
         password_input,
-        verify_password_button,
+        ft.Row(controls=[verify_password_button, agent_button, progress]),
         error_message,
     )
+    page.run_task(probe_agent)
 
 
 master_password_verified_callback = None
@@ -115,26 +295,3 @@ master_password_verified_callback = None
 def set_master_password_verified_callback(callback):
     global master_password_verified_callback
     master_password_verified_callback = callback
-
-
-def _create_default_settings_ini():
-    """初回起動時にデフォルト Argon2 設定を含む settings.ini を作成"""
-    settings_path = os.path.join("password_file", "settings.ini")
-    if os.path.exists(settings_path):
-        return  # 既に存在する場合は作成しない
-
-    os.makedirs(os.path.dirname(settings_path), exist_ok=True)
-    cfg = configparser.ConfigParser()
-    cfg["argon2"] = {
-        "memory_cost": "102400",
-        "time_cost": "2",
-        "parallelism": "8",
-    }
-    cfg["file_paths"] = {
-        "password_file": "password_file\\passwords.txt",
-    }
-    try:
-        with open(settings_path, "w", encoding="utf-8") as f:
-            cfg.write(f)
-    except Exception as ex:
-        print(f"警告: デフォルト settings.ini の作成に失敗しました: {ex}")
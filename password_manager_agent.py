@@ -0,0 +1,600 @@
+"""
+アンロックエージェント（ssh-agent のように、一度アンロックした保管庫をメモリ上に保持する常駐プロセス）
+
+    eval "$(uv run python password_manager_agent.py start < master_password.txt)"
+    uv run python password_manager_cli.py get example.com   # マスターパスワードの入力なしで取得できる
+    uv run python password_manager_agent.py stop
+
+エージェントは起動時に一度だけ鍵ファイルから DEK を取り出し、Unix ドメインソケットで
+list / get / totp の要求に応える。最後の要求から [agent] idle_timeout 秒が経過すると
+鍵を消去して終了する。CLI（list / get / totp）と GUI のロック画面は、同じ保管庫を扱う
+エージェントが動いていればそれを使う。DEK そのものはエージェントの外に出さない。
+
+ソケットは所有者だけが入れるディレクトリ（0700）に 0600 で作成し、接続してきたプロセスの
+UID も確認する（SO_PEERCRED が使える場合）。同じユーザーのプロセスはすべてのパスワードを
+取得できるため、エージェントが動いている間は保管庫がアンロックされているのと同じ扱いになる。
+Unix ドメインソケットを使うため、Windows では使えない。
+
+プロトコル（要求・応答とも同じ形式のフレーム）:
+    本文の長さ（uint32）| コード（uint8）| フィールド数（uint16）| [フィールド長（uint32）| フィールド] ...
+要求のコードは OP_*、応答のコードは STATUS_*。フィールドはすべて UTF-8 のバイト列。
+"""
+
+import argparse
+import os
+import socket
+import struct
+import sys
+import threading
+
+import password_manager_core
+
+AGENT_SOCKET_ENV = "PASSWORD_MANAGER_AGENT_SOCK"
+AGENT_SOCKET_NAME = "agent.sock"
+AGENT_MAX_FRAME_BYTES = 1 << 20
+AGENT_CLIENT_TIMEOUT = 5.0  # 秒
+AGENT_WATCH_INTERVAL = 1.0  # 秒（アイドルタイムアウトと保管庫の更新を確認する間隔）
+
+_FRAME_HEADER = struct.Struct(">IBH")  # 本文の長さ、コード、フィールド数
+_FIELD_LENGTH = struct.Struct(">I")
+
+OP_PING = 1  # 応答: [保管庫のパス]
+OP_LIST = 2  # 応答: [サービス名, ユーザー名, サービス名, ユーザー名, ...]
+OP_GET = 3  # 要求: [サービス名, (ユーザー名)] / 応答: [ユーザー名, パスワード]
+OP_TOTP = 4  # 要求: [サービス名, (ユーザー名)] / 応答: [TOTP コード]
+OP_STOP = 6  # 鍵を消去してエージェントを終了する
+
+STATUS_OK = 0
+STATUS_NOT_FOUND = 1
+STATUS_AMBIGUOUS = 2
+STATUS_LOCKED = 3
+STATUS_BAD_REQUEST = 4
+STATUS_ERROR = 5
+
+
+class AgentError(Exception):
+    """エージェントがエラーを返したことを示す例外（status に STATUS_* が入る）"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def agent_supported():
+    """この環境でエージェント（Unix ドメインソケット）が使えるか"""
+    return os.name != "nt" and hasattr(socket, "AF_UNIX")
+
+
+def agent_socket_path():
+    """
+    ソケットのパスを返す。環境変数 PASSWORD_MANAGER_AGENT_SOCK があればそれを使い、
+    なければ $XDG_RUNTIME_DIR（なければ一時ディレクトリ）の下のユーザー専用ディレクトリに置く。
+    """
+    path = os.environ.get(AGENT_SOCKET_ENV)
+    if path:
+        return path
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        return os.path.join(runtime_dir, "password-manager", AGENT_SOCKET_NAME)
+    import tempfile
+
+    return os.path.join(
+        tempfile.gettempdir(), f"password-manager-{os.getuid()}", AGENT_SOCKET_NAME
+    )
+
+
+# ---- フレーム ----
+
+
+def encode_frame(code, fields=()):
+    body = b"".join(_FIELD_LENGTH.pack(len(field)) + field for field in fields)
+    return _FRAME_HEADER.pack(len(body), code, len(fields)) + body
+
+
+def _frame_length(header):
+    """ヘッダーから本文の長さ・コード・フィールド数を取り出す（大きすぎるフレームは拒否する）"""
+    length, code, count = _FRAME_HEADER.unpack(header)
+    if length > AGENT_MAX_FRAME_BYTES:
+        raise ValueError("フレームが大きすぎます。")
+    return length, code, count
+
+
+def decode_fields(body, count):
+    fields = []
+    pos = 0
+    for _ in range(count):
+        if pos + _FIELD_LENGTH.size > len(body):
+            raise ValueError("フレームが壊れています。")
+        (length,) = _FIELD_LENGTH.unpack_from(body, pos)
+        pos += _FIELD_LENGTH.size
+        if pos + length > len(body):
+            raise ValueError("フレームが壊れています。")
+        fields.append(body[pos : pos + length])
+        pos += length
+    if pos != len(body):
+        raise ValueError("フレームが壊れています。")
+    return fields
+
+
+# ---- クライアント ----
+
+
+def _recv_exact(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("エージェントとの接続が切断されました。")
+        data += chunk
+    return bytes(data)
+
+
+def agent_request(op, *fields, path=None, timeout=AGENT_CLIENT_TIMEOUT):
+    """
+    エージェントに要求を送り、応答のフィールドを返す。
+    エージェントが動いていない場合は OSError、エラー応答の場合は AgentError。
+    """
+    if not agent_supported():
+        raise OSError("この環境ではアンロックエージェントを使えません。")
+    fields = [f.encode("utf-8") if isinstance(f, str) else f for f in fields]
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(path or agent_socket_path())
+        sock.sendall(encode_frame(op, fields))
+        length, status, count = _frame_length(_recv_exact(sock, _FRAME_HEADER.size))
+        response = decode_fields(_recv_exact(sock, length), count)
+    if status != STATUS_OK:
+        message = response[0].decode("utf-8") if response else ""
+        raise AgentError(status, message or "エージェントがエラーを返しました。")
+    return response
+
+
+def agent_vault_path(path=None, timeout=AGENT_CLIENT_TIMEOUT):
+    """
+    動いているエージェントが扱う保管庫のパスを返す（エージェントがなければ None）。
+    別の保管庫のエージェントを使わないよう、呼び出し側で get_password_file_path() と比べる。
+    """
+    try:
+        (vault_path,) = agent_request(OP_PING, path=path, timeout=timeout)
+    except (OSError, ValueError, AgentError):
+        return None
+    return vault_path.decode("utf-8")
+
+
+def agent_serves_current_vault(path=None, timeout=AGENT_CLIENT_TIMEOUT):
+    """現在のパスワードファイルを扱うエージェントが動いているか"""
+    vault_path = agent_vault_path(path, timeout)
+    return vault_path is not None and vault_path == os.path.abspath(
+        password_manager_core.get_password_file_path()
+    )
+
+
+def agent_list(path=None):
+    """(サービス名, ユーザー名) の一覧を返す"""
+    fields = [f.decode("utf-8") for f in agent_request(OP_LIST, path=path)]
+    return list(zip(fields[0::2], fields[1::2]))
+
+
+def _selector(service_name, username):
+    return (service_name,) if username is None else (service_name, username)
+
+
+def agent_get(service_name, username=None, path=None):
+    """(ユーザー名, パスワード) を返す"""
+    username, password = agent_request(
+        OP_GET, *_selector(service_name, username), path=path
+    )
+    return username.decode("utf-8"), password.decode("utf-8")
+
+
+def agent_totp(service_name, username=None, path=None):
+    """現在の TOTP コードを返す"""
+    (code,) = agent_request(OP_TOTP, *_selector(service_name, username), path=path)
+    return code.decode("utf-8")
+
+
+def agent_stop(path=None):
+    agent_request(OP_STOP, path=path)
+
+
+# ---- エージェント本体 ----
+
+
+def _prepare_socket_dir(socket_path):
+    """ソケットを置くディレクトリを所有者専用（0700）で用意する"""
+    directory = os.path.dirname(os.path.abspath(socket_path))
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    st = os.stat(directory)
+    if st.st_uid != os.getuid():
+        raise ValueError(f"{directory} は別のユーザーが所有しています。")
+    if st.st_mode & 0o022:
+        raise ValueError(f"{directory} は他のユーザーが書き込めるため使えません。")
+
+
+def _peer_uid(writer):
+    """接続してきたプロセスの UID（調べられない環境では None）"""
+    sock = writer.get_extra_info("socket")
+    if sock is None or not hasattr(socket, "SO_PEERCRED"):
+        return None
+    creds = sock.getsockopt(
+        socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i")
+    )
+    _pid, uid, _gid = struct.unpack("3i", creds)
+    return uid
+
+
+class VaultAgent:
+    """
+    アンロック済みの VaultSession を保持して要求に応える。
+    パスワードファイル（とジャーナル）が GUI などで更新された場合は、次の要求で読み直す。
+    """
+
+    def __init__(self, session, socket_path=None, filepath=None):
+        self.session = session
+        self.socket_path = socket_path or agent_socket_path()
+        self.filepath = os.path.abspath(
+            filepath or password_manager_core.get_password_file_path()
+        )
+        self._store = None
+        self._store_stamp = None
+        self._store_lock = (
+            threading.Lock()
+        )  # 要求はワーカースレッドで並行して処理される
+        self._stopped = None
+
+    def _vault_stamp(self):
+        stamp = []
+        for path in (
+            self.filepath,
+            password_manager_core.journal_path_for(self.filepath),
+        ):
+            try:
+                st = os.stat(path)
+                stamp.append((st.st_mtime_ns, st.st_size))
+            except FileNotFoundError:
+                stamp.append(None)
+        return tuple(stamp)
+
+    def store(self):
+        with self._store_lock:
+            stamp = self._vault_stamp()
+            if self._store is None or stamp != self._store_stamp:
+                self._store = password_manager_core.get_decrypted_passwords(
+                    filepath=self.filepath, key=self.session.key
+                )
+                self._store_stamp = stamp
+            return self._store
+
+    def _find(self, fields):
+        if not 1 <= len(fields) <= 2:
+            raise AgentError(STATUS_BAD_REQUEST, "サービス名を指定してください。")
+        service_name = fields[0].decode("utf-8")
+        username = fields[1].decode("utf-8") if len(fields) == 2 else None
+        store = self.store()
+        matches = store.find(service_name, username)
+        if not matches:
+            raise AgentError(
+                STATUS_NOT_FOUND, f"エントリが見つかりません: {service_name}"
+            )
+        if len(matches) > 1:
+            usernames = ", ".join(store[i].username for i in matches)
+            raise AgentError(
+                STATUS_AMBIGUOUS,
+                f"{service_name} のエントリが複数あります（{usernames}）。ユーザー名で指定してください。",
+            )
+        return store[matches[0]]
+
+    async def handle(self, op, fields):
+        """
+        要求を処理して (STATUS_*, 応答のフィールド) を返す。
+        保管庫の読み直し（復号）や復号を伴う要求はワーカースレッドで処理し、
+        その間もイベントループはほかの接続に応答する。
+        """
+        import asyncio
+
+        if op == OP_PING:
+            return STATUS_OK, [self.filepath]
+        if op == OP_STOP:
+            self.stop()
+            return STATUS_OK, []
+        status, result = await asyncio.to_thread(self._respond, op, fields)
+        if status == STATUS_LOCKED:
+            self.stop()  # イベントループ上で止める
+        return status, result
+
+    def _respond(self, op, fields):
+        """
+        list / get / totp を処理する（ワーカースレッドで呼ばれる）。
+        どの要求もアイドルタイマーをリセットする（一覧を取得するだけのクライアントでも終了しない）。
+        ping は状態の確認に使われるため、アイドルタイマーをリセットしない。
+        """
+        try:
+            self.session.touch()
+            if op == OP_LIST:
+                result = []
+                for record in self.store():
+                    result += [record.service_name, record.username]
+                return STATUS_OK, result
+            if op == OP_GET:
+                record = self._find(fields)
+                return STATUS_OK, [
+                    record.username,
+                    self.session.reveal(record.password),
+                ]
+            if op == OP_TOTP:
+                record = self._find(fields)
+                secret = self.session.reveal(record.totp_secret)
+                if not secret:
+                    raise AgentError(
+                        STATUS_NOT_FOUND,
+                        f"{record.service_name} に TOTP シークレットキーが登録されていません。",
+                    )
+                return STATUS_OK, [password_manager_core.generate_totp_code(secret)]
+        except AgentError as ex:
+            return ex.status, [str(ex)]
+        except password_manager_core.VaultLockedError as ex:
+            return STATUS_LOCKED, [str(ex)]
+        except (OSError, ValueError) as ex:
+            return STATUS_ERROR, [str(ex)]
+        return STATUS_BAD_REQUEST, ["不明な要求です。"]
+
+    async def _handle_client(self, reader, writer):
+        import asyncio
+
+        try:
+            uid = _peer_uid(writer)
+            if uid is not None and uid != os.getuid():
+                return
+            while not self._stopped.is_set():
+                try:
+                    header = await reader.readexactly(_FRAME_HEADER.size)
+                except asyncio.IncompleteReadError:
+                    return
+                try:
+                    length, op, count = _frame_length(header)
+                    fields = decode_fields(await reader.readexactly(length), count)
+                except ValueError as ex:
+                    writer.write(
+                        encode_frame(STATUS_BAD_REQUEST, [str(ex).encode("utf-8")])
+                    )
+                    await writer.drain()
+                    return
+                status, result = await self.handle(op, fields)
+                writer.write(
+                    encode_frame(
+                        status,
+                        [
+                            f.encode("utf-8") if isinstance(f, str) else f
+                            for f in result
+                        ],
+                    )
+                )
+                await writer.drain()
+        except (OSError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _watch(self):
+        """アイドルタイムアウトで鍵が消去されたらエージェントを終了する"""
+        import asyncio
+
+        while not self._stopped.is_set():
+            if not self.session.is_unlocked():
+                self.stop()
+                return
+            try:
+                await asyncio.wait_for(
+                    self._stopped.wait(), timeout=AGENT_WATCH_INTERVAL
+                )
+            except asyncio.TimeoutError:
+                pass
+
+    def stop(self):
+        """鍵を消去してエージェントを終了する"""
+        self.session.lock()
+        if self._stopped is not None:
+            self._stopped.set()
+
+    async def serve(self, on_ready=None):
+        """ソケットで要求を待ち受ける（stop() されるかアイドルタイムアウトまで戻らない）"""
+        import asyncio
+
+        self._stopped = asyncio.Event()
+        _prepare_socket_dir(self.socket_path)
+        if os.path.exists(self.socket_path):
+            if agent_vault_path(self.socket_path, timeout=1.0) is not None:
+                raise ValueError(
+                    f"エージェントはすでに起動しています: {self.socket_path}"
+                )
+            os.unlink(self.socket_path)  # 前回異常終了したときのソケット
+
+        old_umask = os.umask(0o177)
+        try:
+            server = await asyncio.start_unix_server(
+                self._handle_client, self.socket_path
+            )
+        finally:
+            os.umask(old_umask)
+        os.chmod(self.socket_path, 0o600)
+        try:
+            await asyncio.to_thread(self.store)  # 起動時に復号できることを確認しておく
+            if on_ready is not None:
+                on_ready()
+            await self._watch()
+        finally:
+            server.close()
+            self.session.lock()
+            try:
+                os.unlink(self.socket_path)
+            except FileNotFoundError:
+                pass
+
+
+def run_agent(master_password, socket_path=None, idle_timeout=None, on_ready=None):
+    """マスターパスワードでアンロックし、終了するまでエージェントとして動く"""
+    import asyncio
+
+    if idle_timeout is None:
+        idle_timeout = password_manager_core.settings.get("agent", "idle_timeout")
+    session = password_manager_core.VaultSession(idle_timeout=idle_timeout or None)
+    try:
+        session.unlock(master_password)
+    except ValueError:
+        raise ValueError("マスターパスワードが正しくありません。")
+    asyncio.run(VaultAgent(session, socket_path).serve(on_ready))
+
+
+# ---- コマンドライン ----
+
+
+def _shell_exports(socket_path, pid):
+    """eval で環境変数を設定できる形式（ssh-agent と同じ）"""
+    return (
+        f"{AGENT_SOCKET_ENV}={socket_path}; export {AGENT_SOCKET_ENV};\n"
+        f"echo アンロックエージェントを起動しました（pid {pid}）;"
+    )
+
+
+def _start_in_background(master_password, socket_path, idle_timeout):
+    """
+    子プロセスをデーモンとして起動し、アンロックが終わるまで待つ。
+    子プロセスはパイプで準備完了（またはエラー）を知らせる。
+    """
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid:
+        os.close(write_fd)
+        with os.fdopen(read_fd, "rb") as pipe:
+            message = pipe.read().decode("utf-8")
+        if message != "OK":
+            os.waitpid(pid, 0)
+            raise ValueError(message or "エージェントの起動に失敗しました。")
+        print(_shell_exports(socket_path, pid))
+        return
+
+    os.close(read_fd)
+    os.setsid()
+    devnull = os.open(os.devnull, os.O_RDWR)
+    for fd in (0, 1, 2):
+        os.dup2(devnull, fd)
+
+    def notify_ready():
+        os.write(write_fd, b"OK")
+        os.close(write_fd)
+
+    status = 0
+    try:
+        run_agent(master_password, socket_path, idle_timeout, on_ready=notify_ready)
+    except Exception as ex:
+        try:
+            os.write(write_fd, str(ex).encode("utf-8"))
+            os.close(write_fd)
+        except OSError:
+            pass
+        status = 1
+    os._exit(status)
+
+
+def cmd_start(args):
+    from password_manager_cli import CliError, read_master_password
+
+    if not password_manager_core.master_password_exists():
+        raise CliError(
+            "マスターパスワードが設定されていません。先に main.py で設定してください。"
+        )
+    socket_path = os.path.abspath(args.socket or agent_socket_path())
+    if agent_vault_path(socket_path, timeout=1.0) is not None:
+        raise CliError(f"エージェントはすでに起動しています: {socket_path}")
+    master_password = read_master_password(args.password_fd)
+    if args.foreground:
+        run_agent(
+            master_password,
+            socket_path,
+            args.idle_timeout,
+            on_ready=lambda: print(
+                _shell_exports(socket_path, os.getpid()), flush=True
+            ),
+        )
+    else:
+        _start_in_background(master_password, socket_path, args.idle_timeout)
+
+
+def cmd_stop(args):
+    agent_stop(args.socket)
+    print("アンロックエージェントを停止しました。")
+
+
+def cmd_status(args):
+    vault_path = agent_vault_path(args.socket)
+    if vault_path is None:
+        print("アンロックエージェントは起動していません。")
+        return 1
+    print(f"{args.socket or agent_socket_path()}: {vault_path}")
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="password_manager_agent",
+        description="パスワードマネージャーのアンロックエージェント",
+    )
+    parser.add_argument(
+        "--socket",
+        help=f"ソケットのパス（省略時は環境変数 {AGENT_SOCKET_ENV} または既定の場所）",
+    )
+    parser.add_argument(
+        "--data-dir",
+        help="password_file ディレクトリがある場所（省略時はカレントディレクトリ）",
+    )
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    start = sub.add_parser("start", help="アンロックしてエージェントを起動する")
+    start.add_argument(
+        "--password-fd",
+        type=int,
+        help="マスターパスワードを読み込むファイルディスクリプタ",
+    )
+    start.add_argument(
+        "--idle-timeout",
+        type=int,
+        help="最後の要求から終了するまでの秒数（省略時は settings.ini の [agent] idle_timeout）",
+    )
+    start.add_argument(
+        "--foreground", action="store_true", help="バックグラウンドに移らずに動く"
+    )
+    start.set_defaults(func=cmd_start)
+
+    sub.add_parser("stop", help="鍵を消去してエージェントを終了する").set_defaults(
+        func=cmd_stop
+    )
+    sub.add_parser("status", help="エージェントが起動しているか表示する").set_defaults(
+        func=cmd_status
+    )
+    return parser
+
+
+def main(argv=None):
+    from password_manager_cli import CliError
+
+    args = build_parser().parse_args(argv)
+    if not agent_supported():
+        print(
+            "エラー: この環境ではアンロックエージェントを使えません。", file=sys.stderr
+        )
+        return 1
+    try:
+        if args.data_dir:
+            os.chdir(args.data_dir)
+        password_manager_core.load_password_file_path_from_config()
+        return args.func(args) or 0
+    except (CliError, AgentError) as ex:
+        print(f"エラー: {ex}", file=sys.stderr)
+        return 1
+    except (OSError, ValueError) as ex:
+        print(f"エラー: {ex}", file=sys.stderr)
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,490 @@
+"""
+パスワードマネージャーのコマンドライン版（GUI を起動せずにパスワードを読み書きする）
+
+    uv run python password_manager_cli.py list < master_password.txt
+    uv run python password_manager_cli.py get example.com
+    uv run python password_manager_cli.py generate --length 24 --count 5
+    uv run python password_manager_cli.py import bitwarden_export.csv < master_password.txt
+    uv run python password_manager_cli.py export backup.pmb   # 暗号化したバンドル（パスフレーズも入力する）
+
+マスターパスワードは次の順で読み込む（コマンドライン引数では受け取らない）。
+  1. --password-fd（または環境変数 PASSWORD_MANAGER_PASSWORD_FD）で指定したファイルディスクリプタの 1 行目
+  2. 標準入力が端末なら getpass で入力
+  3. 標準入力の 1 行目
+add / edit で登録するパスワードと TOTP シークレット、export / import のバンドルのパスフレーズは、
+その後に続く標準入力の行から読み込む。
+list / get / totp は、同じ保管庫を扱うアンロックエージェント（password_manager_agent.py）が
+動いていれば、マスターパスワードを読まずにエージェントに問い合わせる（--no-agent で無効）。
+
+flet は読み込まない。起動時間は `python benchmark.py cli` で計測できる。
+"""
+
+import argparse
+import contextlib
+import os
+import sys
+
+import password_manager_core
+
+PASSWORD_FD_ENV = "PASSWORD_MANAGER_PASSWORD_FD"
+DEFAULT_PASSWORD_LENGTH = 24
+
+
+class CliError(Exception):
+    """利用者に表示して終了するエラー"""
+
+
+def _read_line(stream, label):
+    """端末なら getpass で、それ以外は 1 行読み込む（末尾の改行は取り除く）"""
+    if stream.isatty():
+        import getpass
+
+        return getpass.getpass(f"{label}: ")
+    line = stream.readline()
+    if not line:
+        raise CliError(f"{label}が入力されていません。")
+    return line.rstrip("\r\n")
+
+
+def read_master_password(password_fd=None):
+    """マスターパスワードをファイルディスクリプタまたは標準入力から読み込む"""
+    if password_fd is None and os.environ.get(PASSWORD_FD_ENV):
+        password_fd = os.environ[PASSWORD_FD_ENV]
+    if password_fd is not None:
+        try:
+            with os.fdopen(int(password_fd), "r", encoding="utf-8") as f:
+                return _read_line(f, "マスターパスワード")
+        except (OSError, ValueError) as ex:
+            raise CliError(
+                f"ファイルディスクリプタ {password_fd} を読み込めません: {ex}"
+            )
+    return _read_line(sys.stdin, "マスターパスワード")
+
+
+def _unlock(args):
+    if not password_manager_core.master_password_exists():
+        raise CliError(
+            "マスターパスワードが設定されていません。先に main.py で設定してください。"
+        )
+    master_password = read_master_password(args.password_fd)
+    session = password_manager_core.VaultSession(
+        idle_timeout=password_manager_core.load_session_idle_timeout_from_config()
+    )
+    try:
+        session.unlock(master_password)
+    except ValueError:
+        raise CliError("マスターパスワードが正しくありません。")
+    return session
+
+
+@contextlib.contextmanager
+def _vault_lease():
+    """
+    保管庫を変更するコマンドの間、書き込み用のリースを保持する。
+    GUI が同じ保管庫を開いている間は、GUI がメモリ上の内容で上書きしてしまうため書き込まない。
+    """
+    try:
+        lease = password_manager_core.acquire_vault_lease()
+    except password_manager_core.VaultInUseError as ex:
+        raise CliError(f"{ex}GUI を閉じてから実行してください。")
+    try:
+        yield
+    finally:
+        lease.release()
+
+
+def _ask_agent(args, request):
+    """
+    同じ保管庫を扱うアンロックエージェントが動いていれば request(エージェントのモジュール) の結果を返す。
+    エージェントがない・途中でロックされた場合は None を返し、呼び出し側で通常どおりアンロックする。
+    """
+    if args.no_agent:
+        return None
+    import password_manager_agent
+
+    if not password_manager_agent.agent_serves_current_vault():
+        return None
+    try:
+        return request(password_manager_agent)
+    except password_manager_agent.AgentError as ex:
+        if ex.status == password_manager_agent.STATUS_LOCKED:
+            return None
+        raise CliError(str(ex))
+    except OSError:
+        return None
+
+
+def _find_record(store, service_name, username=None):
+    """サービス名（とユーザー名）が一致するレコードの位置を返す"""
+    matches = store.find(service_name, username)
+    if not matches:
+        raise CliError(f"エントリが見つかりません: {service_name}")
+    if len(matches) > 1:
+        usernames = ", ".join(store[i].username for i in matches)
+        raise CliError(
+            f"{service_name} のエントリが複数あります（{usernames}）。--username で指定してください。"
+        )
+    return matches[0]
+
+
+def _new_password(args):
+    if args.generate:
+        return password_manager_core.generate_secure_password(
+            args.length, not args.no_symbols
+        )
+    return _read_line(sys.stdin, "パスワード")
+
+
+def _read_totp_secret():
+    secret = _read_line(sys.stdin, "TOTP シークレットキー").strip()
+    if secret and not password_manager_core.totp_secret_is_valid(secret):
+        raise CliError("TOTP シークレットキーが不正です。")
+    return secret
+
+
+def _save(session, store, op, index, record=None):
+    """
+    GUI と同じく、保存方式（snapshot / journal）に合わせて変更を書き込む
+    （読み込みから続けて vault_lock() の中で呼ぶ）。
+    """
+    if password_manager_core.load_storage_mode_from_config() == "journal":
+        journal = password_manager_core.VaultJournal(session)
+        journal.append(op, index, record)
+        if journal.needs_compaction():
+            journal.compact(*journal.snapshot(store))
+    else:
+        password_manager_core.encrypt_password_file(
+            password_manager_core.serialize_passwords(store), key=session.key
+        )
+
+
+def cmd_list(args):
+    entries = _ask_agent(args, lambda agent: agent.agent_list())
+    if entries is not None:
+        for service_name, username in entries:
+            print(f"{service_name}\t{username}")
+        return
+    with _unlock(args) as session:
+        for record in password_manager_core.get_decrypted_passwords(key=session.key):
+            print(f"{record.service_name}\t{record.username}")
+
+
+def cmd_get(args):
+    entry = _ask_agent(args, lambda agent: agent.agent_get(args.service, args.username))
+    if entry is not None:
+        username, password = entry
+        print(username if args.field == "username" else password)
+        return
+    with _unlock(args) as session:
+        store = password_manager_core.get_decrypted_passwords(key=session.key)
+        record = store[_find_record(store, args.service, args.username)]
+        if args.field == "username":
+            print(record.username)
+        else:
+            print(session.reveal(record.password))
+
+
+def cmd_totp(args):
+    code = _ask_agent(args, lambda agent: agent.agent_totp(args.service, args.username))
+    if code is not None:
+        print(code)
+        return
+    with _unlock(args) as session:
+        store = password_manager_core.get_decrypted_passwords(key=session.key)
+        record = store[_find_record(store, args.service, args.username)]
+        secret = session.reveal(record.totp_secret)
+        if not secret:
+            raise CliError(
+                f"{args.service} に TOTP シークレットキーが登録されていません。"
+            )
+        try:
+            print(password_manager_core.generate_totp_code(secret))
+        except ValueError:
+            raise CliError("TOTP シークレットキーが不正です。")
+
+
+# 変更するコマンドは、入力を読み終えてから vault_lock() を取り、読み込みから保存までをその中で行う
+
+
+def cmd_add(args):
+    with _vault_lease(), _unlock(args) as session:
+        password = _new_password(args)
+        totp_secret = _read_totp_secret() if args.totp else ""
+        record = password_manager_core.PasswordRecord(
+            args.service,
+            args.username,
+            session.seal(password),
+            session.seal(totp_secret),
+            totp_valid=True if totp_secret else None,
+        )
+        with password_manager_core.vault_lock():
+            store = password_manager_core.get_decrypted_passwords(key=session.key)
+            index = store.add(record)
+            _save(session, store, password_manager_core.JOURNAL_OP_ADD, index, record)
+        if args.generate and args.print:
+            print(password)
+
+
+def cmd_edit(args):
+    with _vault_lease(), _unlock(args) as session:
+        new_password = new_secret = None
+        if args.password or args.generate:
+            new_password = _new_password(args)
+        if args.totp and not args.clear_totp:
+            new_secret = _read_totp_secret()
+        with password_manager_core.vault_lock():
+            store = password_manager_core.get_decrypted_passwords(key=session.key)
+            index = _find_record(store, args.service, args.username)
+            old = store[index]
+            password = old.password
+            if new_password is not None:
+                password = session.seal(new_password)
+            totp_secret, totp_valid = old.totp_secret, old.totp_valid
+            if args.clear_totp:
+                totp_secret, totp_valid = "", None
+            elif new_secret is not None:
+                totp_secret = session.seal(new_secret)
+                totp_valid = True if new_secret else None
+            record = password_manager_core.PasswordRecord(
+                args.new_service or old.service_name,
+                args.new_username or old.username,
+                password,
+                totp_secret,
+                totp_valid=totp_valid,
+                extra_fields=old.extra_fields,  # このバージョンが扱わないフィールドは保持する
+            )
+            store.update(index, record)
+            _save(
+                session, store, password_manager_core.JOURNAL_OP_UPDATE, index, record
+            )
+        if args.generate and args.print:
+            print(new_password)
+
+
+def cmd_rm(args):
+    with _vault_lease(), _unlock(args) as session:
+        with password_manager_core.vault_lock():
+            store = password_manager_core.get_decrypted_passwords(key=session.key)
+            index = _find_record(store, args.service, args.username)
+            store.delete(index)
+            _save(session, store, password_manager_core.JOURNAL_OP_DELETE, index)
+
+
+def _read_bundle_passphrase():
+    return _read_line(sys.stdin, "バンドルのパスフレーズ")
+
+
+def cmd_import(args):
+    import password_manager_import
+
+    fmt = args.format or password_manager_import.detect_import_format(args.file)
+
+    def show_progress(result):
+        print(
+            f"\r{result.rows} 件を読み込みました", end="", file=sys.stderr, flush=True
+        )
+
+    with _vault_lease(), _unlock(args) as session:
+        passphrase = _read_bundle_passphrase() if fmt == "bundle" else None
+        with password_manager_core.vault_lock():
+            store = password_manager_core.get_decrypted_passwords(key=session.key)
+            result = password_manager_import.import_file(
+                session,
+                store,
+                args.file,
+                fmt,
+                progress=show_progress if sys.stderr.isatty() else None,
+                passphrase=passphrase,
+            )
+            if sys.stderr.isatty():
+                print(file=sys.stderr)
+            if result.added:
+                password_manager_import.write_imported_store(session, store)
+        print(
+            f"追加: {result.added} 件 / 重複: {result.duplicates} 件 / "
+            f"スキップ: {result.skipped} 件"
+        )
+
+
+def cmd_export(args):
+    import password_manager_export
+
+    fmt = args.format or password_manager_export.export_format_for(args.file)
+    with _unlock(args) as session:
+        passphrase = _read_bundle_passphrase() if fmt == "bundle" else None
+        store = password_manager_core.get_decrypted_passwords(key=session.key)
+        count = password_manager_export.export_file(
+            session, store, args.file, fmt, passphrase=passphrase
+        )
+    print(f"{count} 件をエクスポートしました: {args.file}")
+    if fmt != "bundle":
+        print(
+            "警告: パスワードが平文で保存されています。使い終わったら削除してください。",
+            file=sys.stderr,
+        )
+
+
+def cmd_generate(args):
+    # マスターパスワードは不要
+    try:
+        passwords = password_manager_core.generate_secure_passwords(
+            [args.length] * args.count, not args.no_symbols
+        )
+    except ValueError as ex:
+        raise CliError(str(ex))
+    print("\n".join(passwords))
+
+
+def _add_selector(parser):
+    parser.add_argument("service", help="サービス名")
+    parser.add_argument(
+        "--username", help="同じサービス名のエントリが複数ある場合のユーザー名"
+    )
+
+
+def _add_generate_options(parser):
+    parser.add_argument(
+        "--generate", action="store_true", help="パスワードを自動生成する"
+    )
+    parser.add_argument("--length", type=int, default=DEFAULT_PASSWORD_LENGTH)
+    parser.add_argument(
+        "--no-symbols", action="store_true", help="記号を使わずに生成する"
+    )
+    parser.add_argument(
+        "--print", action="store_true", help="生成したパスワードを表示する"
+    )
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="password_manager_cli",
+        description="パスワードマネージャー（コマンドライン版）",
+    )
+    parser.add_argument(
+        "--password-fd",
+        type=int,
+        help=f"マスターパスワードを読み込むファイルディスクリプタ（環境変数 {PASSWORD_FD_ENV} でも指定可）",
+    )
+    parser.add_argument(
+        "--data-dir",
+        help="password_file ディレクトリがある場所（省略時はカレントディレクトリ）",
+    )
+    parser.add_argument(
+        "--no-agent",
+        action="store_true",
+        help="アンロックエージェントが動いていても使わない",
+    )
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    sub.add_parser("list", help="サービス名とユーザー名の一覧").set_defaults(
+        func=cmd_list
+    )
+
+    get = sub.add_parser("get", help="パスワード（またはユーザー名）を表示する")
+    _add_selector(get)
+    get.add_argument("--field", choices=["password", "username"], default="password")
+    get.set_defaults(func=cmd_get)
+
+    add = sub.add_parser(
+        "add", help="エントリを追加する（パスワードは標準入力から読み込む）"
+    )
+    add.add_argument("service", help="サービス名")
+    add.add_argument("username", help="ユーザー名")
+    add.add_argument(
+        "--totp",
+        action="store_true",
+        help="TOTP シークレットキーも標準入力から読み込む",
+    )
+    _add_generate_options(add)
+    add.set_defaults(func=cmd_add)
+
+    edit = sub.add_parser("edit", help="エントリを変更する")
+    _add_selector(edit)
+    edit.add_argument("--new-service", help="新しいサービス名")
+    edit.add_argument("--new-username", help="新しいユーザー名")
+    edit.add_argument(
+        "--password",
+        action="store_true",
+        help="新しいパスワードを標準入力から読み込む",
+    )
+    edit.add_argument(
+        "--totp",
+        action="store_true",
+        help="新しい TOTP シークレットキーを標準入力から読み込む",
+    )
+    edit.add_argument(
+        "--clear-totp", action="store_true", help="TOTP シークレットキーを削除する"
+    )
+    _add_generate_options(edit)
+    edit.set_defaults(func=cmd_edit)
+
+    rm = sub.add_parser("rm", help="エントリを削除する")
+    _add_selector(rm)
+    rm.set_defaults(func=cmd_rm)
+
+    import_ = sub.add_parser(
+        "import",
+        help="Bitwarden / Chrome / Firefox の CSV、KeePass の XML、export したファイルからまとめて追加する",
+    )
+    import_.add_argument("file", help="エクスポートファイル")
+    import_.add_argument(
+        "--format",
+        choices=[
+            "bitwarden",
+            "chrome",
+            "firefox",
+            "keepass",
+            "csv",
+            "jsonl",
+            "bundle",
+        ],
+        help="ファイルの形式（省略時は内容から判定する）",
+    )
+    import_.set_defaults(func=cmd_import)
+
+    export = sub.add_parser(
+        "export",
+        help="CSV / JSON Lines / 暗号化したバンドルに書き出す（インポートし直せる）",
+    )
+    export.add_argument("file", help="書き出すファイル")
+    export.add_argument(
+        "--format",
+        choices=["csv", "jsonl", "bundle"],
+        help="形式（省略時は拡張子 .csv / .jsonl から判定し、それ以外はバンドル）",
+    )
+    export.set_defaults(func=cmd_export)
+
+    generate = sub.add_parser(
+        "generate", help="パスワードを生成する（マスターパスワードは不要）"
+    )
+    generate.add_argument("--length", type=int, default=DEFAULT_PASSWORD_LENGTH)
+    generate.add_argument("--count", type=int, default=1)
+    generate.add_argument(
+        "--no-symbols", action="store_true", help="記号を使わずに生成する"
+    )
+    generate.set_defaults(func=cmd_generate)
+
+    totp = sub.add_parser("totp", help="現在の TOTP コードを表示する")
+    _add_selector(totp)
+    totp.set_defaults(func=cmd_totp)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    try:
+        if args.data_dir:
+            os.chdir(args.data_dir)
+        password_manager_core.load_password_file_path_from_config()
+        args.func(args)
+    except CliError as ex:
+        print(f"エラー: {ex}", file=sys.stderr)
+        return 1
+    except (OSError, ValueError) as ex:
+        print(f"エラー: {ex}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,16 +1,32 @@
 import secrets
 import string
-from passlib.hash import argon2
 import os
-from Crypto.Cipher import ChaCha20_Poly1305
 from Crypto.Random import get_random_bytes
-from Crypto.Protocol.KDF import PBKDF2
 import time as time_module
 import configparser
 import shutil
-import pyotp
 import csv
+import base64
+import binascii
+import threading
+import hashlib
+import hmac
+import zlib
+import struct
+import mmap
+import contextlib
+import tempfile
 import io
+import functools
+import bisect
+import re
+import sys
+from dataclasses import dataclass
+
+# asyncio / passlib / lzma / zstd / concurrent.futures / statistics と暗号の実装
+# （argon2.low_level / Crypto.Protocol.KDF / Crypto.Cipher）は、一部の機能でしか使わないか、
+# アンロックが始まるまで不要なため、使う関数の中で読み込む
+# （ロック画面やコマンドラインを早く起動するため）。
 
 # ソルトファイルと鍵の定数
 SALT_FILEPATH = "password_file\\salt.txt"
@@ -24,9 +40,210 @@ _password_file_decrypted_in_memory = False
 _password_file_path = "password_file\\passwords.txt"
 
 
+# ========== 設定（settings.ini） ==========
+# settings.ini は Settings を通して読み書きする。
+# - 初回アクセス時に一度だけパースし、型付きの値をキャッシュする
+# - 毎回ファイルの更新時刻とサイズを確認し、外部で書き換えられていたら読み直す
+# - 書き込みは一時ファイル + os.replace で行い、他のセクションの内容は保持する
+# - 値が変わったら購読者（subscribe で登録した関数）に通知する
+
+SETTINGS_FILEPATH = os.path.join("password_file", "settings.ini")
+
+# 既定値（初回起動時に settings.ini に書き込む内容。値の型は既定値の型に合わせて変換する）
+# storage.mode: snapshot（毎回全体を書き直す）または journal（変更分だけを追記する）
+# storage.compression: none / zlib / lzma / zstd（暗号化の前に圧縮する）
+# kdf.algorithm: argon2id（[argon2] の設定を使う）/ scrypt / pbkdf2-sha1
+# session.idle_timeout: GUI / コマンドライン版が最後の利用から鍵を保持する秒数（0 なら無期限）
+# agent.idle_timeout: アンロックエージェントが最後の利用から鍵を保持する秒数
+SETTINGS_DEFAULTS = {
+    "argon2": {"memory_cost": 102400, "time_cost": 2, "parallelism": 8},
+    "kdf": {"algorithm": "argon2id"},
+    "file_paths": {"password_file": "password_file\\passwords.txt"},
+    "storage": {"mode": "snapshot", "compression": "none"},
+    "session": {"idle_timeout": 600},
+    "agent": {"idle_timeout": 900},
+}
+
+
+class Settings:
+    """settings.ini のキャッシュ付きの読み書き"""
+
+    def __init__(self, path=SETTINGS_FILEPATH, defaults=SETTINGS_DEFAULTS):
+        self.path = path
+        self.defaults = defaults
+        self._lock = threading.RLock()
+        self._config = None
+        self._stamp = None
+        self._values = {}  # (section, key) -> 変換済みの値
+        self._subscribers = []
+
+    def _file_stamp(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def _read_config(self):
+        cfg = configparser.ConfigParser()
+        if os.path.exists(self.path):
+            cfg.read(self.path, encoding="utf-8")
+        return cfg
+
+    def _snapshot(self):
+        if self._config is None:
+            return {}
+        return {
+            (section, key): value
+            for section in self._config.sections()
+            for key, value in self._config.items(section, raw=True)
+        }
+
+    def _reload_if_changed(self):
+        """ファイルが変わっていれば読み直し、変わった値を (section, key) -> 値 で返す"""
+        stamp = self._file_stamp()
+        if self._config is not None and stamp == self._stamp:
+            return {}
+        before = self._snapshot()
+        try:
+            config = self._read_config()
+        except (configparser.Error, OSError, UnicodeDecodeError) as ex:
+            print(f"警告: settings.ini の読み込みに失敗しました: {ex}")
+            config = configparser.ConfigParser()
+        first_load = self._config is None
+        self._config = config
+        self._stamp = stamp
+        self._values.clear()
+        after = self._snapshot()
+        if first_load:
+            return {}
+        return {
+            name: after.get(name)
+            for name in before.keys() | after.keys()
+            if before.get(name) != after.get(name)
+        }
+
+    def _refresh(self):
+        with self._lock:
+            changes = self._reload_if_changed()
+        if changes:
+            self._notify(changes)
+
+    def _default(self, section, key, fallback):
+        if fallback is not None:
+            return fallback
+        return self.defaults.get(section, {}).get(key)
+
+    def _convert(self, section, key, raw, default):
+        if isinstance(default, bool):
+            return raw.strip().lower() in ("1", "true", "yes", "on")
+        if isinstance(default, int):
+            try:
+                return int(raw)
+            except ValueError:
+                print(
+                    f"警告: settings.ini の [{section}] {key} が整数ではありません。既定値を使います: {raw}"
+                )
+                return default
+        return raw.strip()
+
+    def get(self, section, key, fallback=None):
+        """
+        値を返す。settings.ini に無い場合は fallback（省略時は既定値）を返す。
+        値は既定値と同じ型（int / bool / str）に変換する。
+        """
+        self._refresh()
+        default = self._default(section, key, fallback)
+        with self._lock:
+            if (section, key) in self._values:
+                return self._values[(section, key)]
+            raw = self._config.get(section, key, raw=True, fallback=None)
+            value = (
+                default if raw is None else self._convert(section, key, raw, default)
+            )
+            self._values[(section, key)] = value
+            return value
+
+    def contains(self, section, key):
+        """settings.ini に値が書かれているかどうか"""
+        self._refresh()
+        with self._lock:
+            return self._config.has_option(section, key)
+
+    def section(self, section):
+        """セクションの値を既定値も含めて辞書で返す"""
+        self._refresh()
+        with self._lock:
+            keys = list(self.defaults.get(section, {}))
+            if self._config.has_section(section):
+                keys += [k for k in self._config.options(section) if k not in keys]
+        return {key: self.get(section, key) for key in keys}
+
+    def update(self, values):
+        """
+        {section: {key: value}} の形で値を書き込む。ほかのセクション・キーはそのまま残す。
+        書き込みは一時ファイル + os.replace で行い、途中で失敗しても元のファイルは壊れない。
+        """
+        with self._lock:
+            # 外部での変更も通知する
+            changes = self._reload_if_changed()
+            config = self._read_config()
+            for section, items in values.items():
+                if not config.has_section(section):
+                    config.add_section(section)
+                for key, value in items.items():
+                    text = str(value)
+                    if config.get(section, key, raw=True, fallback=None) != text:
+                        changes[(section, key)] = text
+                    config.set(section, key, text)
+            buffer = io.StringIO()
+            config.write(buffer)
+            atomic_write(self.path, [buffer.getvalue().encode("utf-8")])
+            self._config = config
+            self._stamp = self._file_stamp()
+            self._values.clear()
+        if changes:
+            self._notify(changes)
+
+    def write_defaults(self):
+        """settings.ini が無ければ既定値で作成する（初回起動時）"""
+        if not os.path.exists(self.path):
+            self.update(self.defaults)
+
+    def subscribe(self, callback):
+        """
+        値が変わったときに callback({(section, key): 新しい値の文字列}) を呼ぶ。
+        登録を解除する関数を返す。
+        """
+        with self._lock:
+            self._subscribers.append(callback)
+
+        def unsubscribe():
+            with self._lock:
+                if callback in self._subscribers:
+                    self._subscribers.remove(callback)
+
+        return unsubscribe
+
+    def _notify(self, changes):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for callback in subscribers:
+            try:
+                callback(changes)
+            except Exception as ex:
+                print(f"警告: 設定変更の通知に失敗しました: {ex}")
+
+
+settings = Settings()
+
+
 def set_password_file_path(filepath):
     """
     パスワードファイルの保存先を設定し、既存のファイルを新しい場所に移動する。
+    移動は移動元・移動先の vault_lock() を保持して行う。開いているセッションの
+    VaultJournal・BackgroundVaultWriter・リースは移動元のパスを指したままなので、
+    呼び出し側で作り直す（UI_password_manager の save_password_file_path を参照）。
     """
     global _password_file_path
     old_filepath = _password_file_path
@@ -34,6 +251,15 @@ def set_password_file_path(filepath):
     if old_filepath == filepath:
         return  # 同じパスなら何もしない
 
+    with vault_lock(old_filepath), vault_lock(filepath):
+        _move_vault_files(old_filepath, filepath)
+
+    # すべての操作が成功したら、グローバル変数を更新
+    _password_file_path = filepath
+
+
+def _move_vault_files(old_filepath, filepath):
+    """パスワードファイルとジャーナル・鍵ファイルを移動する（失敗したらコピーを削除して IOError）"""
     # 古いファイルが存在する場合のみ移動処理を行う
     if os.path.exists(old_filepath):
         try:
@@ -44,19 +270,27 @@ def set_password_file_path(filepath):
 
             # ファイルを新しい場所にコピー
             shutil.copy2(old_filepath, filepath)
+            # ジャーナルと鍵ファイルがあれば一緒に移動する
+            for suffix in (JOURNAL_SUFFIX, KEY_FILE_SUFFIX):
+                if os.path.exists(old_filepath + suffix):
+                    shutil.copy2(old_filepath + suffix, filepath + suffix)
 
             # 古いファイルを削除
             os.remove(old_filepath)
+            for suffix in (JOURNAL_SUFFIX, KEY_FILE_SUFFIX):
+                if os.path.exists(old_filepath + suffix):
+                    os.remove(old_filepath + suffix)
 
         except Exception as e:
             # エラーが発生した場合は、操作をロールバック（新しいファイルを削除）
-            if os.path.exists(filepath):
-                os.remove(filepath)
+            # 移動元が残っているファイルのコピーだけを削除する（移動元を削除済みのものは消さない）
+            for suffix in ("", JOURNAL_SUFFIX, KEY_FILE_SUFFIX):
+                if os.path.exists(filepath + suffix) and os.path.exists(
+                    old_filepath + suffix
+                ):
+                    os.remove(filepath + suffix)
             raise IOError(f"パスワードファイルの移動に失敗しました: {e}")
 
-    # すべての操作が成功したら、グローバル変数を更新
-    _password_file_path = filepath
-
 
 def get_password_file_path():
     """現在のパスワードファイル保存先を取得"""
@@ -66,31 +300,96 @@ def get_password_file_path():
 def load_password_file_path_from_config():
     """settings.ini からパスワードファイルパスを読み込む"""
     try:
-        settings_path = os.path.join("password_file", "settings.ini")
-        if os.path.exists(settings_path):
-            cfg = configparser.ConfigParser()
-            cfg.read(settings_path, encoding="utf-8")
-            if "file_paths" in cfg and "password_file" in cfg["file_paths"]:
-                set_password_file_path(cfg["file_paths"]["password_file"])
+        if settings.contains("file_paths", "password_file"):
+            set_password_file_path(settings.get("file_paths", "password_file"))
     except Exception as ex:
         print(f"警告: パスワードファイルパスの読み込みに失敗しました: {ex}")
 
 
-# ランダムなパスワードを生成する関数
-def generate_secure_password(length, use_special_chars=True):
+# ========== パスワード生成 ==========
+PASSWORD_MIN_LENGTH = 12
+PASSWORD_RANDOM_CHUNK = 4096  # ストリーミング生成で一度に用意する文字数
+
+
+def _check_password_length(length):
     # 短すぎる文字数のパスワードは拒否
     # 今回は12文字以上とする
-    if length < 12:
+    if length < PASSWORD_MIN_LENGTH:
         raise ValueError("パスワードの長さは12文字以上である必要があります。")
+
+
+@functools.lru_cache(maxsize=None)
+def _password_translation(use_special_chars):
+    """
+    乱数バイト列をパスワードの文字に一括で変換するための表を返す。
+    文字数 n に対して 256 - 256 % n 未満のバイトだけを採用し（棄却サンプリング）、
+    採用したバイトは b % n 番目の文字に対応させるため、どの文字も等確率になる。
+    戻り値: (bytes.translate の変換表, 削除するバイト, 採用率)
+    """
     # 使用する文字セットを定義
     # 英大文字、英小文字、数字、記号を含む(記号は有効な場合のみ)
     if use_special_chars:
         characters = string.ascii_letters + string.digits + string.punctuation
     else:
         characters = string.ascii_letters + string.digits
-    # ランダムに文字を選んでパスワードを生成
-    password = "".join(secrets.choice(characters) for _ in range(length))
-    return password
+    alphabet = characters.encode("ascii")
+    limit = 256 - 256 % len(alphabet)
+    table = bytes(alphabet[b % len(alphabet)] if b < limit else 0 for b in range(256))
+    return table, bytes(range(limit, 256)), limit / 256
+
+
+def _random_password_chars(count, use_special_chars):
+    """
+    パスワードに使える文字を count 文字以上まとめて生成する。
+    secrets.token_bytes で取得したバッファを bytes.translate で一度に変換・棄却するため、
+    1 文字ごとの乱数取得や Python の関数呼び出しは発生しない。
+    """
+    table, rejected, acceptance = _password_translation(use_special_chars)
+    chars = b""
+    while len(chars) < count:
+        # 棄却される分を見込んで少し多めに取得する（足りなければもう一度取得する）
+        request = int((count - len(chars)) / acceptance * 1.05) + 16
+        chars += secrets.token_bytes(request).translate(table, rejected)
+    return chars.decode("ascii")
+
+
+def iter_secure_passwords(
+    lengths, use_special_chars=True, chunk_size=PASSWORD_RANDOM_CHUNK
+):
+    """
+    lengths で指定した長さのパスワードを順に生成するジェネレーター。
+    乱数はおよそ chunk_size 文字ずつまとめて用意し、そこから切り出す。
+    """
+    pool = ""
+    position = 0
+    for length in lengths:
+        _check_password_length(length)
+        available = len(pool) - position
+        if available < length:
+            pool = pool[position:] + _random_password_chars(
+                max(length - available, chunk_size), use_special_chars
+            )
+            position = 0
+        yield pool[position : position + length]
+        position += length
+
+
+def generate_secure_passwords(lengths, use_special_chars=True):
+    """
+    lengths で指定した長さのパスワードをまとめて生成してリストで返す。
+    必要な乱数は 1 つのバッファでまとめて取得する。
+    """
+    lengths = list(lengths)
+    for length in lengths:
+        _check_password_length(length)
+    return list(
+        iter_secure_passwords(lengths, use_special_chars, chunk_size=sum(lengths))
+    )
+
+
+# ランダムなパスワードを生成する関数
+def generate_secure_password(length, use_special_chars=True):
+    return next(iter_secure_passwords([length], use_special_chars, chunk_size=0))
 
 
 def get_or_create_salt():
@@ -106,208 +405,2818 @@ def get_or_create_salt():
         return salt
 
 
+def _read_salt():
+    """既存のソルトを読み込む。存在しない場合は例外を送出する"""
+    if not os.path.exists(SALT_FILEPATH):
+        raise FileNotFoundError(
+            "ソルトファイルが見つかりません。アプリケーションが正しく初期化されていません。"
+        )
+    with open(SALT_FILEPATH, "rb") as f:
+        return f.read()
+
+
+# ========== 鍵導出（KDF）のバックエンド ==========
+# 同じ KDF でも実装によって速さが違う（例えば pycryptodome の PBKDF2 は、PRF を指定すると
+# Python から呼び出すことになり大幅に遅くなる）。
+# アルゴリズムごとに実装を速い順に登録しておき、既知の正解値（テストベクター）とビット単位で
+# 一致した最初の実装を使う。出力はどの実装でも同じなので、既存のデータはそのまま開ける。
+# 登録順は `python benchmark.py kdf` の計測結果に基づく（PBKDF2-HMAC-SHA1 は hashlib と
+# pycryptodome でほぼ同じ、scrypt は pycryptodome の方が 3 割ほど速かった）。
+#
+# パラメータ（params）:
+#   argon2id:    (memory_cost, time_cost, parallelism)
+#   scrypt:      (n, r, p)
+#   pbkdf2-sha1: (iterations,)
+
+KDF_ARGON2ID = "argon2id"
+KDF_SCRYPT = "scrypt"
+KDF_PBKDF2_SHA1 = "pbkdf2-sha1"
+SCRYPT_DEFAULT_PARAMS = (2**17, 8, 1)
+
+# アルゴリズムごとの既知の正解値: (パスワード, ソルト, params, 出力)
+KDF_TEST_VECTORS = {
+    # RFC 6070
+    KDF_PBKDF2_SHA1: (
+        b"password",
+        b"salt",
+        (4096,),
+        bytes.fromhex("4b007901b765489abead49d926f721d065a429c1"),
+    ),
+    # RFC 7914
+    KDF_SCRYPT: (
+        b"",
+        b"",
+        (16, 1, 1),
+        bytes.fromhex(
+            "77d6576238657b203b19ca42c18a0497f16b4844e3074ae8dfdffa3fede2144"
+            "2fcd0069ded0948f8326a753a0fc81f17e8d3e0fb2e0d3628cf35e20c38d18906"
+        ),
+    ),
+    # Argon2 リファレンス実装のテスト（m=2^8, t=2, p=1）
+    KDF_ARGON2ID: (
+        b"password",
+        b"somesalt",
+        (256, 2, 1),
+        bytes.fromhex(
+            "9dfeb910e80bad0311fee20f9c0e2b12c17987b4cac90c2ef54d5b3021c68bfe"
+        ),
+    ),
+}
+
+
+@dataclass(frozen=True, slots=True)
+class KdfBackend:
+    """KDF の実装。derive(password_bytes, salt, params, length) -> bytes"""
+
+    algorithm: str
+    name: str
+    derive: object
+
+
+_kdf_backends = {}  # algorithm -> [KdfBackend, ...]（優先順）
+
+
+def register_kdf_backend(algorithm, name, derive):
+    """KDF の実装を登録する。先に登録したものほど優先される"""
+    if algorithm not in KDF_TEST_VECTORS:
+        raise ValueError(f"未対応の鍵導出方式です: {algorithm}")
+    _kdf_backends.setdefault(algorithm, []).append(KdfBackend(algorithm, name, derive))
+    select_kdf_backend.cache_clear()
+
+
+def kdf_backends(algorithm):
+    """登録されている実装を優先順に返す"""
+    return list(_kdf_backends.get(algorithm, ()))
+
+
+def verify_kdf_backend(backend):
+    """実装の出力がテストベクターとビット単位で一致するかどうか"""
+    password, salt, params, expected = KDF_TEST_VECTORS[backend.algorithm]
+    try:
+        actual = backend.derive(password, salt, params, len(expected))
+    except Exception as ex:
+        print(f"警告: 鍵導出の実装 {backend.name} を利用できません: {ex}")
+        return False
+    return hmac.compare_digest(actual, expected)
+
+
+@functools.lru_cache(maxsize=None)
+def select_kdf_backend(algorithm):
+    """テストベクターと一致する実装のうち、最も優先度の高い（速い）ものを返す"""
+    for backend in _kdf_backends.get(algorithm, ()):
+        if verify_kdf_backend(backend):
+            return backend
+    raise ValueError(f"鍵導出方式 {algorithm} の実装が見つかりません。")
+
+
+def kdf_derive(algorithm, password_bytes, salt, params, length=KEY_BYTES):
+    return select_kdf_backend(algorithm).derive(password_bytes, salt, params, length)
+
+
+def _pbkdf2_hashlib(password, salt, params, length):
+    (iterations,) = params
+    return hashlib.pbkdf2_hmac("sha1", password, salt, iterations, length)
+
+
+def _pbkdf2_pycryptodome(password, salt, params, length):
+    from Crypto.Protocol.KDF import PBKDF2
+
+    (iterations,) = params
+    return PBKDF2(password, salt, dkLen=length, count=iterations)
+
+
+def _scrypt_hashlib(password, salt, params, length):
+    n, r, p = params
+    # OpenSSL は必要なメモリ量が maxmem を超えるとエラーにするため、余裕を持たせて指定する
+    maxmem = min(128 * r * (n + p + 2) + 1024 * 1024, 2**31 - 1)
+    return hashlib.scrypt(
+        password, salt=salt, n=n, r=r, p=p, maxmem=maxmem, dklen=length
+    )
+
+
+def _scrypt_pycryptodome(password, salt, params, length):
+    from Crypto.Protocol.KDF import scrypt
+
+    n, r, p = params
+    return scrypt(password, salt, length, n, r, p)
+
+
+def _argon2id_cffi(password, salt, params, length):
+    from argon2.low_level import Type, hash_secret_raw
+
+    m, t, p = params
+    return hash_secret_raw(
+        password,
+        salt,
+        time_cost=t,
+        memory_cost=m,
+        parallelism=p,
+        hash_len=length,
+        type=Type.ID,
+    )
+
+
+register_kdf_backend(KDF_PBKDF2_SHA1, "hashlib", _pbkdf2_hashlib)
+register_kdf_backend(KDF_PBKDF2_SHA1, "pycryptodome", _pbkdf2_pycryptodome)
+register_kdf_backend(KDF_SCRYPT, "pycryptodome", _scrypt_pycryptodome)
+if hasattr(hashlib, "scrypt"):
+    register_kdf_backend(KDF_SCRYPT, "hashlib", _scrypt_hashlib)
+register_kdf_backend(KDF_ARGON2ID, "argon2-cffi", _argon2id_cffi)
+
+
+def _new_cipher(key, nonce):
+    """XChaCha20-Poly1305（24 バイトの nonce）の暗号オブジェクトを作る"""
+    from Crypto.Cipher import ChaCha20_Poly1305
+
+    return ChaCha20_Poly1305.new(key=key, nonce=nonce)
+
+
+def _hkdf_sha256(secret, salt, context):
+    from Crypto.Hash import SHA256
+    from Crypto.Protocol.KDF import HKDF
+
+    return HKDF(secret, KEY_BYTES, salt, SHA256, context=context)
+
+
 def derive_key(master_password, salt):
     """マスターパスワードとソルトからPBKDF2で暗号化キーを派生させる"""
-    return PBKDF2(master_password, salt, dkLen=KEY_BYTES, count=PBKDF2_ITERATIONS)
+    # 以前の pycryptodome の PBKDF2 と同じく、パスワードは latin-1 でバイト列にする
+    return kdf_derive(
+        KDF_PBKDF2_SHA1,
+        master_password.encode("latin-1"),
+        salt,
+        (PBKDF2_ITERATIONS,),
+    )
 
 
-def encrypt_password_file(plaintext_bytes, master_password, filepath=None):
-    """
-    平文のバイトデータをマスターパスワードで暗号化し、ファイルに保存する。
-    """
+# ========== 鍵の階層（データ暗号化鍵のラップ） ==========
+# パスワードファイルはランダムなデータ暗号化鍵（DEK）で暗号化し、DEK はマスターパスワードから
+# 導出した鍵暗号化鍵（KEK）で暗号化（ラップ）して鍵ファイルに保存する。
+# マスターパスワードや Argon2 の設定を変更しても DEK は変わらないため、鍵ファイルの 32 バイトを
+# ラップし直すだけでよく、パスワードファイルの大きさに関係なく一定時間で終わる。
+#
+# アンロックは KDF（既定は Argon2id）を 1 回だけ実行する。その出力から HKDF で KEK を導出し、
+# DEK のアンラップ（AEAD の検証）がそのままマスターパスワードの検証を兼ねる。
+# そのため、アンロックにかかる時間は KDF の設定だけで決まる。
+#
+# 鍵ファイル（<パスワードファイル>.key）の形式:
+#   v2 ヘッダー: マジック(4) + バージョン(1) + KDF の ID(1) + KDF のパラメータ(4 x 3)
+#                + ソルト(16)（パラメータが 3 つに満たない KDF は残りを 0 にする）
+#   v1 ヘッダー: マジック(4) + バージョン(1) + ソルト(16)（KEK は PBKDF2。読み込みのみ対応）
+#   本体:        nonce(24) + ラップした DEK(32) + tag(16)（ヘッダーを AAD とする）
+#
+# 移行:
+#   - 鍵ファイルが無い旧形式のパスワードファイルは、salt.txt から PBKDF2 で導出した鍵で
+#     直接暗号化されている。その鍵をそのまま DEK とする（再暗号化は不要）。
+#   - v1 の鍵ファイルと旧形式のデータは、次回のアンロックで v2 の鍵ファイルに書き換える。
+#   - master_password.txt（Argon2 のハッシュ）は v2 の鍵ファイルを作った時点で不要になるため削除する。
+
+KEY_FILE_SUFFIX = ".key"
+KEY_FILE_MAGIC = b"PMK1"
+KEY_FILE_VERSION = 2
+KEY_FILE_V1_HEADER_STRUCT = struct.Struct(">4sB16s")
+KEY_FILE_HEADER_STRUCT = struct.Struct(">4sBBIII16s")
+KEY_FILE_KDF_IDS = {KDF_ARGON2ID: 1, KDF_SCRYPT: 2, KDF_PBKDF2_SHA1: 3}
+KEY_FILE_KDF_NAMES = {kdf_id: name for name, kdf_id in KEY_FILE_KDF_IDS.items()}
+KDF_PARAM_COUNTS = {KDF_ARGON2ID: 3, KDF_SCRYPT: 3, KDF_PBKDF2_SHA1: 1}
+KEY_WRAP_CONTEXT = b"password-manager key-encryption key v1"
+MASTER_PASSWORD_FILEPATH = "password_file\\master_password.txt"
+DEFAULT_ARGON2_PARAMS = (102400, 2, 8)  # (memory_cost, time_cost, parallelism)
+
+
+def key_path_for(filepath=None):
+    """パスワードファイルに対応する鍵ファイルのパスを返す"""
     if filepath is None:
         filepath = get_password_file_path()
+    return filepath + KEY_FILE_SUFFIX
 
-    salt = get_or_create_salt()
-    key = derive_key(master_password, salt)
 
-    # 空のデータは空ファイルとして保存
-    if not plaintext_bytes:
-        with open(filepath, "wb") as f:
-            f.write(b"")
-        return
+def load_argon2_params_from_config():
+    """settings.ini から Argon2 のパラメータ (memory_cost, time_cost, parallelism) を読み込む"""
+    m, t, p = DEFAULT_ARGON2_PARAMS
+    return (
+        settings.get("argon2", "memory_cost", m),
+        settings.get("argon2", "time_cost", t),
+        settings.get("argon2", "parallelism", p),
+    )
 
-    # 暗号化
-    nonce = get_random_bytes(24)  # XChaCha20-Poly1305 用の 24 バイトナンス
-    cipher = ChaCha20_Poly1305.new(key=key, nonce=nonce)
-    ciphertext, tag = cipher.encrypt_and_digest(plaintext_bytes)
 
-    # 暗号化された内容を保存（nonce + ciphertext + tag）
-    os.makedirs(os.path.dirname(filepath), exist_ok=True)
-    with open(filepath, "wb") as f:
-        f.write(nonce + ciphertext + tag)
+def load_kdf_from_config():
+    """
+    settings.ini の [kdf] algorithm から鍵ファイルに使う KDF と、そのパラメータを読み込む。
+    Argon2id のパラメータは [argon2]、それ以外は [kdf] の scrypt_* / pbkdf2_iterations から読む。
+    """
+    algorithm = settings.get("kdf", "algorithm", KDF_ARGON2ID).lower()
+    if algorithm == KDF_SCRYPT:
+        n, r, p = SCRYPT_DEFAULT_PARAMS
+        return algorithm, (
+            settings.get("kdf", "scrypt_n", n),
+            settings.get("kdf", "scrypt_r", r),
+            settings.get("kdf", "scrypt_p", p),
+        )
+    if algorithm == KDF_PBKDF2_SHA1:
+        return algorithm, (settings.get("kdf", "pbkdf2_iterations", PBKDF2_ITERATIONS),)
+    if algorithm != KDF_ARGON2ID:
+        print(
+            f"警告: 不明な鍵導出方式 {algorithm} が指定されています。argon2id を使います。"
+        )
+    return KDF_ARGON2ID, load_argon2_params_from_config()
 
 
-def decrypt_password_file(master_password, filepath=None):
+def derive_unlock_key(master_password, salt, algorithm, params):
     """
-    パスワードファイルをマスターパスワードで復号化し、平文のバイトデータを返す。
-    ディスクへの書き込みは行わない。
+    マスターパスワードから KDF を 1 回だけ実行し、HKDF で KEK を導出する。
     """
-    if filepath is None:
-        filepath = get_password_file_path()
+    secret = kdf_derive(algorithm, master_password.encode("utf-8"), salt, params)
+    return _hkdf_sha256(secret, salt, KEY_WRAP_CONTEXT)
 
-    if not os.path.exists(filepath) or os.path.getsize(filepath) == 0:
-        return b""  # ファイルが存在しないか空なら空のバイト列を返す
 
-    if not os.path.exists(SALT_FILEPATH):
-        raise FileNotFoundError(
-            "ソルトファイルが見つかりません。アプリケーションが正しく初期化されていません。"
-        )
+class WrongMasterPasswordError(ValueError):
+    """マスターパスワードが違う（鍵ファイルの認証に失敗した）ことを示す例外"""
 
-    with open(SALT_FILEPATH, "rb") as f:
-        salt = f.read()
 
-    key = derive_key(master_password, salt)
+def _wrong_master_password_error():
+    return WrongMasterPasswordError(
+        "鍵ファイルを開けませんでした。マスターパスワードが間違っているか、鍵ファイルが破損している可能性があります。"
+    )
 
-    with open(filepath, "rb") as f:
-        data = f.read()
 
-    # nonce(24) + tag(16) + 最低1バイトのデータが必要
-    if len(data) < 24 + 16 + 1:
-        raise ValueError("パスワードファイルが破損しているか、不正な形式です。")
+def wrap_vault_key(vault_key, master_password, argon2_params=None, kdf=None):
+    """
+    DEK をマスターパスワードから導出した KEK でラップし、鍵ファイル（v2）の内容を返す。
+    argon2_params を指定した場合は Argon2id、kdf=(algorithm, params) を指定した場合はその KDF を使う。
+    どちらも省略した場合は settings.ini の設定を使う。
+    """
+    if argon2_params is not None:
+        algorithm, params = KDF_ARGON2ID, tuple(argon2_params)
+    else:
+        algorithm, params = kdf or load_kdf_from_config()
+    if len(params) != KDF_PARAM_COUNTS[algorithm]:
+        raise ValueError(f"鍵導出方式 {algorithm} のパラメータが不正です。")
+    salt = get_random_bytes(16)
+    padded = tuple(params) + (0,) * (3 - len(params))
+    header = KEY_FILE_HEADER_STRUCT.pack(
+        KEY_FILE_MAGIC, KEY_FILE_VERSION, KEY_FILE_KDF_IDS[algorithm], *padded, salt
+    )
+    nonce = get_random_bytes(24)
+    cipher = _new_cipher(
+        derive_unlock_key(master_password, salt, algorithm, params), nonce
+    )
+    cipher.update(header)
+    wrapped, tag = cipher.encrypt_and_digest(bytes(vault_key))
+    return header + nonce + wrapped + tag
 
-    nonce = data[:24]
-    tag = data[-16:]
-    ciphertext = data[24:-16]
 
-    try:
-        cipher = ChaCha20_Poly1305.new(key=key, nonce=nonce)
-        plaintext = cipher.decrypt_and_verify(ciphertext, tag)
-        return plaintext
-    except (ValueError, KeyError) as e:
-        raise ValueError(
-            "パスワードファイルの復号化に失敗しました。マスターパスワードが間違っているか、ファイルが破損している可能性があります。"
-        )
+def _key_file_version(key_file_bytes):
+    if len(key_file_bytes) < 5 or key_file_bytes[:4] != KEY_FILE_MAGIC:
+        raise ValueError("鍵ファイルが破損しているか、不正な形式です。")
+    return key_file_bytes[4]
 
 
-# パスワードファイルを復号化して内容を取得する関数
-def get_decrypted_passwords(master_password, filepath=None):
-    if filepath is None:
-        filepath = get_password_file_path()
+def key_file_kdf(key_file_bytes):
+    """v2 の鍵ファイルに記録された KDF とパラメータ (algorithm, params) を返す"""
+    if _key_file_version(key_file_bytes) != KEY_FILE_VERSION or (
+        len(key_file_bytes) < KEY_FILE_HEADER_STRUCT.size
+    ):
+        raise ValueError("鍵ファイルのバージョンに対応していません。")
+    _magic, _version, kdf_id, *params, _salt = KEY_FILE_HEADER_STRUCT.unpack_from(
+        key_file_bytes
+    )
+    algorithm = KEY_FILE_KDF_NAMES.get(kdf_id)
+    if algorithm is None:
+        raise ValueError("鍵ファイルの鍵導出方式に対応していません。")
+    return algorithm, tuple(params[: KDF_PARAM_COUNTS[algorithm]])
+
+
+def unwrap_vault_key(key_file_bytes, master_password):
+    """
+    鍵ファイルの内容から DEK を取り出す。パスワードが違う場合は ValueError を送出する。
+    v2 はヘッダーに記録された KDF + HKDF、v1 は PBKDF2 で KEK を導出する。
+    """
+    version = _key_file_version(key_file_bytes)
+    if version == KEY_FILE_VERSION:
+        header_struct = KEY_FILE_HEADER_STRUCT
+    elif version == 1:
+        header_struct = KEY_FILE_V1_HEADER_STRUCT
+    else:
+        raise ValueError("鍵ファイルのバージョンに対応していません。")
+    header_bytes = header_struct.size
+    if len(key_file_bytes) != header_bytes + 24 + KEY_BYTES + 16:
+        raise ValueError("鍵ファイルが破損しているか、不正な形式です。")
+
+    if version == KEY_FILE_VERSION:
+        algorithm, params = key_file_kdf(key_file_bytes)
+        salt = header_struct.unpack_from(key_file_bytes)[-1]
+        kek = derive_unlock_key(master_password, salt, algorithm, params)
+    else:
+        _magic, _version, salt = header_struct.unpack_from(key_file_bytes)
+        kek = derive_key(master_password, salt)
 
+    nonce = key_file_bytes[header_bytes : header_bytes + 24]
+    wrapped = key_file_bytes[header_bytes + 24 : -16]
     try:
-        decrypted_bytes = decrypt_password_file(master_password, filepath)
-    except ValueError as e:
-        # 復号エラーはここで捕捉し、空リストを返すか、再度例外を送出するか選択
-        # UI側でエラーメッセージを処理するため、ここでは再送出が適切
-        raise e
+        cipher = _new_cipher(kek, nonce)
+        cipher.update(key_file_bytes[:header_bytes])
+        return cipher.decrypt_and_verify(wrapped, key_file_bytes[-16:])
+    except (ValueError, KeyError):
+        raise _wrong_master_password_error()
+
+
+def _read_key_file(filepath):
+    with open(key_path_for(filepath), "rb") as f:
+        return f.read()
 
-    passwords = []
-    if not decrypted_bytes:
-        return passwords
 
+def _write_key_file(filepath, key_file_bytes):
+    atomic_write(key_path_for(filepath), [key_file_bytes])
+
+
+def _retire_master_password_hash():
+    """v2 の鍵ファイルが検証を兼ねるようになったため、旧来の Argon2 ハッシュファイルを削除する"""
     try:
-        decrypted_content = decrypted_bytes.decode("utf-8")
-    except UnicodeDecodeError:
-        raise ValueError("パスワードファイルのデータが破損しており、読み込めません。")
+        if os.path.exists(MASTER_PASSWORD_FILEPATH):
+            os.remove(MASTER_PASSWORD_FILEPATH)
+    except OSError as ex:
+        print(f"警告: 古いマスターパスワードファイルの削除に失敗しました: {ex}")
 
-    # CSV としてパースして、オプションで 4 列目に totp_secret を扱う
-    reader = csv.reader(decrypted_content.splitlines())
-    for row in reader:
-        if not row or all([not cell.strip() for cell in row]):
-            continue
-        if len(row) < 3:
-            print(f"警告: 保存ファイルの行が不正な形式です。スキップします: {row}")
-            continue
-        service_name = row[0]
-        username = row[1]
-        password = row[2]
-        totp_secret = row[3] if len(row) >= 4 else ""
-        passwords.append(
-            {
-                "service_name": service_name,
-                "username": username,
-                "password": password,
-                "totp_secret": totp_secret,
-            }
-        )
-    return passwords
 
+def _vault_has_data(filepath):
+    return (os.path.exists(filepath) and os.path.getsize(filepath) > 0) or (
+        os.path.exists(journal_path_for(filepath))
+    )
 
-# マスターパスワードが存在するかチェックする関数
-def master_password_exists():
-    return os.path.exists("password_file\\master_password.txt")
 
+def _check_legacy_vault_key(key, filepath):
+    """
+    旧形式の鍵で既存のデータ（先頭のチャンクかジャーナルの先頭エントリ）が復号できることを確かめる。
+    間違った鍵を DEK として保存すると二度と読めなくなるため、鍵ファイルを作る前に必ず確認する。
+    """
+    if os.path.exists(filepath) and os.path.getsize(filepath) > 0:
+        entries = decrypt_stream(key, filepath)
+    else:
+        entries = _read_journal_entries(key, filepath)
+    try:
+        with contextlib.closing(entries):
+            next(entries, None)
+    except ValueError:
+        raise _wrong_master_password_error()
 
-# マスターパスワードのハッシュ化関数
-def hash_master_password(master_password, m=102400, t=2, p=8):
-    # Argon2でハッシュ化
-    hashed_password = argon2.using(
-        type="id", memory_cost=m, time_cost=t, parallelism=p
-    ).hash(master_password)
-    # ファイルに保存
-    with open("password_file\\master_password.txt", "w") as f:
-        f.write(hashed_password)
 
+def open_vault_key(master_password, filepath=None, write=True, create=False):
+    """
+    マスターパスワードからパスワードファイルの DEK を取り出す。
+    - v2 の鍵ファイルがあれば、Argon2id 1 回でアンラップする（検証を兼ねる）
+    - v1 の鍵ファイルや旧形式のデータがあれば、旧来の方法で DEK を取り出して v2 の鍵ファイルに移行する
+    - どれも無ければ（または create=True なら）ランダムな DEK を新しく作る
+    write=False の場合は鍵ファイルを書き換えずに DEK だけを返す（新規作成はできない）。
+    """
+    if filepath is None:
+        filepath = get_password_file_path()
 
-# マスターパスワードの検証関数
-def verify_master_password(input_password):
-    # 保存されたハッシュを読み込み
-    if not os.path.exists("password_file\\master_password.txt"):
-        raise FileNotFoundError("マスターパスワードファイルが存在しません。")
-    with open("password_file\\master_password.txt", "r") as f:
-        stored_hash = f.read()
-    # 入力されたパスワードを検証
-    return argon2.verify(input_password, stored_hash)
+    key_path = key_path_for(filepath)
+    if not create and os.path.exists(key_path):
+        key_file_bytes = _read_key_file(filepath)
+        vault_key = unwrap_vault_key(key_file_bytes, master_password)
+        if _key_file_version(key_file_bytes) == KEY_FILE_VERSION or not write:
+            return vault_key
+    elif not create and (
+        _vault_has_data(filepath) or os.path.exists(MASTER_PASSWORD_FILEPATH)
+    ):
+        # 旧形式: 鍵ファイルを作る前に、旧来の Argon2 ハッシュで検証する
+        if os.path.exists(
+            MASTER_PASSWORD_FILEPATH
+        ) and not _verify_master_password_hash(master_password):
+            raise _wrong_master_password_error()
+        if _vault_has_data(filepath):
+            # 既存のパスワードファイルがあるのにソルトが無い場合は新規作成せずにエラーにする
+            vault_key = derive_key(master_password, _read_salt())
+            _check_legacy_vault_key(vault_key, filepath)
+        elif write:
+            vault_key = get_random_bytes(KEY_BYTES)
+        else:
+            raise FileNotFoundError("鍵ファイルが見つかりません。")
+    elif write:
+        vault_key = get_random_bytes(KEY_BYTES)
+    else:
+        raise FileNotFoundError("鍵ファイルが見つかりません。")
 
+    if write:
+        _write_key_file(filepath, wrap_vault_key(vault_key, master_password))
+        _retire_master_password_hash()
+    return vault_key
 
-# マスターパスワードを再ハッシュする関数（パスワード自体は変わらない、Argon2設定のみ変更）
-def rehash_master_password(current_password, m=102400, t=2, p=8):
+
+def rewrap_vault_key(current_password, new_password, filepath=None, argon2_params=None):
     """
-    現在のマスターパスワード（プレーンテキスト）を検証して、
-    新しい Argon2 パラメータでハッシュを再生成する。
-    パスワードの値自体は変わらない。
+    DEK を新しいマスターパスワード（と Argon2 のパラメータ）でラップし直す。
+    パスワードファイル自体は書き換えないため、データ量に関係なく一定時間で終わる。
     """
-    # 現在のパスワードが正しいか確認
-    if not verify_master_password(current_password):
-        raise ValueError("現在のマスターパスワードが正しくありません。")
-    # 新しいパラメータで再ハッシュ
-    hash_master_password(current_password, m=m, t=t, p=p)
+    if filepath is None:
+        filepath = get_password_file_path()
+    vault_key = open_vault_key(current_password, filepath, write=False)
+    _write_key_file(filepath, wrap_vault_key(vault_key, new_password, argon2_params))
+    _retire_master_password_hash()
 
 
-# Argon2 パラメータでハッシュ化テストを行う関数
-def test_argon2_hash(test_password, m=102400, t=2, p=8):
+def load_session_idle_timeout_from_config():
+    """settings.ini から VaultSession のアイドルタイムアウト（秒）を読み込む（0 以下なら None）"""
+    idle_timeout = settings.get("session", "idle_timeout", 600)
+    return idle_timeout if idle_timeout > 0 else None
+
+
+class VaultLockedError(Exception):
+    """セッションの鍵が破棄済み（ロック中）であることを示す例外"""
+
+
+class VaultSession:
     """
-    与えられたパラメータでハッシュ化テストを実行し、
-    実行時間とハッシュ結果を返す。
-    実際のマスターパスワードファイルは変更しない。
+    アンロック時に一度だけ鍵を導出し、セッション中はメモリ上に保持する。
+    保存のたびに PBKDF2 を実行しなくて済むようにするためのもの。
 
-    戻り値: {
-        "success": bool,
-        "hash": str（ハッシュ値、成功時のみ）,
-        "execution_time": float（秒）,
-        "error": str（エラー時のみ）,
-    }
+    - lock() で鍵を明示的に消去する（ロック時・終了時に呼ぶ）
+    - idle_timeout（秒）を指定すると、最後の利用からその時間が経過した時点で鍵を消去する
     """
 
+    def __init__(self, idle_timeout=None):
+        self.idle_timeout = idle_timeout
+        self._key = (
+            None  # bytearray（消去できるように bytes ではなく bytearray で保持）
+        )
+        self._last_used = 0.0
+        self._lock = threading.Lock()
+        self._stop_watch = threading.Event()
+
+    def unlock(self, master_password, filepath=None, cancel_event=None, create=False):
+        """
+        マスターパスワードで鍵ファイルから DEK を取り出してセッションを開始する。
+        create=True の場合は新しい DEK を作る（初回セットアップ時）。
+        cancel_event がセットされていた場合は、取り出した鍵を保持せずに破棄する。
+        """
+        key = open_vault_key(master_password, filepath, create=create)
+        self.unlock_with_key(key, cancel_event)
+
+    def unlock_with_key(self, key, cancel_event=None):
+        """鍵ファイルから取り出し済みの DEK でセッションを開始する"""
+        if len(key) != KEY_BYTES:
+            raise ValueError("鍵の長さが不正です。")
+        with self._lock:
+            if cancel_event is not None and cancel_event.is_set():
+                return
+            self._wipe()
+            self._key = bytearray(key)
+            self._last_used = time_module.monotonic()
+            self._stop_watch = threading.Event()
+
+        if self.idle_timeout:
+            threading.Thread(
+                target=self._watch_idle, args=(self._stop_watch,), daemon=True
+            ).start()
+
+    def is_unlocked(self):
+        with self._lock:
+            self._evict_if_idle()
+            return self._key is not None
+
+    @property
+    def key(self):
+        """
+        保持している鍵を返す。ロック済み・タイムアウト済みの場合は VaultLockedError。
+        アクセスするたびにアイドルタイマーをリセットする。
+        """
+        with self._lock:
+            self._evict_if_idle()
+            if self._key is None:
+                raise VaultLockedError(
+                    "セッションはロックされています。マスターパスワードを再入力してください。"
+                )
+            self._last_used = time_module.monotonic()
+            return bytes(self._key)
+
+    def touch(self):
+        """
+        鍵を使わない操作（一覧の取得など）でもアイドルタイマーをリセットする。
+        ロック済み・タイムアウト済みの場合は VaultLockedError。
+        """
+        with self._lock:
+            self._evict_if_idle()
+            if self._key is None:
+                raise VaultLockedError(
+                    "セッションはロックされています。マスターパスワードを再入力してください。"
+                )
+            self._last_used = time_module.monotonic()
+
+    def seal(self, text):
+        """パスワード / TOTP シークレットを個別に暗号化する（空文字列はそのまま）"""
+        return seal_secret(self.key, text)
+
+    def reveal(self, value):
+        """seal() で暗号化したシークレットを、必要になった時点で復号する"""
+        return reveal_secret(self.key, value)
+
+    def lock(self):
+        """鍵をメモリ上から消去してセッションをロックする"""
+        with self._lock:
+            self._wipe()
+
+    def _wipe(self):
+        # Python ではコピーを完全には消せないため、保持しているバッファの消去はベストエフォート
+        if self._key is not None:
+            for i in range(len(self._key)):
+                self._key[i] = 0
+            self._key = None
+        self._stop_watch.set()
+
+    def _evict_if_idle(self):
+        if (
+            self._key is not None
+            and self.idle_timeout
+            and time_module.monotonic() - self._last_used >= self.idle_timeout
+        ):
+            self._wipe()
+
+    def _watch_idle(self, stop_event):
+        """アイドルタイムアウトを監視し、期限が来たら鍵を消去するスレッド"""
+        while not stop_event.is_set():
+            with self._lock:
+                if self._key is None:
+                    return
+                remaining = (
+                    self._last_used + self.idle_timeout - time_module.monotonic()
+                )
+                if remaining <= 0:
+                    self._wipe()
+                    return
+            stop_event.wait(remaining)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.lock()
+
+
+# ========== パスワードファイルの形式 ==========
+# v2（チャンク分割ストリーミング形式、STREAM 構成）:
+#   ヘッダー: マジック(4) + バージョン(1) + 圧縮方式(1) + チャンクサイズ(4) + nonce プレフィックス(19)
+#   本体:     チャンクごとに ciphertext（最大チャンクサイズ） + tag(16)
+#   各チャンクの nonce は プレフィックス(19) + チャンク番号(4) + 最終チャンクフラグ(1)。
+#   ヘッダー全体を AAD として各チャンクに結び付け、並べ替え・切り詰め・差し替えを検出する。
+#   圧縮方式が 0 以外の場合、平文は暗号化の前に圧縮されている（チャンクは圧縮後のデータを区切ったもの）。
+# v1（旧形式）: nonce(24) + ciphertext + tag(16) の単一メッセージ。読み込みのみ対応する。
+
+VAULT_MAGIC = b"PMV2"
+VAULT_FORMAT_VERSION = 2
+VAULT_NONCE_PREFIX_BYTES = 19
+VAULT_HEADER_STRUCT = struct.Struct(">4sBBI19s")
+VAULT_HEADER_BYTES = VAULT_HEADER_STRUCT.size
+VAULT_TAG_BYTES = 16
+VAULT_CHUNK_SIZE = 64 * 1024  # 平文のチャンクサイズ
+# この数以上のチャンクがある場合はスレッドプールで並列に復号する
+VAULT_PARALLEL_MIN_CHUNKS = 4
+
+# 圧縮方式（settings.ini の [storage] compression で選ぶ）とヘッダーに記録する ID
+VAULT_COMPRESSION_IDS = {"none": 0, "zlib": 1, "lzma": 2, "zstd": 3}
+VAULT_COMPRESSION_NAMES = {v: k for k, v in VAULT_COMPRESSION_IDS.items()}
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 3
+
+
+@functools.lru_cache(maxsize=None)
+def _zstd_modules():
+    """(compression.zstd, zstandard) のうち読み込めたもの（無い場合は None）"""
     try:
-        start_time = time_module.time()
-        hashed_password = argon2.using(
-            type="id", memory_cost=m, time_cost=t, parallelism=p
-        ).hash(test_password)
-        end_time = time_module.time()
+        from compression import zstd  # Python 3.14 以降の標準ライブラリ
+    except ImportError:
+        zstd = None
+    try:
+        import zstandard
+    except ImportError:
+        zstandard = None
+    return zstd, zstandard
 
-        execution_time = end_time - start_time
-        return {
-            "success": True,
-            "hash": hashed_password,
-            "execution_time": execution_time,
-        }
-    except Exception as ex:
-        end_time = time_module.time()
-        execution_time = end_time - start_time
-        return {
-            "success": False,
-            "execution_time": execution_time,
-            "error": str(ex),
-        }
+
+def available_compressions():
+    """この環境で使える圧縮方式の一覧（zstd は対応モジュールがある場合のみ）"""
+    names = ["none", "zlib", "lzma"]
+    if any(module is not None for module in _zstd_modules()):
+        names.append("zstd")
+    return names
+
+
+def _new_compressor(compression):
+    if compression == "zlib":
+        return zlib.compressobj(ZLIB_LEVEL)
+    if compression == "lzma":
+        import lzma
+
+        return lzma.LZMACompressor()
+    zstd, zstandard = _zstd_modules()
+    if compression == "zstd" and zstd is not None:
+        return zstd.ZstdCompressor(level=ZSTD_LEVEL)
+    if compression == "zstd" and zstandard is not None:
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+    raise ValueError(f"この環境では使用できない圧縮方式です: {compression}")
+
+
+def _new_decompressor(compression):
+    if compression == "zlib":
+        return zlib.decompressobj()
+    if compression == "lzma":
+        import lzma
+
+        return lzma.LZMADecompressor()
+    zstd, zstandard = _zstd_modules()
+    if compression == "zstd" and zstd is not None:
+        return zstd.ZstdDecompressor()
+    if compression == "zstd" and zstandard is not None:
+        return zstandard.ZstdDecompressor().decompressobj()
+    raise ValueError(
+        f"パスワードファイルは {compression} で圧縮されていますが、この環境では展開できません。"
+    )
+
+
+def _compress_chunks(plaintext_chunks, compression):
+    """平文を順に圧縮し、圧縮後のデータを順に返すジェネレーター"""
+    compressor = _new_compressor(compression)
+    for piece in plaintext_chunks:
+        out = compressor.compress(piece)
+        if out:
+            yield out
+    tail = compressor.flush()
+    if tail:
+        yield tail
+
+
+def _decompress_chunks(chunks, compression):
+    """復号したチャンクを順に展開し、平文を順に返すジェネレーター"""
+    decompressor = _new_decompressor(compression)
+    errors = (zlib.error,)
+    if compression == "lzma":
+        import lzma
+
+        errors += (lzma.LZMAError,)
+    for module in _zstd_modules():
+        if module is not None:
+            errors += (module.ZstdError,)
+    try:
+        for chunk in chunks:
+            out = decompressor.decompress(chunk)
+            if out:
+                yield out
+    except errors as ex:
+        raise ValueError(f"パスワードファイルの展開に失敗しました: {ex}")
+    if not getattr(decompressor, "eof", True):
+        raise ValueError("パスワードファイルの圧縮データが途中で終わっています。")
+
+
+def _chunk_nonce(nonce_prefix, index, last):
+    return nonce_prefix + struct.pack(">IB", index, 1 if last else 0)
+
+
+def _seal_chunk(key, header, nonce_prefix, index, chunk, last):
+    cipher = _new_cipher(key, _chunk_nonce(nonce_prefix, index, last))
+    cipher.update(header)
+    ciphertext, tag = cipher.encrypt_and_digest(chunk)
+    return ciphertext + tag
+
+
+def encrypt_stream(
+    key, plaintext_chunks, chunk_size=VAULT_CHUNK_SIZE, compression="none"
+):
+    """
+    平文のバイト列を順に受け取り、v2 形式の暗号化データを順に返すジェネレーター。
+    入力の区切り方に関係なく chunk_size ごとに封緘するため、メモリ使用量はチャンクサイズ程度に収まる。
+    compression が "none" 以外なら、暗号化の前にストリーミングで圧縮する。
+    平文が空の場合（圧縮なし）は何も返さない。
+    """
+    if compression not in VAULT_COMPRESSION_IDS:
+        raise ValueError(f"不明な圧縮方式です: {compression}")
+    if compression != "none":
+        plaintext_chunks = _compress_chunks(plaintext_chunks, compression)
+    nonce_prefix = get_random_bytes(VAULT_NONCE_PREFIX_BYTES)
+    header = VAULT_HEADER_STRUCT.pack(
+        VAULT_MAGIC,
+        VAULT_FORMAT_VERSION,
+        VAULT_COMPRESSION_IDS[compression],
+        chunk_size,
+        nonce_prefix,
+    )
+    buf = bytearray()
+    index = 0
+    for piece in plaintext_chunks:
+        buf += piece
+        # 後続データがあると分かっているチャンクだけを先に封緘する（最終チャンクは最後に判定）
+        while len(buf) > chunk_size:
+            if index == 0:
+                yield header
+            yield _seal_chunk(
+                key, header, nonce_prefix, index, memoryview(buf)[:chunk_size], False
+            )
+            del buf[:chunk_size]
+            index += 1
+    if index == 0 and not buf:
+        return
+    if index == 0:
+        yield header
+    yield _seal_chunk(key, header, nonce_prefix, index, bytes(buf), True)
+
+
+def _parse_vault_header(view):
+    """
+    v2 ヘッダーを解析して (チャンクサイズ, nonce プレフィックス, 圧縮方式) を返す。
+    v2 形式でなければ None を返す。
+    """
+    if len(view) < VAULT_HEADER_BYTES or bytes(view[:4]) != VAULT_MAGIC:
+        return None
+    magic, version, compression_id, chunk_size, nonce_prefix = (
+        VAULT_HEADER_STRUCT.unpack_from(view)
+    )
+    if version != VAULT_FORMAT_VERSION or chunk_size <= 0:
+        return None
+    compression = VAULT_COMPRESSION_NAMES.get(compression_id)
+    if compression is None:
+        raise ValueError(
+            f"パスワードファイルの圧縮方式に対応していません（ID: {compression_id}）。"
+        )
+    return chunk_size, nonce_prefix, compression
+
+
+def _chunk_layout(total_bytes, chunk_size):
+    """
+    本体のバイト数から、各チャンクの (開始位置, 暗号文の長さ, 平文の開始位置) を計算する。
+    """
+    body = total_bytes - VAULT_HEADER_BYTES
+    sealed = chunk_size + VAULT_TAG_BYTES
+    count = -(-body // sealed)
+    if count == 0 or body - (count - 1) * sealed < VAULT_TAG_BYTES:
+        raise ValueError("パスワードファイルが破損しているか、不正な形式です。")
+    layout = []
+    for i in range(count):
+        start = VAULT_HEADER_BYTES + i * sealed
+        length = min(sealed, total_bytes - start) - VAULT_TAG_BYTES
+        layout.append((start, length, i * chunk_size))
+    return layout
+
+
+def _open_chunk(key, view, header, nonce_prefix, index, start, length, last, output):
+    """1 チャンクを output（書き込み先のメモリビュー）へ直接復号して検証する"""
+    cipher = _new_cipher(key, _chunk_nonce(nonce_prefix, index, last))
+    cipher.update(header)
+    cipher.decrypt(view[start : start + length], output=output)
+    cipher.verify(view[start + length : start + length + VAULT_TAG_BYTES])
+
+
+def _decrypt_failed_error():
+    return ValueError(
+        "パスワードファイルの復号化に失敗しました。マスターパスワードが間違っているか、ファイルが破損している可能性があります。"
+    )
+
+
+@contextlib.contextmanager
+def _mapped_view(filepath):
+    """ファイルを読み取り専用で mmap し、そのメモリビューを返すコンテキストマネージャー"""
+    with open(filepath, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(mm)
+        try:
+            yield view
+        finally:
+            view.release()
+            try:
+                mm.close()
+            except BufferError:
+                # 例外のトレースバックがスライスを参照している間は閉じられないため、GC に任せる
+                pass
+
+
+def _iter_open_chunks(key, view, chunk_size, nonce_prefix):
+    """v2 形式のチャンクを先頭から 1 つずつ復号・検証して返すジェネレーター"""
+    header = bytes(view[:VAULT_HEADER_BYTES])
+    layout = _chunk_layout(len(view), chunk_size)
+    for i, (start, length, _) in enumerate(layout):
+        out = bytearray(length)
+        try:
+            _open_chunk(
+                key,
+                view,
+                header,
+                nonce_prefix,
+                i,
+                start,
+                length,
+                i == len(layout) - 1,
+                out,
+            )
+        except (ValueError, KeyError):
+            raise _decrypt_failed_error()
+        yield out
+
+
+def decrypt_stream(key, filepath=None, offset=0):
+    """
+    パスワードファイルを mmap で読み、復号したチャンクを順に返すジェネレーター。
+    各チャンクは検証が済んでから返すため、改ざんされたデータが外に出ることはない。
+    圧縮されたファイルは展開した平文を順に返す。旧形式（v1）のファイルは単一のチャンクとして返す。
+    offset を指定すると、ファイルのその位置から始まる暗号化データを読む（バックアップバンドル用）。
+    """
+    if filepath is None:
+        filepath = get_password_file_path()
+    if not os.path.exists(filepath) or os.path.getsize(filepath) <= offset:
+        return
+
+    with _mapped_view(filepath) as mapped:
+        view = mapped[offset:]
+        try:
+            parsed = _parse_vault_header(view)
+            if parsed is None:
+                yield _decrypt_legacy(key, view)
+                return
+            chunk_size, nonce_prefix, compression = parsed
+            chunks = _iter_open_chunks(key, view, chunk_size, nonce_prefix)
+            if compression != "none":
+                chunks = _decompress_chunks(chunks, compression)
+            yield from chunks
+        finally:
+            view.release()
+
+
+def _decrypt_legacy(key, view):
+    """旧形式（nonce + ciphertext + tag の単一メッセージ）を復号する"""
+    # nonce(24) + tag(16) + 最低1バイトのデータが必要
+    if len(view) < 24 + 16 + 1:
+        raise ValueError("パスワードファイルが破損しているか、不正な形式です。")
+    out = bytearray(len(view) - 24 - 16)
+    try:
+        cipher = _new_cipher(key, view[:24])
+        cipher.decrypt(view[24:-16], output=out)
+        cipher.verify(view[-16:])
+    except (ValueError, KeyError):
+        raise _decrypt_failed_error()
+    return out
+
+
+def _decrypt_chunked(key, view, chunk_size, nonce_prefix):
+    """v2 形式の全チャンクを、1 つの出力バッファへ直接（必要なら並列に）復号する"""
+    header = bytes(view[:VAULT_HEADER_BYTES])
+    layout = _chunk_layout(len(view), chunk_size)
+    plaintext_size = sum(length for _, length, _ in layout)
+    out = bytearray(plaintext_size)
+    out_view = memoryview(out)
+    last_index = len(layout) - 1
+
+    def _open(i):
+        start, length, out_offset = layout[i]
+        _open_chunk(
+            key,
+            view,
+            header,
+            nonce_prefix,
+            i,
+            start,
+            length,
+            i == last_index,
+            out_view[out_offset : out_offset + length],
+        )
+
+    try:
+        if len(layout) >= VAULT_PARALLEL_MIN_CHUNKS:
+            # pycryptodome は C 呼び出し中に GIL を解放するため、スレッドで並列化できる
+            from concurrent.futures import ThreadPoolExecutor
+
+            with ThreadPoolExecutor(max_workers=os.cpu_count() or 1) as pool:
+                list(pool.map(_open, range(len(layout))))
+        else:
+            for i in range(len(layout)):
+                _open(i)
+    except (ValueError, KeyError):
+        raise _decrypt_failed_error()
+    finally:
+        out_view.release()
+    return out
+
+
+# ========== バックアップバンドル ==========
+# マスターパスワードや鍵ファイルがなくても、パスフレーズだけで復元できる自己完結型の暗号化ファイル。
+#   マジック(4) + 鍵ブロック（鍵ファイル v2 と同じ形式: KDF ヘッダー + ソルト + ラップしたバンドル鍵）
+#   + バンドル鍵で暗号化した v2 形式のデータ
+BUNDLE_MAGIC = b"PMB1"
+BUNDLE_KEY_BLOCK_BYTES = KEY_FILE_HEADER_STRUCT.size + 24 + KEY_BYTES + 16
+BUNDLE_PREFIX_BYTES = len(BUNDLE_MAGIC) + BUNDLE_KEY_BLOCK_BYTES
+
+
+def encrypt_bundle_stream(plaintext_chunks, passphrase, kdf=None, compression="none"):
+    """
+    平文のバイト列を順に受け取り、パスフレーズで暗号化したバンドルを順に返すジェネレーターを作る。
+    バンドル鍵は毎回ランダムに作り、kdf=(algorithm, params)（省略時は settings.ini の設定）で
+    パスフレーズから導出した鍵でラップする。KDF とソルトは鍵ブロックのヘッダーに記録される。
+    """
+    if len(passphrase) < PASSWORD_MIN_LENGTH:
+        raise ValueError("バンドルのパスフレーズは12文字以上である必要があります。")
+    bundle_key = get_random_bytes(KEY_BYTES)
+    key_block = wrap_vault_key(bundle_key, passphrase, kdf=kdf)
+
+    def _blocks():
+        yield BUNDLE_MAGIC + key_block
+        yield from encrypt_stream(bundle_key, plaintext_chunks, compression=compression)
+
+    return _blocks()
+
+
+def is_bundle_file(filepath):
+    with open(filepath, "rb") as f:
+        return f.read(len(BUNDLE_MAGIC)) == BUNDLE_MAGIC
+
+
+def decrypt_bundle_stream(filepath, passphrase):
+    """
+    バンドルを開き、復号した平文を順に返すジェネレーターを作る。
+    パスフレーズが違う場合や、バンドルでない場合は ValueError を送出する（ジェネレーターを作る前に確認する）。
+    """
+    with open(filepath, "rb") as f:
+        prefix = f.read(BUNDLE_PREFIX_BYTES)
+    if len(prefix) != BUNDLE_PREFIX_BYTES or not prefix.startswith(BUNDLE_MAGIC):
+        raise ValueError("バックアップバンドルが破損しているか、不正な形式です。")
+    try:
+        bundle_key = unwrap_vault_key(prefix[len(BUNDLE_MAGIC) :], passphrase)
+    except ValueError:
+        raise ValueError(
+            "バックアップバンドルを開けませんでした。パスフレーズが間違っているか、ファイルが破損している可能性があります。"
+        )
+    return decrypt_stream(bundle_key, filepath, offset=BUNDLE_PREFIX_BYTES)
+
+
+def _fsync_directory(directory):
+    """ディレクトリエントリ（置き換え後のファイル名）をディスクに反映する（Windows では不要）"""
+    if os.name == "nt":
+        return
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def atomic_write(filepath, blocks):
+    """
+    一時ファイルに書き込んで fsync し、os.replace で置き換える。
+    書き込み中にクラッシュしても、元のファイルは壊れずに残る。
+    """
+    directory = os.path.dirname(filepath) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(
+        prefix=os.path.basename(filepath) + ".", suffix=".tmp", dir=directory
+    )
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for block in blocks:
+                f.write(block)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, filepath)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    _fsync_directory(directory)
+
+
+# ========== 保管庫のロック ==========
+# GUI・コマンドライン版・アンロックエージェントが同じパスワードファイルを扱うため、
+# 読み込み・変更・書き込みの間は <パスワードファイル>.lock の排他ロックを保持する（vault_lock）。
+# GUI はメモリ上の全データを書き戻すため、開いている間は <パスワードファイル>.lease も保持し
+# （acquire_vault_lease）、コマンドライン版はリースを取れない間は書き込みを拒否する。
+VAULT_LOCK_SUFFIX = ".lock"
+VAULT_LEASE_SUFFIX = ".lease"
+
+
+class VaultInUseError(Exception):
+    """ほかのウィンドウやプロセスが保管庫を書き込み用に開いていることを示す例外"""
+
+
+def _open_lock_file(path, blocking):
+    """ロックファイルを開いて排他ロックを取得し、ファイルディスクリプタを返す（取れなければ None）"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        if os.name == "nt":
+            import msvcrt
+
+            msvcrt.locking(fd, msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+
+            fcntl.flock(
+                fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+            )
+    except OSError:
+        os.close(fd)
+        if blocking:
+            raise
+        return None
+    return fd
+
+
+def _close_lock_file(fd):
+    try:
+        if os.name == "nt":
+            import msvcrt
+
+            os.lseek(fd, 0, os.SEEK_SET)
+            msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+
+            fcntl.flock(fd, fcntl.LOCK_UN)
+    finally:
+        os.close(fd)
+
+
+class VaultFileLock:
+    """
+    ロックファイルによるプロセス間の排他ロック（with で使う）。
+    同じプロセス内ではスレッド間の排他も兼ね、同じスレッドからは再入できる。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+
+    def acquire(self):
+        self._thread_lock.acquire()
+        if self._depth == 0:
+            try:
+                self._fd = _open_lock_file(self.path, blocking=True)
+            except BaseException:
+                self._thread_lock.release()
+                raise
+        self._depth += 1
+
+    def release(self):
+        self._depth -= 1
+        try:
+            if self._depth == 0:
+                fd, self._fd = self._fd, None
+                _close_lock_file(fd)
+        finally:
+            self._thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+
+class VaultLease:
+    """
+    GUI が保管庫を開いている間保持するリース（acquire_vault_lease で取得する）。
+    取得したスレッド以外からも release() できる。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._guard = threading.Lock()
+        self._fd = None
+
+    def _try_acquire(self):
+        with self._guard:
+            if self._fd is not None:
+                return False  # 同じプロセスの別の画面が保持している
+            self._fd = _open_lock_file(self.path, blocking=False)
+            return self._fd is not None
+
+    def release(self):
+        with self._guard:
+            if self._fd is not None:
+                fd, self._fd = self._fd, None
+                _close_lock_file(fd)
+
+
+_vault_locks = {}
+_vault_locks_guard = threading.Lock()
+
+
+def _shared_lock(path, lock_class):
+    """同じロックファイルには、プロセス内で 1 つのオブジェクトを使う"""
+    path = os.path.abspath(path)
+    with _vault_locks_guard:
+        lock = _vault_locks.get(path)
+        if lock is None:
+            lock = _vault_locks[path] = lock_class(path)
+        return lock
+
+
+def vault_lock(filepath=None):
+    """パスワードファイル（とジャーナル）の読み込み・変更・書き込みの間に保持する排他ロックを返す"""
+    if filepath is None:
+        filepath = get_password_file_path()
+    return _shared_lock(filepath + VAULT_LOCK_SUFFIX, VaultFileLock)
+
+
+def acquire_vault_lease(filepath=None):
+    """
+    保管庫を書き込み用に開くリースを取得する（閉じるときに release() する）。
+    ほかのウィンドウやプロセスが保持している場合は VaultInUseError を送出する。
+    """
+    if filepath is None:
+        filepath = get_password_file_path()
+    lease = _shared_lock(filepath + VAULT_LEASE_SUFFIX, VaultLease)
+    if not lease._try_acquire():
+        raise VaultInUseError(
+            "ほかのウィンドウまたはプロセスがこのパスワードファイルを開いています。"
+        )
+    return lease
+
+
+def load_compression_from_config():
+    """settings.ini から圧縮方式（none / zlib / lzma / zstd）を読み込む"""
+    compression = settings.get("storage", "compression", "none").lower()
+    if compression in available_compressions():
+        return compression
+    if compression == "zstd":
+        print("警告: zstd が利用できないため、zlib で圧縮します。")
+        return "zlib"
+    print(f"警告: 不明な圧縮方式です。圧縮しません: {compression}")
+    return "none"
+
+
+def encrypt_password_file(
+    plaintext_bytes, master_password=None, filepath=None, key=None, compression=None
+):
+    """
+    平文のバイトデータを暗号化し、v2（チャンク分割）形式でファイルにアトミックに保存する。
+    key（VaultSession.key）が渡された場合は鍵導出を行わずにそれを使う。
+    compression を省略した場合は settings.ini の設定で圧縮する。
+    """
+    if filepath is None:
+        filepath = get_password_file_path()
+
+    if key is None:
+        key = open_vault_key(master_password, filepath)
+
+    if compression is None:
+        compression = load_compression_from_config()
+    if not plaintext_bytes:
+        compression = "none"
+
+    # 空のデータは空ファイルとして保存される（encrypt_stream は何も返さない）
+    with vault_lock(filepath):
+        atomic_write(
+            filepath, encrypt_stream(key, [plaintext_bytes], compression=compression)
+        )
+
+
+class BackgroundVaultWriter:
+    """
+    保存を UI スレッドから切り離すための書き込みスレッド（write-behind）。
+    submit() された内容は debounce 秒だけ待ってからまとめて 1 回で書き込み、
+    連続した変更は最後の内容だけが書き込まれる。書き込みは encrypt_password_file（アトミック）で行う。
+    submit() が続いても、最初の未保存の変更から max_delay 秒が経過した時点で書き込む。
+    書き込みに失敗した内容は破棄せずに保持し、retry_delay 秒ごとに再試行する。
+    """
+
+    def __init__(
+        self,
+        session,
+        filepath=None,
+        debounce=0.2,
+        on_error=None,
+        max_delay=2.0,
+        retry_delay=1.0,
+    ):
+        self.session = session
+        self.filepath = filepath
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.retry_delay = retry_delay
+        self.on_error = on_error
+        self._cond = threading.Condition()
+        self._pending = None
+        self._submitted = 0  # submit された回数
+        self._written = 0  # 書き込み済み（または断念して確定済み）の submit 回数
+        self._dirty_since = None  # 最初の未保存の変更の時刻
+        self._retry_at = None  # 失敗した書き込みを再試行する時刻
+        self._failures = 0  # 連続して失敗した回数
+        self._closed = False
+        self._last_latency = None
+        self._last_error = None
+        self._write_count = 0
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, plaintext_bytes):
+        """保存する内容を登録する。未書き込みの内容があれば置き換える（すぐに戻る）"""
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("書き込みスレッドは既に終了しています。")
+            self._pending = plaintext_bytes
+            self._submitted += 1
+            if self._dirty_since is None:
+                self._dirty_since = time_module.monotonic()
+            self._cond.notify_all()
+
+    def flush(self, timeout=None):
+        """
+        呼び出し時点までに submit された内容がディスクに書き込まれるまで待つ。
+        タイムアウトした場合（書き込みが失敗し続けている場合を含む）は False を返す。
+        """
+        with self._cond:
+            target = self._submitted
+            self._cond.notify_all()
+            return self._cond.wait_for(lambda: self._written >= target, timeout)
+
+    def close(self, timeout=None):
+        """未書き込みの内容を書き込んでからスレッドを終了する（失敗した内容も最後に 1 回だけ再試行する）"""
+        flushed = self.flush(timeout)
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        return flushed
+
+    def stats(self):
+        """保存の状況（待ち行列の深さ、未保存の変更の有無、直近の書き込み時間など）を返す"""
+        with self._cond:
+            return {
+                "queue_depth": self._submitted - self._written,
+                "dirty": self._pending is not None,
+                "last_latency": self._last_latency,
+                "write_count": self._write_count,
+                "last_error": self._last_error,
+                "failures": self._failures,
+            }
+
+    def _wait_for_write_time(self):
+        """書き込む時刻まで待つ（self._cond を保持した状態で呼ぶ）"""
+        while not self._closed:
+            now = time_module.monotonic()
+            if self._retry_at is not None:
+                # 失敗した書き込みは retry_delay 秒おいてから再試行する
+                if now >= self._retry_at:
+                    return
+                self._cond.wait(self._retry_at - now)
+                continue
+            # 連続した変更をまとめるため、新しい submit が来なくなるまで少し待つ。
+            # ただし最初の未保存の変更から max_delay 秒を過ぎたら待たずに書き込む
+            deadline = self._dirty_since + self.max_delay
+            if now >= deadline:
+                return
+            seen = self._submitted
+            self._cond.wait(min(self.debounce, deadline - now))
+            if self._submitted == seen:
+                return
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending is not None or self._closed)
+                if self._pending is None:
+                    return
+                self._wait_for_write_time()
+                plaintext_bytes = self._pending
+                target = self._submitted
+                closing = self._closed
+                self._pending = None
+
+            start = time_module.perf_counter()
+            error = None
+            try:
+                encrypt_password_file(
+                    plaintext_bytes, filepath=self.filepath, key=self.session.key
+                )
+            except Exception as ex:
+                error = ex
+
+            give_up = False
+            with self._cond:
+                self._last_latency = time_module.perf_counter() - start
+                self._last_error = error
+                if error is None:
+                    self._write_count += 1
+                    self._written = target
+                    self._failures = 0
+                    self._retry_at = None
+                    self._dirty_since = (
+                        time_module.monotonic() if self._pending is not None else None
+                    )
+                else:
+                    self._failures += 1
+                    if self._pending is None:
+                        # 新しい submit が無ければ、失敗した内容を次の再試行で書き込む
+                        self._pending = plaintext_bytes
+                    # 終了時の最後の試行やロック後（鍵が無い）は、再試行しても書き込めないため断念する
+                    give_up = closing or isinstance(error, VaultLockedError)
+                    if give_up:
+                        self._pending = None
+                        self._dirty_since = None
+                        self._retry_at = None
+                        self._written = self._submitted
+                    else:
+                        self._retry_at = time_module.monotonic() + self.retry_delay
+                failures = self._failures
+                self._cond.notify_all()
+            # 失敗が続いている間は、最初の失敗と断念したときだけ通知する
+            if error is not None and self.on_error and (failures == 1 or give_up):
+                self.on_error(error)
+
+
+def decrypt_password_file(master_password=None, filepath=None, key=None):
+    """
+    パスワードファイルを復号化し、平文のバイトデータ（bytearray）を返す。
+    key（VaultSession.key）が渡された場合は鍵導出を行わずにそれを使う。
+    ファイルは mmap で読み、各チャンクを出力バッファへ直接復号するため余分なコピーは作らない。
+    ディスクへの書き込みは行わない。
+    """
+    if filepath is None:
+        filepath = get_password_file_path()
+
+    if not os.path.exists(filepath) or os.path.getsize(filepath) == 0:
+        return b""  # ファイルが存在しないか空なら空のバイト列を返す
+
+    if key is None:
+        key = open_vault_key(master_password, filepath, write=False)
+
+    with _mapped_view(filepath) as view:
+        parsed = _parse_vault_header(view)
+        if parsed is None:
+            return _decrypt_legacy(key, view)
+        chunk_size, nonce_prefix, compression = parsed
+        if compression != "none":
+            # 圧縮されている場合は、チャンクを復号しながら順に展開する
+            out = bytearray()
+            for piece in _decompress_chunks(
+                _iter_open_chunks(key, view, chunk_size, nonce_prefix), compression
+            ):
+                out += piece
+            return out
+        try:
+            return _decrypt_chunked(key, view, chunk_size, nonce_prefix)
+        except ValueError:
+            # 旧形式の nonce が偶然マジックと一致した場合に備えて、旧形式でも試す
+            return _decrypt_legacy(key, view)
+
+
+# ========== レコード単位のシークレット暗号化 ==========
+# パスワードと TOTP シークレットは、ファイル全体の暗号化とは別にレコードごとに個別に暗号化する。
+# 一覧表示に必要なサービス名・ユーザー名だけを平文で展開し、シークレットはコピー・編集で
+# 必要になった時点で復号する（アンロック時に全シークレットを文字列として展開しない）。
+
+RECORD_SECRET_CONTEXT = b"password-manager record secrets v1"
+SEALED_VAULT_MARKER = "#pm-sealed-v1"
+
+
+def _record_secret_key(vault_key):
+    """ファイル暗号化用の鍵から、レコード単位のシークレット用の鍵を HKDF で導出する"""
+    return _hkdf_sha256(vault_key, b"", RECORD_SECRET_CONTEXT)
+
+
+class SealedSecret:
+    """個別に暗号化されたシークレット（nonce(24) + ciphertext + tag(16)）"""
+
+    __slots__ = ("blob",)
+
+    def __init__(self, blob):
+        self.blob = bytes(blob)
+
+    def reveal(self, vault_key):
+        return self._open(_record_secret_key(vault_key))
+
+    def _open(self, record_key):
+        try:
+            nonce, ciphertext, tag = self.blob[:24], self.blob[24:-16], self.blob[-16:]
+            cipher = _new_cipher(record_key, nonce)
+            return cipher.decrypt_and_verify(ciphertext, tag).decode("utf-8")
+        except (ValueError, KeyError, UnicodeDecodeError):
+            raise ValueError("シークレットの復号化に失敗しました。")
+
+    def __len__(self):
+        # 一覧のマスク表示用（平文のバイト数）
+        return max(len(self.blob) - 24 - 16, 0)
+
+    def __repr__(self):
+        return "SealedSecret(***)"
+
+
+def seal_secret(vault_key, text):
+    """シークレットを暗号化して SealedSecret を返す。空文字列は空文字列のまま返す"""
+    if isinstance(text, SealedSecret) or not text:
+        return text
+    return _seal_with(_record_secret_key(vault_key), text)
+
+
+def _seal_with(record_key, text):
+    nonce = get_random_bytes(24)
+    cipher = _new_cipher(record_key, nonce)
+    ciphertext, tag = cipher.encrypt_and_digest(text.encode("utf-8"))
+    return SealedSecret(nonce + ciphertext + tag)
+
+
+def reveal_secret(vault_key, value):
+    """SealedSecret を復号して文字列を返す。空文字列はそのまま返す"""
+    if isinstance(value, SealedSecret):
+        return value.reveal(vault_key)
+    return value or ""
+
+
+class SecretBatch:
+    """
+    多数のシークレットをまとめて暗号化・復号する（インポートやエクスポートなどの一括処理用）。
+    seal_secret() / reveal_secret() は呼び出しごとに HKDF を実行するが、
+    こちらはレコード用の鍵を一度だけ導出して使い回す。使い終わったら破棄すること。
+    """
+
+    __slots__ = ("_record_key",)
+
+    def __init__(self, vault_key):
+        self._record_key = _record_secret_key(vault_key)
+
+    def seal(self, text):
+        if isinstance(text, SealedSecret) or not text:
+            return text
+        return _seal_with(self._record_key, text)
+
+    def reveal(self, value):
+        if isinstance(value, SealedSecret):
+            return value._open(self._record_key)
+        return value or ""
+
+
+# ========== レコードとリポジトリ ==========
+@dataclass(slots=True)
+class PasswordRecord:
+    """
+    1 件分のパスワード情報。__slots__ により辞書よりも 1 件あたりのメモリが小さい。
+    password / totp_secret は SealedSecret（未設定なら空文字列）。
+    totp_valid は TOTP シークレットの妥当性（未検証なら None）で、一覧表示で復号せずに使う。
+    extra_fields はこのバージョンが知らないフィールド（(タグ, 値) のタプル）で、保存時にそのまま書き戻す。
+    """
+
+    service_name: str = ""
+    username: str = ""
+    password: object = ""
+    totp_secret: object = ""
+    totp_valid: object = None
+    extra_fields: tuple = ()
+
+    def __post_init__(self):
+        # 同じサービス名・ユーザー名は使い回されることが多いため、文字列を共有する
+        self.service_name = sys.intern(self.service_name)
+        self.username = sys.intern(self.username)
+
+
+class PasswordStore:
+    """
+    PasswordRecord を順序付きで保持するリポジトリ。
+    UI・ジャーナル・検索はこの API（get / add / update / delete / 反復）を通してレコードを扱う。
+    """
+
+    __slots__ = ("_records",)
+
+    def __init__(self, records=()):
+        self._records = list(records)
+
+    def __len__(self):
+        return len(self._records)
+
+    def __iter__(self):
+        return iter(self._records)
+
+    def __getitem__(self, index):
+        # スライスにも対応する（一覧の表示範囲の取得など）
+        return self._records[index]
+
+    def get(self, index):
+        return self._records[index]
+
+    def add(self, record):
+        """末尾に追加し、追加した位置を返す"""
+        self._records.append(record)
+        return len(self._records) - 1
+
+    def update(self, index, record):
+        """指定位置のレコードを置き換え、置き換える前のレコードを返す"""
+        old_record = self._records[index]
+        self._records[index] = record
+        return old_record
+
+    def delete(self, index):
+        """指定位置のレコードを削除して返す"""
+        return self._records.pop(index)
+
+    def index_of(self, record):
+        """レコードの現在の位置を同一性で探す（見つからなければ None）"""
+        for i, r in enumerate(self._records):
+            if r is record:
+                return i
+        return None
+
+    def find(self, service_name, username=None):
+        """サービス名（とユーザー名）が一致するレコードの位置を順に返す"""
+        return [
+            i
+            for i, r in enumerate(self._records)
+            if r.service_name == service_name
+            and (username is None or r.username == username)
+        ]
+
+
+# パスワードファイルを復号化して内容を取得する関数
+def get_decrypted_passwords(master_password=None, filepath=None, key=None):
+    """
+    パスワードファイルを復号して一覧を返す。
+    各レコードの password / totp_secret は SealedSecret のまま返すため、
+    平文が必要な箇所で reveal_secret()（または VaultSession.reveal()）を呼ぶこと。
+    """
+    if filepath is None:
+        filepath = get_password_file_path()
+
+    journal_exists = os.path.exists(journal_path_for(filepath))
+    if not journal_exists and (
+        not os.path.exists(filepath) or os.path.getsize(filepath) == 0
+    ):
+        return PasswordStore()
+
+    if key is None:
+        # スナップショットとジャーナル（と旧形式のシークレット）で使うため、鍵の導出は一度だけ行う
+        key = open_vault_key(master_password, filepath, write=False)
+
+    # スナップショットとジャーナルを読む間に、ほかのプロセスが畳み込まないようにする
+    with vault_lock(filepath):
+        try:
+            decrypted_bytes = decrypt_password_file(filepath=filepath, key=key)
+        except ValueError as e:
+            # 復号エラーはここで捕捉し、空リストを返すか、再度例外を送出するか選択
+            # UI側でエラーメッセージを処理するため、ここでは再送出が適切
+            raise e
+
+        passwords = parse_passwords(decrypted_bytes, key)
+
+        # ジャーナルモードで追記された変更があれば、スナップショットに再適用する
+        if os.path.exists(journal_path_for(filepath)):
+            replay_journal(passwords, key, filepath)
+    return passwords
+
+
+def _record_from_row(row, sealed, key):
+    """CSV の 1 行を PasswordRecord に変換する（不正な行は None）"""
+    if not row or all([not cell.strip() for cell in row]):
+        return None
+    if len(row) < 3:
+        print(f"警告: 保存ファイルの行が不正な形式です。スキップします: {row}")
+        return None
+    password = row[2]
+    totp_secret = row[3] if len(row) >= 4 else ""
+    totp_valid = _TOTP_VALID_FROM_CELL.get(row[4]) if len(row) >= 5 else None
+    if sealed:
+        password = SealedSecret(base64.b64decode(password)) if password else ""
+        totp_secret = SealedSecret(base64.b64decode(totp_secret)) if totp_secret else ""
+    else:
+        # 旧形式（平文の CSV）は読み込み時に封緘し、次回の保存で新形式に移行する
+        if totp_secret:
+            totp_valid = totp_secret_is_valid(totp_secret)
+        password = seal_secret(key, password)
+        totp_secret = seal_secret(key, totp_secret)
+    return PasswordRecord(row[0], row[1], password, totp_secret, totp_valid)
+
+
+def _parse_csv_records(decrypted_bytes, key):
+    """旧形式（CSV）の平文を PasswordStore に変換する"""
+    passwords = PasswordStore()
+    try:
+        decrypted_content = decrypted_bytes.decode("utf-8")
+    except UnicodeDecodeError:
+        raise ValueError("パスワードファイルのデータが破損しており、読み込めません。")
+
+    lines = decrypted_content.splitlines()
+    sealed = bool(lines) and lines[0] == SEALED_VAULT_MARKER
+    if sealed:
+        lines = lines[1:]
+
+    # CSV としてパースして、オプションで 4 列目に totp_secret を扱う
+    reader = csv.reader(lines)
+    for row in reader:
+        try:
+            record = _record_from_row(row, sealed, key)
+        except binascii.Error:
+            raise ValueError(
+                "パスワードファイルのデータが破損しており、読み込めません。"
+            )
+        if record is not None:
+            passwords.add(record)
+    return passwords
+
+
+# 5 列目: TOTP シークレットの妥当性（"1" / "0" / 未検証なら空）
+_TOTP_VALID_FROM_CELL = {"1": True, "0": False}
+
+
+# ========== レコードのバイナリ形式 ==========
+# パスワードファイル（とジャーナルのエントリ）を復号した平文の形式:
+#   ヘッダー:   マジック(4) + バージョン(1) + 予約(3)
+#   レコード:   長さ(4) + フィールドの並び
+#   フィールド: タグ(1) + 長さ(4) + 値
+# 値が空のフィールドは書き出さない（読み込み時は既定値になる）。
+# 知らないタグのフィールドは読み飛ばして extra_fields に保持するため、
+# フィールド（メモや URL など）を追加しても古いバージョンで読み込め、保存しても失われない。
+# バージョンは互換性のない変更をしたときだけ上げる。
+
+RECORD_FORMAT_MAGIC = b"PMRB"
+RECORD_FORMAT_VERSION = 1
+RECORD_HEADER_STRUCT = struct.Struct(">4sB3x")
+_RECORD_LENGTH_STRUCT = struct.Struct(">I")
+_RECORD_FIELD_STRUCT = struct.Struct(">BI")
+
+RECORD_FIELD_SERVICE_NAME = 1  # UTF-8
+RECORD_FIELD_USERNAME = 2  # UTF-8
+RECORD_FIELD_PASSWORD = 3  # SealedSecret の中身
+RECORD_FIELD_TOTP_SECRET = 4  # SealedSecret の中身
+RECORD_FIELD_TOTP_VALID = 5  # 1 バイト（1: 妥当、0: 不正）
+
+
+def _record_format_error():
+    return ValueError("パスワードファイルのデータが破損しており、読み込めません。")
+
+
+def _parse_binary_records(view):
+    """
+    バイナリ形式の平文（memoryview）を PasswordStore に変換する。
+    平文全体を文字列にデコードしたり行に分割したりせず、各フィールドをバッファから直接読む。
+    """
+    records = []
+    if len(view) < RECORD_HEADER_STRUCT.size:
+        raise _record_format_error()
+    magic, version = RECORD_HEADER_STRUCT.unpack_from(view, 0)
+    if version > RECORD_FORMAT_VERSION:
+        raise ValueError(
+            "このパスワードファイルは新しいバージョンの形式で保存されているため、読み込めません。"
+        )
+    unpack_length = _RECORD_LENGTH_STRUCT.unpack_from
+    unpack_field = _RECORD_FIELD_STRUCT.unpack_from
+    offset = RECORD_HEADER_STRUCT.size
+    end = len(view)
+    try:
+        while offset < end:
+            (length,) = unpack_length(view, offset)
+            offset += 4
+            record_end = offset + length
+            if record_end > end:
+                raise _record_format_error()
+            service_name = username = password = totp_secret = ""
+            totp_valid = None
+            extra_fields = ()
+            while offset < record_end:
+                tag, size = unpack_field(view, offset)
+                offset += 5
+                value_end = offset + size
+                if value_end > record_end:
+                    raise _record_format_error()
+                if tag == RECORD_FIELD_SERVICE_NAME:
+                    service_name = str(view[offset:value_end], "utf-8")
+                elif tag == RECORD_FIELD_USERNAME:
+                    username = str(view[offset:value_end], "utf-8")
+                elif tag == RECORD_FIELD_PASSWORD:
+                    password = SealedSecret(bytes(view[offset:value_end]))
+                elif tag == RECORD_FIELD_TOTP_SECRET:
+                    totp_secret = SealedSecret(bytes(view[offset:value_end]))
+                elif tag == RECORD_FIELD_TOTP_VALID:
+                    totp_valid = view[offset] == 1 if size else None
+                else:
+                    extra_fields += ((tag, bytes(view[offset:value_end])),)
+                offset = value_end
+            records.append(
+                PasswordRecord(
+                    service_name,
+                    username,
+                    password,
+                    totp_secret,
+                    totp_valid,
+                    extra_fields,
+                )
+            )
+    except (struct.error, UnicodeDecodeError):
+        raise _record_format_error()
+    return PasswordStore(records)
+
+
+def parse_passwords(decrypted_bytes, key):
+    """
+    復号済みのバイトデータを PasswordStore に変換する。
+    バイナリ形式でなければ旧形式（CSV）として読み込む（次回の保存でバイナリ形式に移行する）。
+    """
+    if not decrypted_bytes:
+        return PasswordStore()
+    with memoryview(decrypted_bytes) as view:
+        if view[: len(RECORD_FORMAT_MAGIC)] == RECORD_FORMAT_MAGIC:
+            return _parse_binary_records(view)
+    return _parse_csv_records(decrypted_bytes, key)
+
+
+def _secret_field_bytes(value):
+    if not value:
+        return b""
+    if not isinstance(value, SealedSecret):
+        raise ValueError("暗号化されていないシークレットは保存できません。")
+    return value.blob
+
+
+def serialize_passwords(passwords):
+    """
+    PasswordRecord の並び（PasswordStore など）をバイナリ形式のバイトデータに変換する。
+    password / totp_secret は SealedSecret のまま書き出す。
+    """
+    pack_field = _RECORD_FIELD_STRUCT.pack
+    out = bytearray(
+        RECORD_HEADER_STRUCT.pack(RECORD_FORMAT_MAGIC, RECORD_FORMAT_VERSION)
+    )
+    for p in passwords:
+        fields = [
+            (RECORD_FIELD_SERVICE_NAME, p.service_name.encode("utf-8")),
+            (RECORD_FIELD_USERNAME, p.username.encode("utf-8")),
+            (RECORD_FIELD_PASSWORD, _secret_field_bytes(p.password)),
+            (RECORD_FIELD_TOTP_SECRET, _secret_field_bytes(p.totp_secret)),
+        ]
+        if p.totp_valid is not None:
+            fields.append(
+                (RECORD_FIELD_TOTP_VALID, b"\x01" if p.totp_valid else b"\x00")
+            )
+        fields.extend(p.extra_fields)
+        body = b"".join(
+            pack_field(tag, len(value)) + value for tag, value in fields if value
+        )
+        out += _RECORD_LENGTH_STRUCT.pack(len(body))
+        out += body
+    return bytes(out)
+
+
+# ========== ジャーナル（追記型ストレージ） ==========
+# 1 件の追加・編集・削除ごとに、個別に認証付き暗号化したレコードをジャーナルへ追記する。
+# 起動時はスナップショット（パスワードファイル本体）を読み込んだ後にジャーナルを再適用し、
+# ジャーナルが大きくなったらスナップショットへ畳み込む（コンパクション）。
+#
+# ジャーナルのファイル形式:
+#   ヘッダー: マジック(4) + 適用先スナップショットID(16)
+#   エントリ: 長さ(4) + nonce(24) + ciphertext + tag(16)
+#   平文:     操作(1) + インデックス(4) + レコード（バイナリ形式で 1 件、旧版は CSV 1 行）
+#   AAD:      ヘッダー + シーケンス番号(8)（並べ替え・別スナップショットへの流用を防ぐ）
+
+JOURNAL_SUFFIX = ".journal"
+JOURNAL_MAGIC = b"PMJ1"
+JOURNAL_HEADER_BYTES = len(JOURNAL_MAGIC) + 16
+JOURNAL_OP_ADD = b"A"
+JOURNAL_OP_UPDATE = b"U"
+JOURNAL_OP_DELETE = b"D"
+
+# コンパクションの閾値
+JOURNAL_COMPACT_MAX_BYTES = (
+    4 * 1024 * 1024
+)  # ジャーナルがこのサイズを超えたら必ず畳み込む
+JOURNAL_COMPACT_MIN_BYTES = 64 * 1024  # これ未満なら比率に関係なく畳み込まない
+JOURNAL_COMPACT_RATIO = 0.5  # スナップショットに対するジャーナルの比率
+
+
+def journal_path_for(filepath=None):
+    """パスワードファイルに対応するジャーナルファイルのパスを返す"""
+    if filepath is None:
+        filepath = get_password_file_path()
+    return filepath + JOURNAL_SUFFIX
+
+
+def load_storage_mode_from_config():
+    """settings.ini から保存方式（"snapshot" または "journal"）を読み込む"""
+    mode = settings.get("storage", "mode", "snapshot").lower()
+    if mode in ("snapshot", "journal"):
+        return mode
+    print(f"警告: 不明な保存方式です。snapshot を使用します: {mode}")
+    return "snapshot"
+
+
+def _snapshot_id(filepath):
+    """
+    スナップショットを識別する ID を返す。
+    暗号化ファイルの先頭には毎回ランダムな nonce が書かれるため、先頭部分のハッシュで十分に一意になる。
+    """
+    if not os.path.exists(filepath) or os.path.getsize(filepath) == 0:
+        return b"\x00" * 16
+    with open(filepath, "rb") as f:
+        head = f.read(64)
+    return hashlib.sha256(head).digest()[:16]
+
+
+def _journal_aad(header, seq):
+    return header + struct.pack(">Q", seq)
+
+
+def _encode_journal_payload(op, index, record):
+    body = b""
+    if record is not None:
+        body = serialize_passwords([record])
+    return op + struct.pack(">I", index) + body
+
+
+def _read_journal_entries(key, filepath):
+    """
+    ジャーナルを先頭から読み、(シーケンス番号, 平文) を順に返すジェネレーター。
+    対応するスナップショットと一致しないジャーナルは古いものとして無視する。
+    末尾の書きかけエントリ（書き込み中のクラッシュ）は無視する。
+    """
+    path = journal_path_for(filepath)
+    if not os.path.exists(path):
+        return
+    expected_header = JOURNAL_MAGIC + _snapshot_id(filepath)
+    with open(path, "rb") as f:
+        header = f.read(JOURNAL_HEADER_BYTES)
+        if header != expected_header:
+            return
+        seq = 0
+        while True:
+            length_bytes = f.read(4)
+            if len(length_bytes) < 4:
+                return
+            (length,) = struct.unpack(">I", length_bytes)
+            blob = f.read(length)
+            if len(blob) < length or length < 24 + 16:
+                return
+            try:
+                cipher = _new_cipher(key, blob[:24])
+                cipher.update(_journal_aad(header, seq))
+                payload = cipher.decrypt_and_verify(blob[24:-16], blob[-16:])
+            except (ValueError, KeyError):
+                raise ValueError(
+                    "ジャーナルの復号化に失敗しました。ファイルが破損している可能性があります。"
+                )
+            yield seq, payload
+            seq += 1
+
+
+def _apply_journal_payload(passwords, payload, key):
+    """ジャーナルの 1 エントリを PasswordStore に適用する"""
+    op = payload[:1]
+    (index,) = struct.unpack(">I", payload[1:5])
+    record = None
+    if len(payload) > 5:
+        records = parse_passwords(payload[5:], key)
+        record = records[0] if records else None
+
+    if op == JOURNAL_OP_ADD and record is not None:
+        passwords.add(record)
+    elif op == JOURNAL_OP_UPDATE and record is not None and index < len(passwords):
+        passwords.update(index, record)
+    elif op == JOURNAL_OP_DELETE and index < len(passwords):
+        passwords.delete(index)
+    else:
+        raise ValueError("ジャーナルのエントリが不正な形式です。")
+
+
+def replay_journal(passwords, key, filepath=None):
+    """スナップショットから読み込んだ PasswordStore に、ジャーナルの変更を順に再適用する"""
+    if filepath is None:
+        filepath = get_password_file_path()
+    for _, payload in _read_journal_entries(key, filepath):
+        _apply_journal_payload(passwords, payload, key)
+    return passwords
+
+
+class VaultJournal:
+    """
+    追記型ストレージ。1 件の変更をジャーナルへの小さな追記（+ fsync）だけで保存する。
+    ジャーナルが閾値を超えたら compact_in_background() でスナップショットへ畳み込む。
+    追記・畳み込みは vault_lock() を保持して行い、そのたびにヘッダーと最後のシーケンス番号を
+    ディスクから読み直す（ほかのプロセスが追記・畳み込みしていても、続きの番号で追記する）。
+    """
+
+    def __init__(self, session, filepath=None):
+        if filepath is None:
+            filepath = get_password_file_path()
+        self.session = session
+        self.filepath = filepath
+        self.path = journal_path_for(filepath)
+        self._lock = vault_lock(filepath)
+        self._state_lock = threading.Lock()
+        self._compacting = False
+        self._compaction_thread = None
+        # 直前に確認したジャーナルの状態（ヘッダー、エントリ数、有効な末尾の位置）
+        self._header = None
+        self._seq = 0
+        self._end = 0
+        with self._lock:
+            self._sync_locked()
+
+    def _sync_locked(self):
+        """
+        ジャーナルのヘッダーと有効なエントリ数をディスクから読み直し、書きかけの末尾を切り詰める
+        （vault_lock を保持した状態で呼ぶ）。前回から変わっていなければエントリは数え直さない。
+        """
+        expected_header = JOURNAL_MAGIC + _snapshot_id(self.filepath)
+        known = (self._header, self._seq, self._end)
+        self._header, self._seq, self._end = None, 0, 0
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as f:
+            if f.read(JOURNAL_HEADER_BYTES) != expected_header:
+                return  # 古いジャーナル（次の追記時に作り直す）
+            size = os.fstat(f.fileno()).st_size
+            if known[0] == expected_header and known[2] == size:
+                seq, valid_end = known[1], size
+            else:
+                # 初回、またはほかのプロセスが追記・畳み込みした
+                valid_end = JOURNAL_HEADER_BYTES
+                seq = 0
+                while True:
+                    length_bytes = f.read(4)
+                    if len(length_bytes) < 4:
+                        break
+                    (length,) = struct.unpack(">I", length_bytes)
+                    if valid_end + 4 + length > size:
+                        break
+                    f.seek(length, os.SEEK_CUR)
+                    valid_end = f.tell()
+                    seq += 1
+        if size != valid_end:
+            with open(self.path, "r+b") as f:
+                f.truncate(valid_end)
+        self._header, self._seq, self._end = expected_header, seq, valid_end
+
+    def _reset_locked(self, key, carried_payloads=()):
+        """現在のスナップショットに対応する空のジャーナルを作り、必要なら引き継ぎエントリを書く"""
+        header = JOURNAL_MAGIC + _snapshot_id(self.filepath)
+        blocks = [header] + [
+            self._seal(key, header, seq, payload)
+            for seq, payload in enumerate(carried_payloads)
+        ]
+        atomic_write(self.path, blocks)
+        self._header = header
+        self._seq = len(carried_payloads)
+        self._end = sum(len(block) for block in blocks)
+
+    @staticmethod
+    def _seal(key, header, seq, payload):
+        nonce = get_random_bytes(24)
+        cipher = _new_cipher(key, nonce)
+        cipher.update(_journal_aad(header, seq))
+        ciphertext, tag = cipher.encrypt_and_digest(payload)
+        blob = nonce + ciphertext + tag
+        return struct.pack(">I", len(blob)) + blob
+
+    def append(self, op, index=0, record=None):
+        """変更を 1 エントリとしてジャーナルに追記し、fsync してから戻る"""
+        key = self.session.key
+        payload = _encode_journal_payload(op, index, record)
+        with self._lock:
+            self._sync_locked()
+            if self._header is None:
+                self._reset_locked(key)
+            entry = self._seal(key, self._header, self._seq, payload)
+            with open(self.path, "ab") as f:
+                f.write(entry)
+                f.flush()
+                os.fsync(f.fileno())
+            self._seq += 1
+            self._end += len(entry)
+
+    def append_add(self, record):
+        self.append(JOURNAL_OP_ADD, 0, record)
+
+    def append_update(self, index, record):
+        self.append(JOURNAL_OP_UPDATE, index, record)
+
+    def append_delete(self, index):
+        self.append(JOURNAL_OP_DELETE, index)
+
+    def size(self):
+        return os.path.getsize(self.path) if os.path.exists(self.path) else 0
+
+    def needs_compaction(self):
+        """ジャーナルがサイズまたは比率の閾値を超えているか"""
+        journal_size = self.size()
+        if journal_size >= JOURNAL_COMPACT_MAX_BYTES:
+            return True
+        if journal_size < JOURNAL_COMPACT_MIN_BYTES:
+            return False
+        snapshot_size = (
+            os.path.getsize(self.filepath) if os.path.exists(self.filepath) else 0
+        )
+        return journal_size >= snapshot_size * JOURNAL_COMPACT_RATIO
+
+    def transaction(self):
+        """
+        メモリ上の変更と append() をまとめて行う範囲（with journal.transaction(): として使う）。
+        その間は snapshot() が割り込まないため、変更済みで未追記のデータを直列化することがない。
+        """
+        return self._lock
+
+    def snapshot(self, passwords):
+        """
+        passwords を直列化し、その内容に反映済みの追記の数と組にして返す（compact() に渡す）。
+        直列化とシーケンス番号の取得は、追記と同じロックの中でまとめて行う。
+        """
+        with self._lock:
+            self._sync_locked()
+            return serialize_passwords(passwords), self._seq
+
+    def compact(self, snapshot_bytes, upto_seq):
+        """
+        snapshot_bytes（シーケンス番号 upto_seq 未満の追記を反映した全データ。snapshot() の戻り値）を
+        スナップショットとして書き出し、ジャーナルを空にする。upto_seq 以降のエントリは新しいジャーナルへ引き継ぐ。
+        """
+        key = self.session.key
+        with self._lock:
+            self._sync_locked()
+            if upto_seq > self._seq:
+                raise ValueError(
+                    "スナップショットがジャーナルより新しいため、畳み込めません。"
+                )
+            carried = []
+            if self._header is not None and self._seq > upto_seq:
+                carried = [
+                    payload
+                    for entry_seq, payload in _read_journal_entries(key, self.filepath)
+                    if entry_seq >= upto_seq
+                ]
+
+            # スナップショットはアトミックに置き換わる
+            encrypt_password_file(snapshot_bytes, filepath=self.filepath, key=key)
+
+            # スナップショット ID が変わったので、旧ジャーナルはこの時点で無効になる
+            # （ここでクラッシュしても、新しいスナップショットだけで正しい状態になる）
+            self._reset_locked(key, carried)
+
+    def compact_in_background(self, snapshot_bytes, upto_seq):
+        """snapshot() で取得したスナップショットを、別スレッドで畳み込む"""
+        with self._state_lock:
+            if self._compacting:
+                return None
+            self._compacting = True
+
+        def _run():
+            try:
+                self.compact(snapshot_bytes, upto_seq)
+            except Exception as ex:
+                print(f"警告: ジャーナルのコンパクションに失敗しました: {ex}")
+            finally:
+                with self._state_lock:
+                    self._compacting = False
+
+        thread = threading.Thread(target=_run, daemon=True)
+        with self._state_lock:
+            self._compaction_thread = thread
+        thread.start()
+        return thread
+
+    def wait_for_compaction(self, timeout=None):
+        """実行中のバックグラウンドのコンパクションが終わるまで待つ"""
+        with self._state_lock:
+            thread = self._compaction_thread
+        if thread is not None:
+            thread.join(timeout)
+
+
+# ========== 検索インデックス ==========
+def _search_keys(record):
+    """検索対象の文字列（サービス名・ユーザー名、大文字小文字を区別しない）"""
+    return (
+        record.service_name.casefold(),
+        record.username.casefold(),
+    )
+
+
+def _trigrams(text):
+    return {text[i : i + 3] for i in range(len(text) - 2)}
+
+
+class PasswordSearchIndex:
+    """
+    サービス名・ユーザー名に対するメモリ上の検索インデックス。
+    - 前方一致: (キー, 文書ID) のソート済みリストを二分探索する
+    - 部分一致: 3 文字以上はトライグラムの転置インデックスで候補を絞り込んでから確認し、
+      2 文字以下は全キーを連結した文字列を検索する（連結文字列は変更後の初回検索時に作り直す）
+    文書IDは登録順の連番で、結果は前方一致を先に、それぞれ登録順（all_passwords の並び）で返す。
+    レコードの追加・編集・削除に合わせて add / update / remove で差分更新する。
+    """
+
+    def __init__(self, records=()):
+        self._doc_ids = {}  # id(レコード) -> 文書ID
+        self._docs = {}  # 文書ID -> (レコード, 検索キー)
+        self._trigram_postings = {}  # トライグラム -> 文書IDの集合
+        self._sorted_keys = []  # (検索キー, 文書ID) のソート済みリスト
+        self._next_doc_id = 0
+        self._joined = None  # 短いクエリ用の連結文字列（None なら再構築が必要）
+        self._joined_offsets = []
+        self._joined_doc_ids = []
+
+        # 初期構築はまとめて行い、ソートも最後に 1 回だけにする
+        for record in records:
+            self._index(record, self._new_doc_id())
+        self._sorted_keys.sort()
+
+    def __len__(self):
+        return len(self._docs)
+
+    def _new_doc_id(self):
+        doc_id = self._next_doc_id
+        self._next_doc_id += 1
+        return doc_id
+
+    def _index(self, record, doc_id, sorted_insert=False):
+        keys = _search_keys(record)
+        self._doc_ids[id(record)] = doc_id
+        self._docs[doc_id] = (record, keys)
+        postings = self._trigram_postings
+        for key in keys:
+            if sorted_insert:
+                bisect.insort(self._sorted_keys, (key, doc_id))
+            else:
+                self._sorted_keys.append((key, doc_id))
+            for gram in _trigrams(key):
+                if gram in postings:
+                    postings[gram].add(doc_id)
+                else:
+                    postings[gram] = {doc_id}
+        self._joined = None
+
+    def add(self, record):
+        if id(record) not in self._doc_ids:
+            self._index(record, self._new_doc_id(), sorted_insert=True)
+
+    def add_many(self, records):
+        """まとめて追加する（インポート用。1 件ずつ挿入せず、最後に 1 回だけソートする）"""
+        for record in records:
+            if id(record) not in self._doc_ids:
+                self._index(record, self._new_doc_id())
+        self._sorted_keys.sort()
+
+    def remove(self, record):
+        doc_id = self._doc_ids.pop(id(record), None)
+        if doc_id is None:
+            return None
+        _, keys = self._docs.pop(doc_id)
+        for key in keys:
+            pos = bisect.bisect_left(self._sorted_keys, (key, doc_id))
+            if pos < len(self._sorted_keys) and self._sorted_keys[pos] == (key, doc_id):
+                del self._sorted_keys[pos]
+            for gram in _trigrams(key):
+                postings = self._trigram_postings.get(gram)
+                if postings is not None:
+                    postings.discard(doc_id)
+                    if not postings:
+                        del self._trigram_postings[gram]
+        self._joined = None
+        return doc_id
+
+    def update(self, old_record, new_record):
+        """レコードを差し替える（文書ID＝一覧での並び順は維持する）"""
+        doc_id = self.remove(old_record)
+        if doc_id is None:
+            doc_id = self._new_doc_id()
+        self._index(new_record, doc_id, sorted_insert=True)
+
+    def _prefix_matches(self, query):
+        matched = set()
+        pos = bisect.bisect_left(self._sorted_keys, (query,))
+        while pos < len(self._sorted_keys):
+            key, doc_id = self._sorted_keys[pos]
+            if not key.startswith(query):
+                break
+            matched.add(doc_id)
+            pos += 1
+        return matched
+
+    def _substring_matches(self, query):
+        if len(query) >= 3:
+            postings = [
+                self._trigram_postings.get(gram, set()) for gram in _trigrams(query)
+            ]
+            postings.sort(key=len)
+            candidates = postings[0].intersection(*postings[1:])
+            if len(query) == 3:
+                return candidates
+            return {
+                doc_id
+                for doc_id in candidates
+                if any(query in key for key in self._docs[doc_id][1])
+            }
+
+        if self._joined is None:
+            self._rebuild_joined()
+        matched = set()
+        for m in re.finditer(re.escape(query), self._joined):
+            i = bisect.bisect_right(self._joined_offsets, m.start()) - 1
+            matched.add(self._joined_doc_ids[i])
+        return matched
+
+    def _rebuild_joined(self):
+        # 区切り文字 "\x00" をまたいで一致しないように各キーを連結する
+        parts = []
+        offsets = []
+        doc_ids = []
+        pos = 0
+        for doc_id, (_, keys) in self._docs.items():
+            for key in keys:
+                offsets.append(pos)
+                doc_ids.append(doc_id)
+                parts.append(key)
+                pos += len(key) + 1
+        self._joined = "\x00".join(parts)
+        self._joined_offsets = offsets
+        self._joined_doc_ids = doc_ids
+
+    def search(self, query):
+        """クエリに前方一致・部分一致するレコードのリストを返す（空クエリは全件）"""
+        query = query.strip().casefold()
+        if not query:
+            return [self._docs[doc_id][0] for doc_id in sorted(self._docs)]
+        prefix = self._prefix_matches(query)
+        substring = self._substring_matches(query) - prefix
+        docs = self._docs
+        return [docs[doc_id][0] for doc_id in sorted(prefix)] + [
+            docs[doc_id][0] for doc_id in sorted(substring)
+        ]
+
+
+# マスターパスワードが存在するかチェックする関数
+def master_password_exists():
+    return os.path.exists(MASTER_PASSWORD_FILEPATH) or os.path.exists(key_path_for())
+
+
+# マスターパスワードのハッシュ化関数（旧形式。v2 の鍵ファイルが無い環境との互換用）
+def hash_master_password(master_password, m=102400, t=2, p=8):
+    # Argon2でハッシュ化
+    from passlib.hash import argon2
+
+    hashed_password = argon2.using(
+        type="id", memory_cost=m, time_cost=t, parallelism=p
+    ).hash(master_password)
+    # ファイルに保存
+    with open(MASTER_PASSWORD_FILEPATH, "w") as f:
+        f.write(hashed_password)
+
+
+def _verify_master_password_hash(input_password):
+    # 保存されたハッシュを読み込み
+    if not os.path.exists(MASTER_PASSWORD_FILEPATH):
+        raise FileNotFoundError("マスターパスワードファイルが存在しません。")
+    with open(MASTER_PASSWORD_FILEPATH, "r") as f:
+        stored_hash = f.read()
+    from passlib.hash import argon2
+
+    # 入力されたパスワードを検証
+    return argon2.verify(input_password, stored_hash)
+
+
+# マスターパスワードの検証関数
+def verify_master_password(input_password):
+    """
+    鍵ファイルがあれば DEK のアンラップで検証する（v2 なら Argon2id 1 回）。
+    無ければ旧来の master_password.txt のハッシュで検証する。
+    """
+    if os.path.exists(key_path_for()):
+        try:
+            unwrap_vault_key(_read_key_file(None), input_password)
+        except ValueError:
+            return False
+        return True
+    return _verify_master_password_hash(input_password)
+
+
+def _requested_argon2_params(m, t, p):
+    """
+    m / t / p のどれかが指定されていれば Argon2id のパラメータ（省略した値は settings.ini）を返す。
+    どれも指定されていなければ None（settings.ini の [kdf] algorithm に従う）。
+    """
+    if m is None and t is None and p is None:
+        return None
+    return tuple(
+        value if value is not None else configured
+        for value, configured in zip((m, t, p), load_argon2_params_from_config())
+    )
+
+
+# マスターパスワードを再ハッシュする関数（パスワード自体は変わらない、Argon2設定のみ変更）
+def rehash_master_password(current_password, m=None, t=None, p=None, filepath=None):
+    """
+    現在のマスターパスワードで DEK を取り出し、settings.ini の鍵導出方式（[kdf] algorithm）で
+    ラップし直す。m / t / p を指定した場合は、そのパラメータの Argon2id でラップする。
+    パスワードの値自体は変わらない。
+    """
+    try:
+        rewrap_vault_key(
+            current_password,
+            current_password,
+            filepath,
+            _requested_argon2_params(m, t, p),
+        )
+    except WrongMasterPasswordError:
+        raise ValueError("現在のマスターパスワードが正しくありません。")
+
+
+# マスターパスワードを変更する関数
+def change_master_password(
+    current_password, new_password, m=None, t=None, p=None, filepath=None
+):
+    """
+    マスターパスワードを変更する。
+    DEK を新しいパスワードでラップし直す（鍵導出方式は rehash_master_password と同じ）。
+    パスワードファイルは書き換えないため、変更後もそのまま読み込める。
+    """
+    try:
+        rewrap_vault_key(
+            current_password, new_password, filepath, _requested_argon2_params(m, t, p)
+        )
+    except WrongMasterPasswordError:
+        raise ValueError("現在のマスターパスワードが正しくありません。")
+
+
+# Argon2 パラメータでハッシュ化テストを行う関数
+def test_argon2_hash(test_password, m=102400, t=2, p=8):
+    """
+    与えられたパラメータでハッシュ化テストを実行し、
+    実行時間とハッシュ結果を返す。
+    実際のマスターパスワードファイルは変更しない。
+
+    戻り値: {
+        "success": bool,
+        "hash": str（ハッシュ値、成功時のみ）,
+        "execution_time": float（秒）,
+        "error": str（エラー時のみ）,
+    }
+    """
+    from passlib.hash import argon2
+
+    try:
+        start_time = time_module.perf_counter()
+        hashed_password = argon2.using(
+            type="id", memory_cost=m, time_cost=t, parallelism=p
+        ).hash(test_password)
+        end_time = time_module.perf_counter()
+
+        execution_time = end_time - start_time
+        return {
+            "success": True,
+            "hash": hashed_password,
+            "execution_time": execution_time,
+        }
+    except Exception as ex:
+        end_time = time_module.perf_counter()
+        execution_time = end_time - start_time
+        return {
+            "success": False,
+            "execution_time": execution_time,
+            "error": str(ex),
+        }
+
+
+# ========== Argon2 パラメータの自動調整 ==========
+ARGON2_CALIBRATION_SAMPLES = 5
+ARGON2_MAX_TIME_COST = 10
+ARGON2_MAX_PARALLELISM = 16
+ARGON2_MEMORY_STEP_KIB = 1024  # memory_cost は 1 MiB 単位で調整する
+
+
+def argon2_default_parallelism():
+    """CPU のコア数（論理コア）に合わせた parallelism"""
+    return max(1, min(os.cpu_count() or 1, ARGON2_MAX_PARALLELISM))
+
+
+def measure_argon2_verify(m, t, p, samples=ARGON2_CALIBRATION_SAMPLES):
+    """
+    指定したパラメータで作ったハッシュの検証時間を samples 回計測する。
+    戻り値: {"median": 秒, "p95": 秒, "samples": [秒, ...]}
+    """
+    import statistics
+    from passlib.hash import argon2
+
+    password = generate_secure_password(24)
+    hasher = argon2.using(type="id", memory_cost=m, time_cost=t, parallelism=p)
+    hashed = hasher.hash(password)
+    argon2.verify(password, hashed)  # ウォームアップ（メモリの確保など）
+    timings = []
+    for _ in range(samples):
+        start = time_module.perf_counter()
+        argon2.verify(password, hashed)
+        timings.append(time_module.perf_counter() - start)
+    timings.sort()
+    p95_index = min(int(round(0.95 * (len(timings) - 1))), len(timings) - 1)
+    return {
+        "median": statistics.median(timings),
+        "p95": timings[p95_index],
+        "samples": timings,
+    }
+
+
+def calibrate_argon2(
+    target_seconds=0.5,
+    memory_budget_kib=262144,
+    parallelism=None,
+    samples=ARGON2_CALIBRATION_SAMPLES,
+    cancel_event=None,
+    progress=None,
+):
+    """
+    検証時間の p95 が target_seconds 以下に収まる中で、最も強い Argon2 パラメータを探す。
+    強さは memory_cost を優先し（上限は memory_budget_kib）、余った時間で time_cost を増やす。
+    parallelism を省略した場合は CPU のコア数を使う。
+    各候補は samples 回計測し、中央値と p95 を記録する。
+
+    戻り値: {
+        "memory_cost", "time_cost", "parallelism": 見つかったパラメータ,
+        "median", "p95": そのパラメータの検証時間（秒）,
+        "meets_target": bool（最小のパラメータでも目標を超える場合は False）,
+        "measurements": [{"memory_cost", "time_cost", "parallelism", "median", "p95"}, ...],
+    }
+    cancel_event がセットされた場合は計測を打ち切って None を返す。
+    """
+    if target_seconds <= 0:
+        raise ValueError("目標時間は正の値である必要があります。")
+    if parallelism is None:
+        parallelism = argon2_default_parallelism()
+    if parallelism <= 0:
+        raise ValueError("parallelism は正の整数である必要があります。")
+    # Argon2 は 1 レーンあたり 8 KiB 以上のメモリが必要
+    min_memory = max(8 * parallelism, ARGON2_MEMORY_STEP_KIB)
+    if memory_budget_kib < min_memory:
+        raise ValueError(f"メモリ上限は {min_memory} KiB 以上である必要があります。")
+
+    measurements = []
+
+    def measure(m, t):
+        if cancel_event is not None and cancel_event.is_set():
+            return None
+        if progress is not None:
+            progress(m, t)
+        result = measure_argon2_verify(m, t, parallelism, samples=samples)
+        entry = {
+            "memory_cost": m,
+            "time_cost": t,
+            "parallelism": parallelism,
+            "median": result["median"],
+            "p95": result["p95"],
+        }
+        measurements.append(entry)
+        return entry
+
+    def round_memory(m):
+        m = int(m) // ARGON2_MEMORY_STEP_KIB * ARGON2_MEMORY_STEP_KIB
+        return max(min(m, memory_budget_kib), min_memory)
+
+    # 1. time_cost=1 で上限のメモリから始め、目標を超える間はメモリを減らす
+    #    （所要時間はほぼメモリ量に比例するため、計測値から次の候補を見積もる）
+    memory = round_memory(memory_budget_kib)
+    best = measure(memory, 1)
+    if best is None:
+        return None
+    too_slow = None  # 目標を超えた最小のメモリ量
+    while best["p95"] > target_seconds and memory > min_memory:
+        too_slow = memory
+        estimate = round_memory(memory * target_seconds / best["p95"])
+        memory = estimate if estimate < memory else round_memory(memory * 0.9)
+        best = measure(memory, 1)
+        if best is None:
+            return None
+    # 見積もりで減らしすぎた分は二分探索で戻す（精度は 1/16 程度）
+    if too_slow is not None and best["p95"] <= target_seconds:
+        while too_slow - memory > max(ARGON2_MEMORY_STEP_KIB, memory // 16):
+            middle = round_memory((memory + too_slow) / 2)
+            if not memory < middle < too_slow:
+                break
+            candidate = measure(middle, 1)
+            if candidate is None:
+                return None
+            if candidate["p95"] <= target_seconds:
+                memory, best = middle, candidate
+            else:
+                too_slow = middle
+
+    if best["p95"] <= target_seconds:
+        # 2. 余裕があれば time_cost を増やす（所要時間は time_cost にほぼ比例する）
+        time_cost = min(max(int(target_seconds / best["p95"]), 1), ARGON2_MAX_TIME_COST)
+        if time_cost > 1:
+            candidate = measure(memory, time_cost)
+            if candidate is None:
+                return None
+            while candidate["p95"] > target_seconds and time_cost > 2:
+                time_cost -= 1
+                candidate = measure(memory, time_cost)
+                if candidate is None:
+                    return None
+            if candidate["p95"] <= target_seconds:
+                best = candidate
+        while best["time_cost"] < ARGON2_MAX_TIME_COST:
+            candidate = measure(memory, best["time_cost"] + 1)
+            if candidate is None:
+                return None
+            if candidate["p95"] > target_seconds:
+                break
+            best = candidate
+
+    return {
+        "memory_cost": best["memory_cost"],
+        "time_cost": best["time_cost"],
+        "parallelism": parallelism,
+        "median": best["median"],
+        "p95": best["p95"],
+        "meets_target": best["p95"] <= target_seconds,
+        "measurements": measurements,
+    }
+
+
+# ========== 非同期版（UI のイベントループを止めないための関数） ==========
+# Argon2 / PBKDF2 / 復号はスレッドで実行する。argon2-cffi と pycryptodome は
+# C 側の計算中に GIL を解放するため、その間もイベントループは応答し続ける。
+
+_blocking_executor = None
+
+
+def _get_blocking_executor():
+    global _blocking_executor
+    if _blocking_executor is None:
+        from concurrent.futures import ThreadPoolExecutor
+
+        _blocking_executor = ThreadPoolExecutor(
+            max_workers=2, thread_name_prefix="password-manager-kdf"
+        )
+    return _blocking_executor
+
+
+async def _run_blocking(func, *args, **kwargs):
+    """
+    重い処理をスレッドで実行して結果を待つ。
+    待っているタスクがキャンセルされると結果は捨てられる（実行中の KDF 自体は途中で止められない）。
+    """
+    import asyncio
+
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _get_blocking_executor(), functools.partial(func, *args, **kwargs)
+    )
+
+
+async def derive_key_async(master_password, salt):
+    return await _run_blocking(derive_key, master_password, salt)
+
+
+async def hash_master_password_async(master_password, m=102400, t=2, p=8):
+    await _run_blocking(hash_master_password, master_password, m=m, t=t, p=p)
+
+
+async def verify_master_password_async(input_password):
+    return await _run_blocking(verify_master_password, input_password)
+
+
+async def rehash_master_password_async(current_password, m=None, t=None, p=None):
+    await _run_blocking(rehash_master_password, current_password, m=m, t=t, p=p)
+
+
+async def change_master_password_async(
+    current_password, new_password, m=None, t=None, p=None
+):
+    await _run_blocking(
+        change_master_password, current_password, new_password, m=m, t=t, p=p
+    )
+
+
+async def decrypt_password_file_async(master_password=None, filepath=None, key=None):
+    return await _run_blocking(
+        decrypt_password_file, master_password, filepath, key=key
+    )
+
+
+async def get_decrypted_passwords_async(master_password=None, filepath=None, key=None):
+    return await _run_blocking(
+        get_decrypted_passwords, master_password, filepath, key=key
+    )
+
+
+async def build_search_index_async(records):
+    return await _run_blocking(PasswordSearchIndex, records)
+
+
+async def calibrate_argon2_async(
+    target_seconds=0.5, memory_budget_kib=262144, parallelism=None, progress=None
+):
+    """calibrate_argon2 をスレッドで実行する。キャンセルされた場合は次の計測の前に打ち切る"""
+    import asyncio
+
+    cancel_event = threading.Event()
+    try:
+        return await _run_blocking(
+            calibrate_argon2,
+            target_seconds,
+            memory_budget_kib,
+            parallelism,
+            cancel_event=cancel_event,
+            progress=progress,
+        )
+    except asyncio.CancelledError:
+        cancel_event.set()
+        raise
+
+
+async def unlock_session_async(session, master_password, filepath=None, create=False):
+    """
+    VaultSession.unlock をスレッドで実行する。
+    キャンセルされた場合は、導出が終わった時点で鍵を保持せずに破棄する。
+    """
+    import asyncio
+
+    cancel_event = threading.Event()
+    try:
+        await _run_blocking(
+            session.unlock,
+            master_password,
+            filepath,
+            cancel_event=cancel_event,
+            create=create,
+        )
+    except asyncio.CancelledError:
+        cancel_event.set()
+        session.lock()
+        raise
+
+
+# ========== TOTP ==========
+TOTP_INTERVAL = 30  # 秒
+TOTP_DIGITS = 6
+
+
+def decode_totp_secret(secret_key):
+    """
+    Base32 の TOTP シークレットをデコードして HMAC 鍵を返す（pyotp と同じ解釈）。
+    不正なシークレットの場合は ValueError を送出する。
+    """
+    secret = secret_key
+    missing_padding = len(secret) % 8
+    if missing_padding:
+        secret += "=" * (8 - missing_padding)
+    try:
+        key = base64.b32decode(secret, casefold=True)
+    except (binascii.Error, ValueError):
+        raise ValueError("TOTP シークレットキーが不正です（Base32 ではありません）。")
+    if not key:
+        raise ValueError("TOTP シークレットキーが空です。")
+    return key
+
+
+def totp_secret_is_valid(secret_key):
+    try:
+        decode_totp_secret(secret_key)
+        return True
+    except ValueError:
+        return False
+
+
+def _totp_counter(for_time, interval):
+    return int(for_time // interval)
+
+
+def _hotp(hmac_key, counter_bytes, digits):
+    """RFC 4226 の HOTP（動的切り詰め）"""
+    digest = hmac.new(hmac_key, counter_bytes, hashlib.sha1).digest()
+    offset = digest[-1] & 0x0F
+    code = int.from_bytes(digest[offset : offset + 4], "big") & 0x7FFFFFFF
+    return str(code % 10**digits).zfill(digits)
+
+
+@dataclass(slots=True)
+class TotpWindow:
+    """1 つの時間枠（30 秒）で計算したコードと、その枠の残り時間"""
+
+    counter: int
+    remaining: float
+    codes: dict
+
+
+class TotpEngine:
+    """
+    TOTP コードの計算をまとめて行うエンジン。
+    - シークレットは prepare() で一度だけ検証・デコードし、HMAC 鍵をキャッシュする
+    - window() は表示中のエントリのコードを時間枠ごとに 1 回だけまとめて計算する
+    キャッシュのキーには SealedSecret（同一性で比較される）やシークレット文字列を使う。
+    """
+
+    def __init__(self, interval=TOTP_INTERVAL, digits=TOTP_DIGITS):
+        self.interval = interval
+        self.digits = digits
+        self._hmac_keys = {}  # キャッシュキー -> HMAC 鍵（不正なシークレットは None）
+        self._window_counter = None
+        self._window_codes = {}
+        self._lock = threading.Lock()
+
+    def prepare(self, cache_key, secret_key):
+        """シークレットを検証してデコードし、結果をキャッシュする。妥当かどうかを返す"""
+        try:
+            hmac_key = decode_totp_secret(secret_key)
+        except ValueError:
+            hmac_key = None
+        with self._lock:
+            self._hmac_keys[cache_key] = hmac_key
+            self._window_codes.pop(cache_key, None)
+        return hmac_key is not None
+
+    def is_prepared(self, cache_key):
+        with self._lock:
+            return cache_key in self._hmac_keys
+
+    def is_valid(self, cache_key):
+        """妥当なら True、不正なら False、未検証なら None"""
+        with self._lock:
+            if cache_key not in self._hmac_keys:
+                return None
+            return self._hmac_keys[cache_key] is not None
+
+    def window(self, cache_keys, for_time=None):
+        """
+        指定したエントリのコードを現在の時間枠でまとめて計算して返す。
+        同じ時間枠で計算済みのコードは再計算しない。未検証・不正なエントリは結果に含まれない。
+        """
+        if for_time is None:
+            for_time = time_module.time()
+        counter = _totp_counter(for_time, self.interval)
+        remaining = self.interval - (for_time % self.interval)
+        counter_bytes = struct.pack(">Q", counter)
+        with self._lock:
+            if counter != self._window_counter:
+                self._window_counter = counter
+                self._window_codes = {}
+            codes = {}
+            for cache_key in cache_keys:
+                code = self._window_codes.get(cache_key)
+                if code is None:
+                    hmac_key = self._hmac_keys.get(cache_key)
+                    if hmac_key is None:
+                        continue
+                    code = _hotp(hmac_key, counter_bytes, self.digits)
+                    self._window_codes[cache_key] = code
+                codes[cache_key] = code
+        return TotpWindow(counter, remaining, codes)
+
+    def forget(self, cache_key):
+        with self._lock:
+            self._hmac_keys.pop(cache_key, None)
+            self._window_codes.pop(cache_key, None)
+
+    def clear(self):
+        """キャッシュした鍵とコードをすべて破棄する（ロック時に呼ぶ）"""
+        with self._lock:
+            self._hmac_keys.clear()
+            self._window_codes = {}
+            self._window_counter = None
 
 
 # TOTP シークレットキーに基づいてワンタイムパスワードを生成する関数
-def generate_totp_code(secret_key):
+def generate_totp_code(secret_key, for_time=None):
     """
     与えられたシークレットキーから TOTP ワンタイムパスワードを生成する。
     デフォルトでは30秒ごとにコードが変わる。
     """
-    totp = pyotp.TOTP(secret_key)
-    return totp.now()
+    if for_time is None:
+        for_time = time_module.time()
+    counter = _totp_counter(for_time, TOTP_INTERVAL)
+    return _hotp(
+        decode_totp_secret(secret_key), struct.pack(">Q", counter), TOTP_DIGITS
+    )
@@ -0,0 +1,135 @@
+"""
+保管庫のエクスポート（バックアップ）
+
+形式:
+- csv: service_name / username / password / totp_secret の 4 列（1 行目はヘッダー）
+- jsonl: 1 行に 1 件の JSON オブジェクト（キーは csv の列名と同じ）
+- bundle: jsonl をパスフレーズで暗号化した自己完結型のファイル（ソルトと KDF の設定を含む。
+  形式は password_manager_core の「バックアップバンドル」を参照）
+
+レコードはジェネレーターで 1 件ずつ復号し、EXPORT_CHUNK_BYTES ごとにファイルへ書き出すため、
+保管庫の件数が増えても、書き出し中に増えるメモリはチャンク 1 つ分程度に収まる。
+csv / jsonl はパスワードが平文で保存されるため、扱いに注意すること（bundle を推奨）。
+どの形式も password_manager_import でインポートし直せる。
+"""
+
+import csv
+import io
+import itertools
+import json
+import os
+
+import password_manager_core
+
+EXPORT_FORMATS = ("csv", "jsonl", "bundle")
+EXPORT_FIELDS = ("service_name", "username", "password", "totp_secret")
+EXPORT_CHUNK_BYTES = 64 * 1024
+EXPORT_PROGRESS_INTERVAL = 1000  # 件（この件数ごとに progress を呼ぶ）
+# 拡張子から形式を判定する（それ以外は bundle）
+EXPORT_EXTENSIONS = {".csv": "csv", ".jsonl": "jsonl", ".json": "jsonl"}
+
+
+def export_format_for(path):
+    """ファイル名の拡張子から形式を決める"""
+    return EXPORT_EXTENSIONS.get(os.path.splitext(path)[1].lower(), "bundle")
+
+
+def iter_export_entries(session, store, progress=None):
+    """
+    store のレコードを (サービス名, ユーザー名, パスワード, TOTP シークレット) の平文で 1 件ずつ返す。
+    progress(件数) は EXPORT_PROGRESS_INTERVAL 件ごとと最後に呼ばれる。
+    """
+    batch = password_manager_core.SecretBatch(session.key)
+    count = 0
+    for record in store:
+        yield (
+            record.service_name,
+            record.username,
+            batch.reveal(record.password),
+            batch.reveal(record.totp_secret),
+        )
+        count += 1
+        if progress is not None and count % EXPORT_PROGRESS_INTERVAL == 0:
+            progress(count)
+    if progress is not None:
+        progress(count)
+
+
+def _chunked(lines):
+    """文字列の行を UTF-8 にして、EXPORT_CHUNK_BYTES 程度のバイト列にまとめて返す"""
+    buf = []
+    size = 0
+    for line in lines:
+        data = line.encode("utf-8")
+        buf.append(data)
+        size += len(data)
+        if size >= EXPORT_CHUNK_BYTES:
+            yield b"".join(buf)
+            buf.clear()
+            size = 0
+    if buf:
+        yield b"".join(buf)
+
+
+def iter_csv(entries):
+    """エントリを CSV のバイト列（チャンク）として順に返す"""
+    out = io.StringIO()
+    writer = csv.writer(out, lineterminator="\n")
+
+    def lines():
+        for row in itertools.chain([EXPORT_FIELDS], entries):
+            writer.writerow(row)
+            # 1 行ずつ取り出してバッファを空にする（全体を 1 つの文字列にしない）
+            yield out.getvalue()
+            out.seek(0)
+            out.truncate()
+
+    return _chunked(lines())
+
+
+def iter_jsonl(entries):
+    """エントリを JSON Lines のバイト列（チャンク）として順に返す"""
+    return _chunked(
+        json.dumps(dict(zip(EXPORT_FIELDS, entry)), ensure_ascii=False) + "\n"
+        for entry in entries
+    )
+
+
+def iter_bundle(entries, passphrase, kdf=None):
+    """エントリを JSON Lines にしてパスフレーズで暗号化したバンドルを順に返す"""
+    return password_manager_core.encrypt_bundle_stream(
+        iter_jsonl(entries),
+        passphrase,
+        kdf=kdf,
+        compression=password_manager_core.load_compression_from_config(),
+    )
+
+
+def export_file(session, store, path, fmt=None, passphrase=None, progress=None):
+    """
+    store を path にエクスポートして件数を返す。fmt を省略した場合は拡張子から決める。
+    書き込みは一時ファイルに行ってから置き換えるため、途中で失敗しても中途半端なファイルは残らない。
+    """
+    if fmt is None:
+        fmt = export_format_for(path)
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"未対応のエクスポート形式です: {fmt}")
+    count = 0
+
+    def on_progress(n):
+        nonlocal count
+        count = n
+        if progress is not None:
+            progress(n)
+
+    entries = iter_export_entries(session, store, on_progress)
+    if fmt == "csv":
+        chunks = iter_csv(entries)
+    elif fmt == "jsonl":
+        chunks = iter_jsonl(entries)
+    else:
+        if not passphrase:
+            raise ValueError("バンドルのパスフレーズを指定してください。")
+        chunks = iter_bundle(entries, passphrase)
+    password_manager_core.atomic_write(path, chunks)
+    return count
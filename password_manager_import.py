@@ -0,0 +1,333 @@
+"""
+他のパスワードマネージャーのエクスポートファイルからの一括インポート
+
+対応形式:
+- bitwarden: Bitwarden の CSV エクスポート（login_uri / login_username / login_password / login_totp）
+- chrome: Chrome（Edge などの Chromium 系）の CSV エクスポート（name / url / username / password）
+- firefox: Firefox の CSV エクスポート（url / username / password / httpRealm ...）
+- keepass: KeePass 2 / KeePassXC の XML エクスポート
+- csv / jsonl / bundle: このアプリのエクスポート（password_manager_export）。bundle はパスフレーズが必要
+
+ファイルは 1 行（1 エントリ）ずつ読み込み、XML も iterparse で処理済みの要素を捨てながら読むため、
+10 万件のファイルでもファイル全体をメモリに読み込まない。パスワードは読み込んだ時点で暗号化し、
+重複の判定には平文ではなく鍵付きハッシュを使う。保存は最後に 1 回だけ行う（write_imported_store）。
+"""
+
+import csv
+import hashlib
+import json
+import os
+import secrets
+import urllib.parse
+from dataclasses import dataclass
+
+import password_manager_core
+
+IMPORT_FORMATS = (
+    "bitwarden",
+    "chrome",
+    "firefox",
+    "keepass",
+    "csv",
+    "jsonl",
+    "bundle",
+)
+IMPORT_PROGRESS_INTERVAL = 1000  # 件（この件数ごとに progress を呼ぶ）
+
+
+@dataclass(slots=True)
+class ImportResult:
+    """インポートの進捗と結果（progress にも途中経過として渡される）"""
+
+    rows: int = 0  # 読み込んだエントリ数
+    added: int = 0  # 追加したエントリ数
+    duplicates: int = (
+        0  # 既存または同じファイル内のエントリと重複していたため飛ばした数
+    )
+    skipped: int = 0  # パスワードやサービス名がないため飛ばした数
+
+
+def _host(url):
+    """URL からホスト名を取り出す（URL でなければそのまま返す）"""
+    url = (url or "").strip()
+    if "://" not in url:
+        return url
+    return urllib.parse.urlsplit(url).hostname or url
+
+
+def _totp_secret_from(value):
+    """otpauth:// URI ならシークレットだけを取り出す（それ以外はそのまま）"""
+    value = (value or "").strip()
+    if value.lower().startswith("otpauth://"):
+        query = urllib.parse.parse_qs(urllib.parse.urlsplit(value).query)
+        return (query.get("secret") or [""])[0]
+    return value
+
+
+# ---- 形式ごとの読み込み（(サービス名, ユーザー名, パスワード, TOTP シークレット) を順に返す） ----
+
+
+def _csv_rows(path):
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        yield from csv.DictReader(f)
+
+
+def _iter_bitwarden(path):
+    for row in _csv_rows(path):
+        if (row.get("type") or "login") != "login":
+            continue  # セキュアメモ・カードなどはパスワードを持たない
+        yield (
+            row.get("name") or _host(row.get("login_uri")),
+            row.get("login_username") or "",
+            row.get("login_password") or "",
+            _totp_secret_from(row.get("login_totp")),
+        )
+
+
+def _iter_chrome(path):
+    for row in _csv_rows(path):
+        yield (
+            row.get("name") or _host(row.get("url")),
+            row.get("username") or "",
+            row.get("password") or "",
+            "",
+        )
+
+
+def _iter_firefox(path):
+    for row in _csv_rows(path):
+        yield (
+            _host(row.get("url")),
+            row.get("username") or "",
+            row.get("password") or "",
+            "",
+        )
+
+
+def _iter_keepass(path):
+    import xml.etree.ElementTree as ET
+
+    # 処理した Entry は親から取り除き、読み込み済みの要素がメモリに残らないようにする
+    stack = []
+    recycle_bin_uuid = None
+    group_uuids = {}  # id(Group 要素) -> UUID（ごみ箱のグループを見分けるため）
+    for event, elem in ET.iterparse(path, events=("start", "end")):
+        if event == "start":
+            stack.append(elem)
+            continue
+        stack.pop()
+        parent = stack[-1] if stack else None
+        if elem.tag == "RecycleBinUUID":
+            recycle_bin_uuid = elem.text
+        elif elem.tag == "UUID" and parent is not None and parent.tag == "Group":
+            group_uuids[id(parent)] = elem.text
+        elif elem.tag == "Group":
+            group_uuids.pop(id(elem), None)
+        if elem.tag != "Entry":
+            continue
+        if parent is not None and parent.tag == "History":
+            continue  # 変更履歴のエントリは取り込まない（History ごと後で捨てられる）
+        in_recycle_bin = recycle_bin_uuid is not None and any(
+            group_uuids.get(id(group)) == recycle_bin_uuid for group in stack
+        )
+        fields = {
+            string.findtext("Key", ""): string.findtext("Value", "") or ""
+            for string in elem.iterfind("String")
+        }
+        if parent is not None:
+            parent.remove(elem)
+        if in_recycle_bin:
+            continue
+        yield (
+            fields.get("Title") or _host(fields.get("URL")),
+            fields.get("UserName", ""),
+            fields.get("Password", ""),
+            _totp_secret_from(
+                fields.get("otp") or fields.get("TimeOtp-Secret-Base32", "")
+            ),
+        )
+
+
+def _iter_csv(path):
+    for row in _csv_rows(path):
+        yield (
+            row.get("service_name") or "",
+            row.get("username") or "",
+            row.get("password") or "",
+            row.get("totp_secret") or "",
+        )
+
+
+def _jsonl_entries(lines):
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            item = json.loads(line)
+        except ValueError:
+            raise ValueError("JSON Lines の形式が不正です。")
+        if not isinstance(item, dict):
+            raise ValueError("JSON Lines の形式が不正です。")
+        yield (
+            str(item.get("service_name") or ""),
+            str(item.get("username") or ""),
+            str(item.get("password") or ""),
+            str(item.get("totp_secret") or ""),
+        )
+
+
+def _iter_jsonl(path):
+    with open(path, "r", encoding="utf-8-sig") as f:
+        yield from _jsonl_entries(f)
+
+
+def _split_lines(chunks):
+    """復号したチャンク（行の途中で区切られている）を 1 行ずつに分けて返す"""
+    rest = b""
+    for chunk in chunks:
+        lines = (rest + chunk).split(b"\n")
+        rest = lines.pop()
+        for line in lines:
+            yield line.decode("utf-8")
+    if rest:
+        yield rest.decode("utf-8")
+
+
+def _iter_bundle(path, passphrase):
+    if not passphrase:
+        raise ValueError("バンドルのパスフレーズを指定してください。")
+    # パスフレーズの確認はここで行い、間違っていれば最初の読み込みの前に ValueError にする
+    chunks = password_manager_core.decrypt_bundle_stream(path, passphrase)
+    return _jsonl_entries(_split_lines(chunks))
+
+
+_READERS = {
+    "bitwarden": _iter_bitwarden,
+    "chrome": _iter_chrome,
+    "firefox": _iter_firefox,
+    "keepass": _iter_keepass,
+    "csv": _iter_csv,
+    "jsonl": _iter_jsonl,
+}
+
+
+def detect_import_format(path):
+    """ファイルの先頭（バンドルのマジック、XML の宣言、JSON、CSV のヘッダー行）から形式を判定する"""
+    if password_manager_core.is_bundle_file(path):
+        return "bundle"
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        head = f.read(4096)
+    if head.lstrip().startswith("<"):
+        return "keepass"
+    if head.lstrip().startswith("{"):
+        return "jsonl"
+    columns = set(next(csv.reader([head.splitlines()[0] if head else ""]), []))
+    if "login_password" in columns:
+        return "bitwarden"
+    if {"service_name", "username", "password"} <= columns:
+        return "csv"
+    if {"url", "username", "password"} <= columns:
+        if columns & {"httpRealm", "formActionOrigin", "guid"}:
+            return "firefox"
+        return "chrome"
+    raise ValueError(
+        "インポートできない形式です（Bitwarden / Chrome / Firefox の CSV、KeePass の XML、"
+        "このアプリのエクスポートに対応しています）。"
+    )
+
+
+def iter_import_entries(path, fmt=None, passphrase=None):
+    """
+    エクスポートファイルのエントリを (サービス名, ユーザー名, パスワード, TOTP シークレット) で順に返す。
+    passphrase はバンドルの場合だけ使う。
+    """
+    if fmt is None:
+        fmt = detect_import_format(path)
+    if fmt == "bundle":
+        return _iter_bundle(path, passphrase)
+    if fmt not in _READERS:
+        raise ValueError(f"未対応のインポート形式です: {fmt}")
+    return _READERS[fmt](path)
+
+
+def import_entries(session, store, entries, progress=None):
+    """
+    entries を store に追加して ImportResult を返す（ファイルへの保存はしない）。
+    サービス名・ユーザー名・パスワードがすべて同じエントリは、既存のものも含めて 1 件にまとめる。
+    progress(result) は IMPORT_PROGRESS_INTERVAL 件ごとと最後に呼ばれる。
+    """
+    batch = password_manager_core.SecretBatch(session.key)
+    # 重複の判定には、このインポートの間だけ使う鍵付きの 16 バイトのハッシュを保持する
+    digest_key = secrets.token_bytes(32)
+
+    def digest(service_name, username, password):
+        h = hashlib.blake2b(key=digest_key, digest_size=16)
+        for value in (service_name, username, password):
+            data = value.encode("utf-8")
+            h.update(len(data).to_bytes(4, "big"))
+            h.update(data)
+        return h.digest()
+
+    seen = {digest(r.service_name, r.username, batch.reveal(r.password)) for r in store}
+    result = ImportResult()
+    for service_name, username, password, totp_secret in entries:
+        result.rows += 1
+        service_name = (service_name or "").strip()
+        if not service_name or not password:
+            result.skipped += 1
+        else:
+            key = digest(service_name, username, password)
+            if key in seen:
+                result.duplicates += 1
+            else:
+                seen.add(key)
+                totp_secret = totp_secret.strip()
+                store.add(
+                    password_manager_core.PasswordRecord(
+                        service_name,
+                        username,
+                        batch.seal(password),
+                        batch.seal(totp_secret),
+                        totp_valid=(
+                            password_manager_core.totp_secret_is_valid(totp_secret)
+                            if totp_secret
+                            else None
+                        ),
+                    )
+                )
+                result.added += 1
+        if progress is not None and result.rows % IMPORT_PROGRESS_INTERVAL == 0:
+            progress(result)
+    if progress is not None:
+        progress(result)
+    return result
+
+
+def import_file(session, store, path, fmt=None, progress=None, passphrase=None):
+    """エクスポートファイルを読み込んで store に追加する（保存は write_imported_store で行う）"""
+    if not os.path.isfile(path):
+        raise ValueError(f"ファイルが見つかりません: {path}")
+    return import_entries(
+        session, store, iter_import_entries(path, fmt, passphrase), progress
+    )
+
+
+def write_imported_store(session, store, journal=None):
+    """
+    インポート後の全データを 1 回の暗号化・書き込みで保存する。
+    ジャーナルモードでは変更を 1 件ずつ追記せず、スナップショットに畳み込んでジャーナルを空にする。
+    journal は呼び出し側が追記に使っている VaultJournal（省略時はジャーナルモードなら作る）。
+    """
+    if (
+        journal is None
+        and password_manager_core.load_storage_mode_from_config() == "journal"
+    ):
+        journal = password_manager_core.VaultJournal(session)
+    if journal is not None:
+        # シリアライズした時点の seq までを畳み込む（その後の追記はジャーナルに残る）
+        snapshot, seq = journal.snapshot(store)
+        journal.compact(snapshot, seq)
+    else:
+        password_manager_core.encrypt_password_file(
+            password_manager_core.serialize_passwords(store), key=session.key
+        )
@@ -0,0 +1,151 @@
+"""
+起動時間のプロファイラ
+
+環境変数 PASSWORD_MANAGER_PROFILE_STARTUP にレポートファイルのパスを指定して起動すると
+（値が "1" の場合は startup_profile.txt）、main.py の実行開始からの次の内容をレポートに書き出す。
+- 節目の時刻（ロック画面の最初の描画 = time-to-first-frame、メイン画面の表示など）
+- モジュールごとの import 時間（`python -X importtime` と同じ形式。self / cumulative はマイクロ秒）
+
+import 時間は builtins.__import__ をフックして計測するため、main.py より前に読み込まれた
+モジュール（site など）と、importlib.import_module で読み込まれたモジュールは親の時間に含まれる。
+"""
+
+import builtins
+import importlib.util
+import os
+import sys
+import threading
+import time
+
+PROFILE_ENV = "PASSWORD_MANAGER_PROFILE_STARTUP"
+DEFAULT_REPORT_PATH = "startup_profile.txt"
+TOP_IMPORTS = 20
+
+_profiler = None
+
+
+class StartupProfiler:
+    def __init__(self, report_path):
+        self.report_path = report_path
+        self._started_ns = time.perf_counter_ns()
+        self._thread = threading.get_ident()
+        self._stack = []  # 読み込み中のモジュールごとの、子モジュールの合計時間
+        # (深さ, モジュール名, self[us], cumulative[us])（読み込みが終わった順）
+        self.imports = []
+        self.milestones = []  # (ラベル, 経過時間[ms])
+        self._original_import = None
+        self._lock = threading.Lock()
+
+    def install(self):
+        self._original_import = builtins.__import__
+        builtins.__import__ = self._import
+
+    def uninstall(self):
+        if builtins.__import__ is self._import:
+            builtins.__import__ = self._original_import
+
+    def _resolve(self, name, globals, level):
+        if not level:
+            return name
+        package = (globals or {}).get("__package__") or (globals or {}).get(
+            "__name__", ""
+        )
+        try:
+            return importlib.util.resolve_name("." * level + name, package)
+        except (ImportError, ValueError):
+            return name
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        original = self._original_import
+        # 計測するのはメインスレッドで初めて読み込まれるモジュールだけ
+        if threading.get_ident() != self._thread:
+            return original(name, globals, locals, fromlist, level)
+        full_name = self._resolve(name, globals, level)
+        if full_name in sys.modules:
+            return original(name, globals, locals, fromlist, level)
+
+        self._stack.append(0)
+        start = time.perf_counter_ns()
+        try:
+            return original(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = time.perf_counter_ns() - start
+            children = self._stack.pop()
+            if self._stack:
+                self._stack[-1] += elapsed
+            self.imports.append(
+                (
+                    len(self._stack),
+                    full_name,
+                    (elapsed - children) // 1000,
+                    elapsed // 1000,
+                )
+            )
+
+    def elapsed_ms(self):
+        return (time.perf_counter_ns() - self._started_ns) / 1e6
+
+    def mark(self, label):
+        """節目の時刻を記録し、その時点までの内容でレポートを書き直す"""
+        with self._lock:
+            self.milestones.append((label, self.elapsed_ms()))
+        self.write_report()
+
+    def write_report(self):
+        with self._lock:
+            milestones = list(self.milestones)
+            imports = list(self.imports)
+        lines = [
+            "# 起動プロファイル",
+            "# 時刻は main.py の実行開始からの経過時間",
+            "",
+            "[節目]",
+        ]
+        lines += [f"{ms:10.1f} ms  {label}" for label, ms in milestones]
+        lines += ["", f"[import 時間（self の上位 {TOP_IMPORTS} 件）]"]
+        for _depth, name, self_us, cumulative_us in sorted(
+            imports, key=lambda entry: entry[2], reverse=True
+        )[:TOP_IMPORTS]:
+            lines.append(
+                f"{self_us / 1000:10.1f} ms  (累計 {cumulative_us / 1000:8.1f} ms)  {name}"
+            )
+        top_level_us = sum(entry[3] for entry in imports if entry[0] == 0)
+        lines += [
+            f"合計: {top_level_us / 1000:.1f} ms（{len(imports)} モジュール）",
+            "",
+            "[importtime]",
+            "import time: self [us] | cumulative | imported package",
+        ]
+        lines += [
+            f"import time: {self_us:>9} | {cumulative_us:>10} | {'  ' * depth}{name}"
+            for depth, name, self_us, cumulative_us in imports
+        ]
+        try:
+            with open(self.report_path, "w", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+        except OSError as ex:
+            print(f"警告: 起動プロファイルの書き込みに失敗しました: {ex}")
+
+
+def enable_from_env():
+    """環境変数で指定されていればプロファイラを有効にして返す（無効なら None）"""
+    global _profiler
+    value = os.environ.get(PROFILE_ENV)
+    if not value or _profiler is not None:
+        return _profiler
+    _profiler = StartupProfiler(DEFAULT_REPORT_PATH if value == "1" else value)
+    _profiler.install()
+    return _profiler
+
+
+def mark(label):
+    """プロファイラが有効な場合だけ、節目の時刻を記録する"""
+    if _profiler is not None:
+        _profiler.mark(label)
+
+
+def finish(label):
+    """最後の節目を記録して import のフックを外す"""
+    if _profiler is not None:
+        _profiler.mark(label)
+        _profiler.uninstall()